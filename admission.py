@@ -0,0 +1,264 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import streamlit as st
+
+from metrics import observe
+from shared import REPLICAS
+
+# Limits for OpenAI calls, overridable with the ADMISSION secret, e.g.
+# ADMISSION = { global_rpm = 500, user_rpm = 10, model_concurrency = { "gpt-image-1" = 2 } }
+# Calls over a limit wait in a queue that serves users round-robin, so one
+# user's burst delays that user instead of everyone.
+DEFAULT_LIMITS = {
+    "global_rpm": 300,  # requests per minute for the whole process
+    "global_burst": 20,
+    "user_rpm": 20,  # requests per minute for one user
+    "user_burst": 4,
+    "model_concurrency": {},  # {model: calls in flight}, others use default_concurrency
+    "default_concurrency": 16,
+    "max_wait_s": 300,
+}
+# Longest a waiter sleeps before re-checking the limits and its queue position
+POLL_S = 0.5
+
+
+class AdmissionTimeout(Exception):
+    """A call waited longer than max_wait_s for a slot."""
+
+
+class TokenBucket:
+    """`rate_per_min` tokens per minute, holding at most `burst`."""
+
+    def __init__(self, rate_per_min: float, burst: float):
+        self.rate = rate_per_min / 60
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= 1
+
+    def take(self):
+        self.tokens -= 1
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until the next token is available."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class _Waiter:
+    __slots__ = ("user_id", "model", "admitted")
+
+    def __init__(self, user_id: str, model: str):
+        self.user_id = user_id
+        self.model = model
+        self.admitted = False
+
+
+class AdmissionController:
+    def __init__(self, limits: dict):
+        self.limits = limits
+        self._cond = threading.Condition()
+        self._global = TokenBucket(limits["global_rpm"], limits["global_burst"])
+        self._users: dict[str, TokenBucket] = {}
+        self._queues: dict[str, deque[_Waiter]] = {}
+        # Users with queued calls, in the order they will next be served
+        self._rotation: deque[str] = deque()
+        self._in_flight: dict[str, int] = {}
+
+    def _concurrency(self, model: str) -> int:
+        return self.limits["model_concurrency"].get(
+            model, self.limits["default_concurrency"]
+        )
+
+    def _user_bucket(self, user_id: str) -> TokenBucket:
+        bucket = self._users.get(user_id)
+        if bucket is None:
+            bucket = self._users[user_id] = TokenBucket(
+                self.limits["user_rpm"], self.limits["user_burst"]
+            )
+        return bucket
+
+    def _dispatch(self) -> float:
+        """
+        Admit queued calls round-robin across users while the limits allow.
+        Return how long until a token frees up for a still-blocked call.
+        """
+        now = time.monotonic()
+        retry_in = POLL_S
+        progress, admitted = True, False
+        while progress and self._rotation:
+            progress = False
+            for user_id in list(self._rotation):
+                waiter = self._queues[user_id][0]
+                bucket = self._user_bucket(user_id)
+                if self._in_flight.get(waiter.model, 0) >= self._concurrency(
+                    waiter.model
+                ):
+                    continue  # admitted when a call to that model finishes
+                if not bucket.ready(now):
+                    retry_in = min(retry_in, bucket.wait_time(now))
+                    continue
+                if not self._global.ready(now):
+                    retry_in = min(retry_in, self._global.wait_time(now))
+                    progress = False
+                    break
+                bucket.take()
+                self._global.take()
+                self._in_flight[waiter.model] = self._in_flight.get(waiter.model, 0) + 1
+                waiter.admitted = True
+                queue = self._queues[user_id]
+                queue.popleft()
+                # Served users go to the back of the line
+                self._rotation.remove(user_id)
+                if queue:
+                    self._rotation.append(user_id)
+                else:
+                    del self._queues[user_id]
+                progress = admitted = True
+        if admitted:
+            self._cond.notify_all()
+        return retry_in
+
+    def _position(self, waiter: _Waiter) -> int:
+        """Calls that will be admitted before this one, given round-robin order."""
+        queue = self._queues[waiter.user_id]
+        rank = queue.index(waiter)
+        ahead = rank
+        for index, user_id in enumerate(self._rotation):
+            if user_id == waiter.user_id:
+                continue
+            # Users earlier in the rotation are served once more in our last round
+            rounds = rank + 1 if index < self._rotation.index(waiter.user_id) else rank
+            ahead += min(len(self._queues[user_id]), rounds)
+        return ahead
+
+    def _forget_idle_users(self, now: float):
+        # A full bucket is the same as a new one, so it need not be kept
+        for user_id in [u for u, b in self._users.items() if b.full(now)]:
+            if user_id not in self._queues:
+                del self._users[user_id]
+
+    @contextmanager
+    def admit(self, user_id: str, model: str):
+        """Hold a slot for one call to `model` on behalf of `user_id`, queueing if needed."""
+        waiter = _Waiter(user_id, model)
+        started = time.monotonic()
+        listener = _queue_listener.get()
+        with self._cond:
+            if user_id not in self._queues:
+                self._queues[user_id] = deque()
+                self._rotation.append(user_id)
+            self._queues[user_id].append(waiter)
+            retry_in = self._dispatch()
+            shown = None
+            while not waiter.admitted:
+                if time.monotonic() - started > self.limits["max_wait_s"]:
+                    self._queues[user_id].remove(waiter)
+                    if not self._queues[user_id]:
+                        del self._queues[user_id]
+                        self._rotation.remove(user_id)
+                    observe("ai.queue_wait", time.monotonic() - started, "timeout")
+                    raise AdmissionTimeout(
+                        f"no slot for {model} after {self.limits['max_wait_s']}s"
+                    )
+                position = self._position(waiter)
+                if listener and position != shown:
+                    shown = position
+                    listener(position)
+                self._cond.wait(max(retry_in, 0.01))
+                retry_in = self._dispatch()
+        waited = time.monotonic() - started
+        observe("ai.queue_wait", waited)
+        if listener and shown is not None:
+            listener(None)
+        try:
+            yield waited
+        finally:
+            with self._cond:
+                self._in_flight[model] -= 1
+                self._dispatch()
+                self._forget_idle_users(time.monotonic())
+
+    def stats(self) -> dict:
+        """Current queue lengths per user and calls in flight per model."""
+        with self._cond:
+            return {
+                "queued": {user: len(q) for user, q in self._queues.items()},
+                "in_flight": {m: n for m, n in self._in_flight.items() if n},
+            }
+
+
+_queue_listener: ContextVar = ContextVar("queue_listener", default=None)
+_controller: AdmissionController | None = None
+_controller_lock = threading.Lock()
+
+
+def _limits(**overrides) -> dict:
+    limits = dict(DEFAULT_LIMITS)
+    limits.update(st.secrets.get("ADMISSION", {}))
+    # Process-wide limits are for the whole deployment; each replica takes its
+    # share. Per-user limits stay whole, as a session lives in one process.
+    limits["global_rpm"] = limits["global_rpm"] / REPLICAS
+    limits["global_burst"] = max(1, limits["global_burst"] / REPLICAS)
+    limits["default_concurrency"] = max(1, limits["default_concurrency"] // REPLICAS)
+    limits["model_concurrency"] = {
+        model: max(1, n // REPLICAS) for model, n in limits["model_concurrency"].items()
+    }
+    limits.update(overrides)
+    return limits
+
+
+def get_controller() -> AdmissionController:
+    """Return the process-wide controller, built from the ADMISSION secret on first use."""
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController(_limits())
+    return _controller
+
+
+def configure(**overrides) -> AdmissionController:
+    """Replace the process-wide controller, e.g. to give a batch job its own limits."""
+    global _controller
+    with _controller_lock:
+        _controller = AdmissionController(_limits(**overrides))
+    return _controller
+
+
+def admit(user_id: str, model: str):
+    """Context manager holding an admission slot for one OpenAI call."""
+    return get_controller().admit(user_id, model)
+
+
+def current_queue_listener():
+    """The listener installed by the innermost queue_status() block, if any."""
+    return _queue_listener.get()
+
+
+@contextmanager
+def queue_status(listener):
+    """
+    Call listener(position) while a call made in this block waits in the queue,
+    and listener(None) once it is admitted.
+    """
+    token = _queue_listener.set(listener)
+    try:
+        yield
+    finally:
+        _queue_listener.reset(token)
@@ -0,0 +1,53 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+import admission
+import db
+import image_generation
+
+# Awaitable versions of the storage and AI calls a chat turn makes, so a turn
+# can overlap independent steps, e.g. saving the prompt while the model thinks.
+# SQLite work runs on a small pool (db.py serializes it on one connection
+# anyway); AI calls get their own pool so a slow upstream never holds up a
+# write. Calls keep the caller's context variables (trace id, snapshot reads),
+# and queue position updates are handed back to the event loop, so the UI is
+# only ever touched from the script thread that runs it.
+DB_WORKERS = 2
+AI_WORKERS = 16
+
+_db_pool = ThreadPoolExecutor(DB_WORKERS, thread_name_prefix="db-io")
+_ai_pool = ThreadPoolExecutor(AI_WORKERS, thread_name_prefix="ai-io")
+
+
+def _with_queue_listener(listener, call):
+    with admission.queue_status(listener):
+        return call()
+
+
+def _offload(pool: ThreadPoolExecutor, fn):
+    """Wrap a blocking function as a coroutine function running it on `pool`."""
+
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        call = partial(fn, *args, **kwargs)
+        listener = admission.current_queue_listener()
+        if listener is not None:
+            # Queue updates are raised on the worker; run the listener on the loop
+            forward = partial(loop.call_soon_threadsafe, listener)
+            call = partial(_with_queue_listener, forward, call)
+
+        return await loop.run_in_executor(pool, contextvars.copy_context().run, call)
+
+    return wrapper
+
+
+save_message = _offload(_db_pool, db.save_message)
+load_messages = _offload(_db_pool, db.load_messages)
+get_session_thread = _offload(_db_pool, db.get_session_thread)
+get_session_history = _offload(_db_pool, db.get_session_history)
+
+send_to_ai = _offload(_ai_pool, image_generation.send_to_ai)
+generate_image = _offload(_ai_pool, image_generation.generate_image)
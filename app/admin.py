@@ -5,9 +5,11 @@ import plotly.graph_objects as go
 
 from datetime import datetime
 from db import (
-    get_all_users_with_chats,
+    get_users_page,
     get_user_chat_sessions,
     load_messages,
+    load_messages_page,
+    get_message_id_at,
     # User-specific analytics functions
     get_user_total_images_created,
     get_user_images_created_over_time,
@@ -20,25 +22,37 @@ from db import (
     get_user_total_sessions,
     get_user_last_activity,
     export_user_chat_data,
+    # Global aggregates
+    get_aggregates_refreshed_at,
+    get_global_totals,
+    get_global_daily_stats,
+    get_global_hourly_heatmap,
+    get_top_users,
+    # API usage metering
+    get_usage_by_day,
+    get_usage_by_user,
+    # Image storage
+    get_image_storage_totals,
+    get_image_storage_by_user,
+    # Snapshot replica
+    snapshot_reads,
+    refresh_snapshot,
+    get_snapshot_taken_at,
 )
 
+from image_server import image_url
+from metering import estimate_cost, flush as flush_metering
+import admission
+import resilience
+import profiling
+import maintenance
+import archive
+
+from contextlib import nullcontext
 from io import BytesIO
 from PIL import Image as PILImage
 import os
-from reportlab.lib.pagesizes import A4
-from reportlab.platypus import (
-    SimpleDocTemplate,
-    Paragraph,
-    Spacer,
-    PageBreak,
-    Table,
-    TableStyle,
-    Image,
-)
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
-from reportlab.lib import colors
-from reportlab.lib.enums import TA_CENTER
 
 
 def process_local_image(
@@ -86,6 +100,21 @@ def process_local_image(
 
 def generate_chat_pdf(user_id: str) -> BytesIO:
     """Generate a PDF report of all chat sessions for a user."""
+    # Imported here: reportlab is only needed when an export is requested
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import (
+        SimpleDocTemplate,
+        Paragraph,
+        Spacer,
+        PageBreak,
+        Table,
+        TableStyle,
+        Image,
+    )
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib import colors
+    from reportlab.lib.enums import TA_CENTER
+
     buffer = BytesIO()
     doc = SimpleDocTemplate(
         buffer,
@@ -290,416 +319,1009 @@ def generate_chat_pdf(user_id: str) -> BytesIO:
     return buffer
 
 
-def show_admin_portal():
-    # Check if current user is admin
-    def is_admin(user_email: str) -> bool:
-        """Check if the current user is an admin based on email."""
-        admin_emails = st.secrets.get("admin_emails", [])
-        return user_email in admin_emails
+USER_SORT_OPTIONS = {
+    "Most recent activity": ("last_activity", True),
+    "Most messages": ("message_count", True),
+    "Email (A-Z)": ("email", False),
+}
 
-    # Admin authentication check
-    user = st.experimental_user
-    if not user.is_logged_in:
-        st.error("Please log in to access the admin portal.")
-        st.stop()
 
-    user_email = user["email"]
-    if not is_admin(user_email):
-        st.error("Access denied. You don't have admin privileges.")
-        st.stop()
+def user_directory_page(
+    key: str, page_size: int = 25
+) -> tuple[list[tuple[str, int, str]], int]:
+    """Render search, sort and pager controls; return the current page of users and the match count."""
+    col_search, col_sort, col_page = st.columns([3, 2, 1])
+    with col_search:
+        search_prefix = st.text_input(
+            "🔍 Search users by email:",
+            placeholder="Start of user email...",
+            key=f"{key}_search",
+        )
+    with col_sort:
+        sort_label = st.selectbox(
+            "Sort by", options=list(USER_SORT_OPTIONS), key=f"{key}_sort"
+        )
+    sort_by, descending = USER_SORT_OPTIONS[sort_label]
 
-    st.set_page_config(
-        page_title="Admin Portal - Origami AI",
-        page_icon="🔐",
-        layout="wide",
+    # Clamp the stored page before the pager is drawn, a new search can shrink it
+    page_key = f"{key}_page"
+    page = st.session_state.get(page_key, 1)
+    users, total = get_users_page(
+        search_prefix, sort_by, descending, page - 1, page_size
     )
+    page_count = max(1, -(-total // page_size))
+    if page > page_count:
+        page = page_count
+        st.session_state[page_key] = page
+        users, total = get_users_page(
+            search_prefix, sort_by, descending, page - 1, page_size
+        )
 
-    # Sidebar with navigation
-    with st.sidebar:
-        st.logo(image="static/origami_icon.png", size="large")
-        st.subheader("Admin Panel")
-        st.text(f"Logged in as: {user_email}")
-
-        if st.button("🏠 Back to App", use_container_width=True, type="primary"):
-            st.query_params = {}
-            st.rerun()
-
-        if st.button("Logout", icon=":material/logout:", use_container_width=True):
-            st.logout()
+    with col_page:
+        st.number_input(
+            f"Page (of {page_count})",
+            min_value=1,
+            max_value=page_count,
+            step=1,
+            key=page_key,
+        )
+    return users, total
 
-    st.title("Admin Portal", anchor=False)
-    st.caption(f"Welcome, {user_email}")
 
-    # Create tabs for different admin functions
-    tab1, tab2 = st.tabs(["📊 Analytics Dashboard", "💬 User Chat Histories"])
+WEEKDAY_LABELS = ["Sun", "Mon", "Tue", "Wed", "Thu", "Fri", "Sat"]
 
-    with tab1:
-        st.header("📈 User-Specific Analytics Dashboard")
 
-        # Get all users with chat data for the selector
-        users_with_chats = get_all_users_with_chats()
+def show_global_analytics():
+    """Fleet-wide dashboard drawn only from the precomputed aggregate tables."""
+    st.header("🌍 Global Analytics Dashboard")
 
-        if not users_with_chats:
-            st.error("No users with chat data found.")
-            return
+    col_range, col_refresh = st.columns([3, 1])
+    with col_range:
+        days = st.select_slider(
+            "Time range (days)",
+            options=[7, 30, 90, 180, 365],
+            value=90,
+            key="global_analytics_days",
+        )
+    with col_refresh:
+        # The maintenance scheduler folds new messages every few minutes; this
+        # runs the same bounded task now
+        if (
+            st.button("🔄 Refresh now", use_container_width=True)
+            and maintenance.run_maintenance(["aggregates"]) is None
+        ):
+            st.info("Maintenance is already running; try again shortly.")
+    st.caption(f"Aggregates last refreshed: {get_aggregates_refreshed_at()} UTC")
+
+    daily_stats = get_global_daily_stats(days)
+    total_messages, total_images, total_users = get_global_totals()
+
+    # === KPI METRICS ===
+    col1, col2, col3, col4, col5 = st.columns(5)
+    latest = daily_stats[-1] if daily_stats else None
+    with col1:
+        st.metric("👥 Total Users", f"{total_users:,}")
+    with col2:
+        st.metric("💬 Total Messages", f"{total_messages:,}")
+    with col3:
+        st.metric("🎨 Total Images", f"{total_images:,}")
+    with col4:
+        st.metric("📅 DAU (latest day)", f"{latest[4]:,}" if latest else "0")
+    with col5:
+        st.metric("🗓️ WAU (latest day)", f"{latest[5]:,}" if latest else "0")
+
+    if not daily_stats:
+        st.info("No activity in the selected time range.")
+        return
+
+    dates, messages, user_messages, images, dau, wau = zip(*daily_stats)
+
+    # === ACTIVE USERS & VOLUME ===
+    col1, col2 = st.columns(2)
+    with col1:
+        fig_active = go.Figure()
+        fig_active.add_trace(
+            go.Scatter(
+                x=dates, y=dau, mode="lines", name="DAU", line=dict(color="#174C4F")
+            )
+        )
+        fig_active.add_trace(
+            go.Scatter(
+                x=dates, y=wau, mode="lines", name="WAU", line=dict(color="#F0EB4E")
+            )
+        )
+        fig_active.update_layout(
+            title="Daily and Weekly Active Users",
+            xaxis_title="Date",
+            yaxis_title="Users",
+            height=400,
+        )
+        st.plotly_chart(fig_active, use_container_width=True)
 
-        # User selector
-        user_options = [
-            (user_id, f"{user_id} ({msg_count} msgs)")
-            for user_id, msg_count, _ in users_with_chats
-        ]
-        selected_user_display = st.selectbox(
-            "🔍 Select user to analyze:",
-            options=[display for _, display in user_options],
-            key="analytics_user_selector",
+    with col2:
+        fig_volume = go.Figure()
+        fig_volume.add_trace(
+            go.Bar(x=dates, y=messages, name="Messages", marker_color="#174C4F")
+        )
+        fig_volume.add_trace(
+            go.Bar(x=dates, y=images, name="Images", marker_color="#F0EB4E")
+        )
+        fig_volume.update_layout(
+            title="Messages and Images per Day",
+            xaxis_title="Date",
+            yaxis_title="Count",
+            barmode="group",
+            height=400,
+        )
+        st.plotly_chart(fig_volume, use_container_width=True)
+
+    # === LOAD HEATMAP & TOP USERS ===
+    col1, col2 = st.columns(2)
+    with col1:
+        st.subheader("🕐 Hourly Load (UTC)")
+        grid = [[0] * 24 for _ in WEEKDAY_LABELS]
+        for weekday, hour, count in get_global_hourly_heatmap(days):
+            grid[weekday][hour] = count
+        fig_heatmap = go.Figure(
+            go.Heatmap(
+                z=grid,
+                x=list(range(24)),
+                y=WEEKDAY_LABELS,
+                colorscale=[[0, "#FFFFFF"], [1, "#174C4F"]],
+            )
         )
+        fig_heatmap.update_layout(
+            xaxis_title="Hour of Day",
+            height=400,
+            xaxis=dict(tickmode="linear", tick0=0, dtick=1),
+        )
+        st.plotly_chart(fig_heatmap, use_container_width=True)
 
-        # Get the actual user_id from the selection
-        selected_user = None
-        for user_id, display in user_options:
-            if display == selected_user_display:
-                selected_user = user_id
-                break
+    with col2:
+        st.subheader("🏆 Top Users")
+        rank_by = st.radio(
+            "Rank by", ["images", "messages"], horizontal=True, key="top_users_by"
+        )
+        top_users = get_top_users(10, rank_by)
+        st.dataframe(
+            [
+                {"User": user_id, "Messages": msg_count, "Images": image_count}
+                for user_id, msg_count, image_count in top_users
+            ],
+            use_container_width=True,
+            hide_index=True,
+        )
 
-        if not selected_user:
-            st.error("Please select a valid user.")
-            return
 
-        st.info(f"📊 Showing analytics for: **{selected_user}**")
-        st.divider()
+def show_usage_and_cost():
+    """Cost and latency per day and per user, read from the daily usage rollup."""
+    st.header("💰 API Usage & Cost")
+    flush_metering()  # include this process's calls that are still buffered
 
-        # === KPI METRICS ===
-        col1, col2, col3, col4 = st.columns(4)
+    pricing = st.secrets.get("MODEL_PRICING", {})
+    if not pricing:
+        st.caption(
+            "Add a MODEL_PRICING table to secrets to see costs; they show as $0 until then."
+        )
+    live = admission.get_controller().stats()
+    in_flight = ", ".join(f"{m}: {n}" for m, n in live["in_flight"].items()) or "none"
+    st.caption(
+        f"Right now: {sum(live['queued'].values())} call(s) queued for "
+        f"{len(live['queued'])} user(s); in flight: {in_flight}"
+    )
+    for upstream, state in resilience.breaker_states().items():
+        if state != "closed":
+            st.warning(f"Circuit breaker for {upstream} is {state}: calls fail fast.")
+    days = st.select_slider(
+        "Time range (days)", options=[7, 30, 90, 180, 365], value=30, key="usage_days"
+    )
 
-        total_images = get_user_total_images_created(selected_user)
-        total_messages = get_user_total_messages(selected_user)
-        total_sessions = get_user_total_sessions(selected_user)
-        last_activity = get_user_last_activity(selected_user)
+    daily = [
+        {
+            "Date": day,
+            "Model": model,
+            "Calls": calls,
+            "Errors": errors,
+            "Cost ($)": estimate_cost(pricing, model, tokens_in, tokens_out, images),
+            "Avg latency (s)": total_ms / calls / 1000 if calls else 0,
+        }
+        for (
+            day,
+            model,
+            calls,
+            errors,
+            tokens_in,
+            tokens_out,
+            images,
+            total_ms,
+        ) in get_usage_by_day(days)
+    ]
+    if not daily:
+        st.info("No API calls recorded in the selected time range.")
+        return
+
+    # === KPI METRICS ===
+    total_calls = sum(row["Calls"] for row in daily)
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("📡 API Calls", f"{total_calls:,}")
+    with col2:
+        st.metric("💵 Estimated Cost", f"${sum(row['Cost ($)'] for row in daily):,.2f}")
+    with col3:
+        st.metric(
+            "⚠️ Error Rate",
+            f"{sum(row['Errors'] for row in daily) / total_calls:.1%}",
+        )
 
-        with col1:
-            st.metric("🎨 Images Created", f"{total_images:,}")
-        with col2:
-            st.metric("💬 Total Messages", f"{total_messages:,}")
-        with col3:
-            st.metric("📱 Total Sessions", f"{total_sessions:,}")
-        with col4:
-            try:
-                if last_activity != "Never":
-                    activity_date = datetime.strptime(
-                        last_activity, "%Y-%m-%d %H:%M:%S"
-                    )
-                    formatted_date = activity_date.strftime("%m/%d/%Y")
-                else:
-                    formatted_date = "Never"
-            except:
-                formatted_date = "Unknown"
-            st.metric("📅 Last Active", formatted_date)
+    # === COST & LATENCY PER DAY ===
+    col1, col2 = st.columns(2)
+    with col1:
+        fig_cost = px.bar(
+            daily, x="Date", y="Cost ($)", color="Model", title="Estimated Cost per Day"
+        )
+        fig_cost.update_layout(height=400)
+        st.plotly_chart(fig_cost, use_container_width=True)
+    with col2:
+        fig_latency = px.line(
+            daily,
+            x="Date",
+            y="Avg latency (s)",
+            color="Model",
+            markers=True,
+            title="Average Call Latency per Day",
+        )
+        fig_latency.update_layout(height=400)
+        st.plotly_chart(fig_latency, use_container_width=True)
+
+    # === PER USER ===
+    st.subheader("👤 Cost and Latency per User")
+    per_user = [
+        {
+            "User": user_id,
+            "Model": model,
+            "Calls": calls,
+            "Errors": errors,
+            "Input tokens": tokens_in,
+            "Output tokens": tokens_out,
+            "Images": images,
+            "Cost ($)": round(
+                estimate_cost(pricing, model, tokens_in, tokens_out, images), 4
+            ),
+            "Avg latency (s)": round(total_ms / calls / 1000, 2) if calls else 0,
+            "Max latency (s)": round(max_ms / 1000, 2),
+        }
+        for (
+            user_id,
+            model,
+            calls,
+            errors,
+            tokens_in,
+            tokens_out,
+            images,
+            total_ms,
+            max_ms,
+        ) in get_usage_by_user(days)
+    ]
+    per_user.sort(key=lambda row: row["Cost ($)"], reverse=True)
+    st.dataframe(per_user, use_container_width=True, hide_index=True)
 
-        st.divider()
 
-        # === USER ENGAGEMENT ANALYSIS ===
-        st.subheader("🎯 User Engagement Analysis")
+def show_user_analytics():
+    """Activity, image and session charts for one user picked from the directory."""
+    st.header("📈 User-Specific Analytics Dashboard")
 
-        # Calculate engagement metrics
-        avg_messages_per_session = (
-            total_messages / total_sessions if total_sessions > 0 else 0
-        )
+    # Only the current page of the user directory feeds the selector
+    users_page, total_users = user_directory_page("analytics_users", page_size=50)
 
-        # Get session lengths to calculate engagement depth
-        session_stats = get_user_session_length_stats(selected_user)
-        if session_stats:
-            _, msg_counts, durations = zip(*session_stats)
-            avg_session_duration = sum(durations) / len(durations)
-            total_duration = sum(durations)
+    if not total_users:
+        if st.session_state.get("analytics_users_search"):
+            st.warning("No users found matching your search.")
         else:
-            avg_session_duration = 0
-            total_duration = 0
+            st.error("No users with chat data found.")
+        return
 
-        # Get daily activity to calculate consistency
-        daily_activity = get_user_activity_over_time(selected_user)
-        active_days = len(daily_activity) if daily_activity else 0
+    # User selector
+    user_options = [
+        (user_id, f"{user_id} ({msg_count} msgs)")
+        for user_id, msg_count, _ in users_page
+    ]
+    selected_user_display = st.selectbox(
+        "🔍 Select user to analyze:",
+        options=[display for _, display in user_options],
+        key="analytics_user_selector",
+    )
 
-        # Format total duration for display
-        if total_duration >= 60:
-            duration_display = f"{total_duration / 60:.1f} hrs"
-        else:
-            duration_display = f"{total_duration} min"
+    # Get the actual user_id from the selection
+    selected_user = None
+    for user_id, display in user_options:
+        if display == selected_user_display:
+            selected_user = user_id
+            break
+
+    if not selected_user:
+        st.error("Please select a valid user.")
+        return
+
+    st.info(f"📊 Showing analytics for: **{selected_user}**")
+    st.divider()
+
+    # === KPI METRICS ===
+    col1, col2, col3, col4 = st.columns(4)
+
+    total_images = get_user_total_images_created(selected_user)
+    total_messages = get_user_total_messages(selected_user)
+    total_sessions = get_user_total_sessions(selected_user)
+    last_activity = get_user_last_activity(selected_user)
+
+    with col1:
+        st.metric("🎨 Images Created", f"{total_images:,}")
+    with col2:
+        st.metric("💬 Total Messages", f"{total_messages:,}")
+    with col3:
+        st.metric("📱 Total Sessions", f"{total_sessions:,}")
+    with col4:
+        try:
+            if last_activity != "Never":
+                activity_date = datetime.strptime(
+                    last_activity, "%Y-%m-%d %H:%M:%S"
+                )
+                formatted_date = activity_date.strftime("%m/%d/%Y")
+            else:
+                formatted_date = "Never"
+        except:
+            formatted_date = "Unknown"
+        st.metric("📅 Last Active", formatted_date)
 
-        col1, col2, col3, col4 = st.columns(4)
+    st.divider()
 
-        with col1:
-            st.metric("📊 Avg Msgs/Session", f"{avg_messages_per_session:.1f}")
-        with col2:
-            st.metric("⏱️ Avg Session Duration", f"{avg_session_duration:.1f} min")
-        with col3:
-            st.metric("📅 Active Days", f"{active_days}")
-        with col4:
-            st.metric("⏰ Total Duration", duration_display)
+    # === USER ENGAGEMENT ANALYSIS ===
+    st.subheader("🎯 User Engagement Analysis")
 
-        # Engagement depth chart
-        col1, col2 = st.columns(2)
+    # Calculate engagement metrics
+    avg_messages_per_session = (
+        total_messages / total_sessions if total_sessions > 0 else 0
+    )
 
-        with col1:
-            st.write("**Engagement Intensity**")
-            if daily_activity:
-                dates, daily_counts = zip(*daily_activity)
-                avg_daily_messages = sum(daily_counts) / len(daily_counts)
-
-                # Categorize engagement levels
-                high_engagement_days = len(
-                    [c for c in daily_counts if c >= avg_daily_messages * 1.5]
-                )
-                medium_engagement_days = len(
-                    [
-                        c
-                        for c in daily_counts
-                        if avg_daily_messages <= c < avg_daily_messages * 1.5
-                    ]
-                )
-                low_engagement_days = len(
-                    [c for c in daily_counts if c < avg_daily_messages]
-                )
+    # Get session lengths to calculate engagement depth
+    session_stats = get_user_session_length_stats(selected_user)
+    if session_stats:
+        _, msg_counts, durations = zip(*session_stats)
+        avg_session_duration = sum(durations) / len(durations)
+        total_duration = sum(durations)
+    else:
+        avg_session_duration = 0
+        total_duration = 0
 
-                engagement_data = [
-                    high_engagement_days,
-                    medium_engagement_days,
-                    low_engagement_days,
-                ]
-                engagement_labels = [
-                    f"High Activity (≥{avg_daily_messages * 1.5:.1f} msgs/day)",
-                    f"Medium Activity ({avg_daily_messages:.1f}-{avg_daily_messages * 1.5:.1f} msgs/day)",
-                    f"Low Activity (<{avg_daily_messages:.1f} msgs/day)",
-                ]
+    # Get daily activity to calculate consistency
+    daily_activity = get_user_activity_over_time(selected_user)
+    active_days = len(daily_activity) if daily_activity else 0
 
-                if sum(engagement_data) > 0:
-                    fig_engagement = px.pie(
-                        values=engagement_data,
-                        names=engagement_labels,
-                        title="Daily Engagement Distribution",
-                        color_discrete_sequence=["#174C4F", "#F0EB4E", "#CCCCCC"],
-                    )
-                    fig_engagement.update_layout(height=300)
-                    st.plotly_chart(fig_engagement, use_container_width=True)
-                else:
-                    st.info("No engagement data available.")
-            else:
-                st.info("No daily activity data available.")
-
-        with col2:
-            st.write("**Session Length Distribution**")
-            if session_stats and len(session_stats) > 1:
-                _, msg_counts, durations = zip(*session_stats)
-
-                # Create session length categories
-                short_sessions = len([c for c in msg_counts if c <= 5])
-                medium_sessions = len([c for c in msg_counts if 5 < c <= 15])
-                long_sessions = len([c for c in msg_counts if c > 15])
-
-                session_data = [short_sessions, medium_sessions, long_sessions]
-                session_labels = [
-                    "Short (≤5 msgs)",
-                    "Medium (6-15 msgs)",
-                    "Long (>15 msgs)",
+    # Format total duration for display
+    if total_duration >= 60:
+        duration_display = f"{total_duration / 60:.1f} hrs"
+    else:
+        duration_display = f"{total_duration} min"
+
+    col1, col2, col3, col4 = st.columns(4)
+
+    with col1:
+        st.metric("📊 Avg Msgs/Session", f"{avg_messages_per_session:.1f}")
+    with col2:
+        st.metric("⏱️ Avg Session Duration", f"{avg_session_duration:.1f} min")
+    with col3:
+        st.metric("📅 Active Days", f"{active_days}")
+    with col4:
+        st.metric("⏰ Total Duration", duration_display)
+
+    # Engagement depth chart
+    col1, col2 = st.columns(2)
+
+    with col1:
+        st.write("**Engagement Intensity**")
+        if daily_activity:
+            dates, daily_counts = zip(*daily_activity)
+            avg_daily_messages = sum(daily_counts) / len(daily_counts)
+
+            # Categorize engagement levels
+            high_engagement_days = len(
+                [c for c in daily_counts if c >= avg_daily_messages * 1.5]
+            )
+            medium_engagement_days = len(
+                [
+                    c
+                    for c in daily_counts
+                    if avg_daily_messages <= c < avg_daily_messages * 1.5
                 ]
+            )
+            low_engagement_days = len(
+                [c for c in daily_counts if c < avg_daily_messages]
+            )
+
+            engagement_data = [
+                high_engagement_days,
+                medium_engagement_days,
+                low_engagement_days,
+            ]
+            engagement_labels = [
+                f"High Activity (≥{avg_daily_messages * 1.5:.1f} msgs/day)",
+                f"Medium Activity ({avg_daily_messages:.1f}-{avg_daily_messages * 1.5:.1f} msgs/day)",
+                f"Low Activity (<{avg_daily_messages:.1f} msgs/day)",
+            ]
 
-                fig_sessions = px.pie(
-                    values=session_data,
-                    names=session_labels,
-                    title="Session Length Categories",
-                    color_discrete_sequence=["#FFCCCB", "#F0EB4E", "#174C4F"],
+            if sum(engagement_data) > 0:
+                fig_engagement = px.pie(
+                    values=engagement_data,
+                    names=engagement_labels,
+                    title="Daily Engagement Distribution",
+                    color_discrete_sequence=["#174C4F", "#F0EB4E", "#CCCCCC"],
                 )
-                fig_sessions.update_layout(height=300)
-                st.plotly_chart(fig_sessions, use_container_width=True)
+                fig_engagement.update_layout(height=300)
+                st.plotly_chart(fig_engagement, use_container_width=True)
             else:
-                st.info("Insufficient session data for analysis.")
+                st.info("No engagement data available.")
+        else:
+            st.info("No daily activity data available.")
 
-        st.divider()
+    with col2:
+        st.write("**Session Length Distribution**")
+        if session_stats and len(session_stats) > 1:
+            _, msg_counts, durations = zip(*session_stats)
 
-        # === ACTIVITY TRENDS ===
-        st.subheader("📊 User Activity Trends")
-        col1, col2 = st.columns(2)
+            # Create session length categories
+            short_sessions = len([c for c in msg_counts if c <= 5])
+            medium_sessions = len([c for c in msg_counts if 5 < c <= 15])
+            long_sessions = len([c for c in msg_counts if c > 15])
 
-        with col1:
-            # User messages vs total activity over time
-            user_messages_data = get_user_messages_over_time(selected_user)
-            total_activity_data = get_user_activity_over_time(selected_user)
-
-            if user_messages_data and total_activity_data:
-                # Create combined chart showing user messages vs total activity
-                user_dates, user_counts = zip(*user_messages_data)
-                total_dates, total_counts = zip(*total_activity_data)
-
-                fig_activity = go.Figure()
-
-                fig_activity.add_trace(
-                    go.Scatter(
-                        x=user_dates,
-                        y=user_counts,
-                        mode="lines+markers",
-                        name="User Messages",
-                        line=dict(color="#174C4F", width=3),
-                        marker=dict(size=8, color="#174C4F"),
-                    )
+            session_data = [short_sessions, medium_sessions, long_sessions]
+            session_labels = [
+                "Short (≤5 msgs)",
+                "Medium (6-15 msgs)",
+                "Long (>15 msgs)",
+            ]
+
+            fig_sessions = px.pie(
+                values=session_data,
+                names=session_labels,
+                title="Session Length Categories",
+                color_discrete_sequence=["#FFCCCB", "#F0EB4E", "#174C4F"],
+            )
+            fig_sessions.update_layout(height=300)
+            st.plotly_chart(fig_sessions, use_container_width=True)
+        else:
+            st.info("Insufficient session data for analysis.")
+
+    st.divider()
+
+    # === ACTIVITY TRENDS ===
+    st.subheader("📊 User Activity Trends")
+    col1, col2 = st.columns(2)
+
+    with col1:
+        # User messages vs total activity over time
+        user_messages_data = get_user_messages_over_time(selected_user)
+        total_activity_data = get_user_activity_over_time(selected_user)
+
+        if user_messages_data and total_activity_data:
+            # Create combined chart showing user messages vs total activity
+            user_dates, user_counts = zip(*user_messages_data)
+            total_dates, total_counts = zip(*total_activity_data)
+
+            fig_activity = go.Figure()
+
+            fig_activity.add_trace(
+                go.Scatter(
+                    x=user_dates,
+                    y=user_counts,
+                    mode="lines+markers",
+                    name="User Messages",
+                    line=dict(color="#174C4F", width=3),
+                    marker=dict(size=8, color="#174C4F"),
                 )
+            )
 
-                fig_activity.add_trace(
-                    go.Scatter(
-                        x=total_dates,
-                        y=total_counts,
-                        mode="lines+markers",
-                        name="Total Activity",
-                        line=dict(color="#F0EB4E", width=3),
-                        marker=dict(size=8, color="#F0EB4E"),
-                    )
+            fig_activity.add_trace(
+                go.Scatter(
+                    x=total_dates,
+                    y=total_counts,
+                    mode="lines+markers",
+                    name="Total Activity",
+                    line=dict(color="#F0EB4E", width=3),
+                    marker=dict(size=8, color="#F0EB4E"),
                 )
+            )
 
-                fig_activity.update_layout(
-                    title="Daily Activity: User Messages vs Total",
-                    xaxis_title="Date",
-                    yaxis_title="Message Count",
-                    height=400,
-                    xaxis=dict(tickformat="%m/%d", tickangle=45),
+            fig_activity.update_layout(
+                title="Daily Activity: User Messages vs Total",
+                xaxis_title="Date",
+                yaxis_title="Message Count",
+                height=400,
+                xaxis=dict(tickformat="%m/%d", tickangle=45),
+            )
+            st.plotly_chart(fig_activity, use_container_width=True)
+        else:
+            st.info("No activity data available for this user.")
+
+    with col2:
+        # Images created over time
+        images_data = get_user_images_created_over_time(selected_user)
+        if images_data:
+            dates, counts = zip(*images_data)
+            fig_images = px.line(
+                x=dates,
+                y=counts,
+                labels={"x": "Date", "y": "Images Created"},
+                title="AI Images Generated Daily",
+                color_discrete_sequence=["#F0EB4E"],
+            )
+            fig_images.update_layout(height=400)
+            st.plotly_chart(fig_images, use_container_width=True)
+        else:
+            st.info("No image generation data available for this user.")
+
+    # === MESSAGE DISTRIBUTION ===
+    col1, col2 = st.columns(2)
+
+    with col1:
+        st.subheader("💬 Message Type Distribution")
+        message_dist = get_user_message_distribution(selected_user)
+        if message_dist:
+            types, counts = zip(*message_dist)
+            fig_messages = px.pie(
+                values=counts,
+                names=types,
+                title="User Activity Breakdown",
+                color_discrete_sequence=px.colors.qualitative.Set3,
+            )
+            fig_messages.update_layout(height=400)
+            st.plotly_chart(fig_messages, use_container_width=True)
+        else:
+            st.info("No message data available for this user.")
+
+    with col2:
+        st.subheader("🕐 Hourly Activity Pattern")
+        hourly_breakdown = get_user_hourly_breakdown(selected_user)
+        if hourly_breakdown:
+            hours, user_counts, ai_counts = zip(*hourly_breakdown)
+
+            fig_hourly = go.Figure()
+
+            fig_hourly.add_trace(
+                go.Bar(
+                    x=hours,
+                    y=user_counts,
+                    name="User Messages",
+                    marker_color="#174C4F",
                 )
-                st.plotly_chart(fig_activity, use_container_width=True)
-            else:
-                st.info("No activity data available for this user.")
+            )
 
-        with col2:
-            # Images created over time
-            images_data = get_user_images_created_over_time(selected_user)
-            if images_data:
-                dates, counts = zip(*images_data)
-                fig_images = px.line(
-                    x=dates,
-                    y=counts,
-                    labels={"x": "Date", "y": "Images Created"},
-                    title="AI Images Generated Daily",
-                    color_discrete_sequence=["#F0EB4E"],
+            fig_hourly.add_trace(
+                go.Bar(
+                    x=hours,
+                    y=ai_counts,
+                    name="AI Responses",
+                    marker_color="#F0EB4E",
                 )
-                fig_images.update_layout(height=400)
-                st.plotly_chart(fig_images, use_container_width=True)
-            else:
-                st.info("No image generation data available for this user.")
+            )
+
+            fig_hourly.update_layout(
+                title="Peak Usage Hours (User vs AI)",
+                xaxis_title="Hour of Day",
+                yaxis_title="Message Count",
+                barmode="stack",
+                height=400,
+                xaxis=dict(tickmode="linear", tick0=0, dtick=1),
+            )
+            st.plotly_chart(fig_hourly, use_container_width=True)
+        else:
+            st.info("No hourly activity data available for this user.")
 
-        # === MESSAGE DISTRIBUTION ===
+    # === SESSION ANALYSIS ===
+    st.subheader("📈 User Session Analysis")
+
+    session_stats = get_user_session_length_stats(selected_user)
+    if session_stats:
         col1, col2 = st.columns(2)
 
         with col1:
-            st.subheader("💬 Message Type Distribution")
-            message_dist = get_user_message_distribution(selected_user)
-            if message_dist:
-                types, counts = zip(*message_dist)
-                fig_messages = px.pie(
-                    values=counts,
-                    names=types,
-                    title="User Activity Breakdown",
-                    color_discrete_sequence=px.colors.qualitative.Set3,
-                )
-                fig_messages.update_layout(height=400)
-                st.plotly_chart(fig_messages, use_container_width=True)
-            else:
-                st.info("No message data available for this user.")
+            # Session length distribution
+            _, msg_counts, durations = zip(*session_stats)
+
+            fig_duration = px.scatter(
+                x=msg_counts,
+                y=durations,
+                labels={"x": "Messages in Session", "y": "Duration (minutes)"},
+                title="Session Duration vs Message Count",
+                color_discrete_sequence=["#174C4F"],
+            )
+            fig_duration.update_layout(height=400)
+            st.plotly_chart(fig_duration, use_container_width=True)
 
         with col2:
-            st.subheader("🕐 Hourly Activity Pattern")
-            hourly_breakdown = get_user_hourly_breakdown(selected_user)
-            if hourly_breakdown:
-                hours, user_counts, ai_counts = zip(*hourly_breakdown)
-
-                fig_hourly = go.Figure()
-
-                fig_hourly.add_trace(
-                    go.Bar(
-                        x=hours,
-                        y=user_counts,
-                        name="User Messages",
-                        marker_color="#174C4F",
-                    )
-                )
+            # Average session metrics
+            avg_duration = sum(durations) / len(durations)
+            avg_messages = sum(msg_counts) / len(msg_counts)
+            longest_session = max(msg_counts)
+            longest_duration = max(durations)
+
+            st.metric("⏱️ Avg Session Duration", f"{avg_duration:.1f} min")
+            st.metric("💬 Avg Messages per Session", f"{avg_messages:.1f}")
+            st.metric("🏆 Longest Session", f"{longest_session} messages")
+            st.metric("⏰ Max Duration", f"{longest_duration} min")
+    else:
+        st.info("No session data available for this user.")
 
-                fig_hourly.add_trace(
-                    go.Bar(
-                        x=hours,
-                        y=ai_counts,
-                        name="AI Responses",
-                        marker_color="#F0EB4E",
-                    )
-                )
 
-                fig_hourly.update_layout(
-                    title="Peak Usage Hours (User vs AI)",
-                    xaxis_title="Hour of Day",
-                    yaxis_title="Message Count",
-                    barmode="stack",
-                    height=400,
-                    xaxis=dict(tickmode="linear", tick0=0, dtick=1),
-                )
-                st.plotly_chart(fig_hourly, use_container_width=True)
-            else:
-                st.info("No hourly activity data available for this user.")
+def show_profiling(admin_email: str):
+    """Arm cProfile for a user's next reruns and browse the stored profiles."""
+    st.header("🔬 Rerun Profiling")
+    st.caption(
+        "Captures a cProfile of the chosen user's next page reruns. "
+        "Nothing is profiled unless a user is armed here."
+    )
+
+    users_page, _ = user_directory_page("profiling_users")
+    user_options = [admin_email] + [u for u, _, _ in users_page if u != admin_email]
+    col_user, col_page, col_runs, col_arm = st.columns([3, 2, 1, 1])
+    with col_user:
+        target = st.selectbox("User", user_options, key="profiling_target")
+    with col_page:
+        page = st.selectbox(
+            "Page", ["Any page", *profiling.PAGES], key="profiling_page"
+        )
+    with col_runs:
+        runs = st.number_input(
+            "Reruns", min_value=1, max_value=50, value=5, key="profiling_runs"
+        )
+    with col_arm:
+        st.write("")
+        if st.button("▶️ Arm", use_container_width=True, key="profiling_arm"):
+            profiling.arm(target, int(runs), None if page == "Any page" else page)
+
+    for user_id, state in profiling.armed().items():
+        col_state, col_disarm = st.columns([5, 1])
+        with col_state:
+            st.info(
+                f"Armed: {user_id} · {state['page'] or 'any page'} · "
+                f"{state['remaining']} rerun(s) left"
+            )
+        with col_disarm:
+            if st.button("Disarm", key=f"profiling_disarm_{user_id}"):
+                profiling.disarm(user_id)
+                st.rerun()
+
+    profiles = profiling.list_profiles()
+    if not profiles:
+        st.info("No profiles captured yet.")
+        return
+
+    st.divider()
+    selected = st.selectbox(
+        "Profile",
+        profiles,
+        format_func=lambda p: f"{p[3]:%Y-%m-%d %H:%M:%S} UTC · {p[1]} · {p[2]}",
+        key="profiling_selected",
+    )
+    path = selected[0]
+
+    ids, labels, parents, values = profiling.call_tree(path)
+    fig_icicle = go.Figure(
+        go.Icicle(
+            ids=ids,
+            labels=labels,
+            parents=parents,
+            values=values,
+            branchvalues="total",
+            tiling=dict(orientation="v"),
+            hovertemplate="%{label}<br>%{value:.3f}s<extra></extra>",
+        )
+    )
+    fig_icicle.update_layout(
+        title="Call Tree (cumulative seconds)", height=600, margin=dict(t=40)
+    )
+    st.plotly_chart(fig_icicle, use_container_width=True)
 
-        # === SESSION ANALYSIS ===
-        st.subheader("📈 User Session Analysis")
+    sort = st.radio(
+        "Sort by",
+        ["cumulative", "own time"],
+        horizontal=True,
+        key="profiling_sort",
+    )
+    st.dataframe(
+        profiling.top_functions(path, sort=sort),
+        use_container_width=True,
+        hide_index=True,
+    )
+    with open(path, "rb") as f:
+        st.download_button(
+            "📥 Download .prof",
+            data=f.read(),
+            file_name=os.path.basename(path),
+            mime="application/octet-stream",
+        )
 
-        session_stats = get_user_session_length_stats(selected_user)
-        if session_stats:
-            col1, col2 = st.columns(2)
 
-            with col1:
-                # Session length distribution
-                _, msg_counts, durations = zip(*session_stats)
+def show_maintenance():
+    """Database size and fragmentation, last maintenance runs and manual triggers."""
+    st.header("🛠️ Database Maintenance")
+
+    stats = maintenance.database_stats()
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("🗄️ Database Size", f"{stats['db_bytes'] / 2**20:,.1f} MB")
+    with col2:
+        st.metric("📝 WAL Size", f"{stats['wal_bytes'] / 2**20:,.1f} MB")
+    with col3:
+        st.metric(
+            "🧩 Free Pages",
+            f"{stats['free_pages']:,}",
+            delta=f"{stats['fragmentation']:.1%} of file",
+            delta_color="off",
+        )
+    with col4:
+        st.metric(
+            "⚙️ Journal / Auto-vacuum",
+            f"{stats['journal_mode']} / {stats['auto_vacuum']}",
+        )
 
-                fig_duration = px.scatter(
-                    x=msg_counts,
-                    y=durations,
-                    labels={"x": "Messages in Session", "y": "Duration (minutes)"},
-                    title="Session Duration vs Message Count",
-                    color_discrete_sequence=["#174C4F"],
-                )
-                fig_duration.update_layout(height=400)
-                st.plotly_chart(fig_duration, use_container_width=True)
-
-            with col2:
-                # Average session metrics
-                avg_duration = sum(durations) / len(durations)
-                avg_messages = sum(msg_counts) / len(msg_counts)
-                longest_session = max(msg_counts)
-                longest_duration = max(durations)
-
-                st.metric("⏱️ Avg Session Duration", f"{avg_duration:.1f} min")
-                st.metric("💬 Avg Messages per Session", f"{avg_messages:.1f}")
-                st.metric("🏆 Longest Session", f"{longest_session} messages")
-                st.metric("⏰ Max Duration", f"{longest_duration} min")
+    if stats["auto_vacuum"] != "INCREMENTAL":
+        st.warning(
+            "Free pages can only be released once the database uses incremental "
+            "auto-vacuum. Converting runs one full VACUUM, which blocks chat writes "
+            "while the file is rewritten, so do it at a quiet time."
+        )
+        if st.button("Convert to incremental auto-vacuum", key="maintenance_convert"):
+            with st.spinner("Running VACUUM..."):
+                maintenance.enable_incremental_vacuum()
+            st.rerun()
+
+    archives = archive.list_archives()
+    if archives:
+        st.caption(
+            f"🗃️ {len(archives)} monthly archive database(s), "
+            f"{sum(size for _, size in archives) / 2**20:,.1f} MB, "
+            f"{archives[0][0]} to {archives[-1][0]}. Sessions idle for "
+            f"{archive.ARCHIVE_AFTER_DAYS} days are archived."
+        )
+
+    st.subheader("🖼️ Image Storage")
+    files, image_bytes, recompressed = get_image_storage_totals()
+    quota_mb = st.secrets.get("IMAGE_QUOTA_MB")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("🖼️ Image Files", f"{files:,}")
+    with col2:
+        st.metric("💾 Image Storage", f"{image_bytes / 2**20:,.1f} MB")
+    with col3:
+        st.metric("🗜️ Recompressed", f"{recompressed:,}")
+    st.dataframe(
+        [
+            {
+                "User": user_id,
+                "Files": user_files,
+                "MB": round(user_bytes / 2**20, 2),
+                "Quota used": (
+                    f"{user_bytes / (float(quota_mb) * 2**20):.0%}" if quota_mb else "-"
+                ),
+            }
+            for user_id, user_files, user_bytes in get_image_storage_by_user(20)
+        ],
+        use_container_width=True,
+        hide_index=True,
+    )
+
+    st.subheader("🕒 Last Runs")
+    runs = maintenance.last_runs()
+    rows = []
+    for task in maintenance.TASKS:
+        started_at, duration_ms, outcome, detail = runs.get(
+            task, ("-", None, "never run", "")
+        )
+        rows.append(
+            {
+                "Task": task,
+                "Started (UTC)": started_at,
+                "Duration (ms)": duration_ms,
+                "Outcome": outcome,
+                "Detail": detail,
+                "Budget (s)": maintenance.TASK_BUDGETS_S[task],
+                "Every (min)": maintenance.TASK_INTERVALS_S[task] // 60,
+            }
+        )
+    st.dataframe(rows, use_container_width=True, hide_index=True)
+
+    tasks = st.multiselect(
+        "Tasks to run",
+        list(maintenance.TASKS),
+        default=list(maintenance.TASKS),
+        key="maintenance_tasks",
+    )
+    if st.button(
+        "▶️ Run now", type="primary", key="maintenance_run", disabled=not tasks
+    ):
+        results = maintenance.run_maintenance(tasks)
+        if results is None:
+            st.info("A maintenance run is already in progress.")
         else:
-            st.info("No session data available for this user.")
+            for task, (outcome, detail) in results.items():
+                st.write(f"**{task}**: {outcome} ({detail})")
+
+
+MESSAGES_PAGE_SIZE = 20
+
+
+def show_session_messages(
+    user_id: str, session_id: str, total_messages: int, page_size: int = MESSAGES_PAGE_SIZE
+):
+    """Render one keyset page of a session, with a jump index and on-demand images."""
+    # (start position, id of the message just before it) for the current page
+    cursor_key = f"admin_msg_cursor_{session_id}"
+    jump_key = f"admin_msg_jump_{session_id}"
+    start, after_id = st.session_state.get(cursor_key, (0, 0))
+
+    def move_to(position: int, before_id: int | None = None):
+        if before_id is None:
+            before_id = (
+                get_message_id_at(user_id, session_id, position - 1) or 0
+                if position > 0
+                else 0
+            )
+        st.session_state[cursor_key] = (position, before_id)
+        st.session_state[jump_key] = position
+
+    messages = load_messages_page(user_id, session_id, after_id, page_size)
+    if not messages and start == 0:
+        st.info("No messages found in this session.")
+        return
+
+    st.write(f"**Session:** {session_id}")
+    st.write(f"**Total messages:** {total_messages}")
+
+    # Jump-to-message index: one entry per page, resolved to a cursor on demand
+    page_starts = list(range(0, max(total_messages, 1), page_size))
+    if jump_key not in st.session_state:
+        st.session_state[jump_key] = start
+    col_jump, col_prev, col_next = st.columns([3, 1, 1])
+    with col_jump:
+        st.selectbox(
+            "Jump to messages:",
+            options=page_starts,
+            format_func=lambda p: f"#{p + 1} – #{min(p + page_size, total_messages)}",
+            key=jump_key,
+            on_change=lambda: move_to(st.session_state[jump_key]),
+        )
+    with col_prev:
+        st.button(
+            "⬅️ Previous",
+            key=f"admin_msg_prev_{session_id}",
+            disabled=start == 0,
+            on_click=move_to,
+            args=(max(start - page_size, 0),),
+            use_container_width=True,
+        )
+    with col_next:
+        st.button(
+            "Next ➡️",
+            key=f"admin_msg_next_{session_id}",
+            disabled=start + page_size >= total_messages or len(messages) < page_size,
+            on_click=move_to,
+            args=(start + page_size, messages[-1]["id"] if messages else after_id),
+            use_container_width=True,
+        )
+
+    show_all_images = st.toggle(
+        "Load all images on this page", key=f"admin_msg_images_{session_id}"
+    )
+    st.divider()
+
+    for i, msg in enumerate(messages, start + 1):
+        role_emoji = "👤" if msg["role"] == "user" else "🤖"
+        role_color = "blue" if msg["role"] == "user" else "green"
+
+        with st.container():
+            st.markdown(f"**#{i} {role_emoji} {msg['role'].title()}:**")
+
+            if msg["type"] == "text":
+                st.markdown(f":{role_color}[{msg['content']}]")
+            else:
+                st.markdown(f":{role_color}[Image: {msg['content']}]")
+                # Images are only sent to the browser when asked for
+                if msg.get("url") and (
+                    show_all_images
+                    or st.checkbox("🖼️ Show image", key=f"admin_img_{msg['id']}")
+                ):
+                    st.image(
+                        image_url(msg["url"]), caption=msg["content"], width=300
+                    )
+
+            st.write("")  # Add spacing
+
+
+def admin_reads():
+    """
+    Where admin pages read from: a snapshot of chat.db at most
+    ADMIN_SNAPSHOT_MAX_AGE_S seconds old when that secret is set, else the live DB.
+    """
+    max_age = st.secrets.get("ADMIN_SNAPSHOT_MAX_AGE_S")
+    return snapshot_reads(float(max_age)) if max_age else nullcontext()
+
+
+def show_admin_portal():
+    # Check if current user is admin
+    def is_admin(user_email: str) -> bool:
+        """Check if the current user is an admin based on email."""
+        admin_emails = st.secrets.get("admin_emails", [])
+        return user_email in admin_emails
+
+    # Admin authentication check
+    user = st.experimental_user
+    if not user.is_logged_in:
+        st.error("Please log in to access the admin portal.")
+        st.stop()
+
+    user_email = user["email"]
+    if not is_admin(user_email):
+        st.error("Access denied. You don't have admin privileges.")
+        st.stop()
+
+    st.set_page_config(
+        page_title="Admin Portal - Origami AI",
+        page_icon="🔐",
+        layout="wide",
+    )
+
+    # Sidebar with navigation
+    with st.sidebar:
+        st.logo(image="static/origami_icon.png", size="large")
+        st.subheader("Admin Panel")
+        st.text(f"Logged in as: {user_email}")
+
+        if st.button("🏠 Back to App", use_container_width=True, type="primary"):
+            st.query_params = {}
+            st.rerun()
+
+        if st.button("Logout", icon=":material/logout:", use_container_width=True):
+            st.logout()
+
+        # Filled in after the tabs, once the snapshot for this run exists
+        snapshot_status = st.container()
+
+    st.title("Admin Portal", anchor=False)
+    st.caption(f"Welcome, {user_email}")
+
+    # Create tabs for different admin functions
+    tab_global, tab_usage, tab1, tab2, tab_profiling, tab_maintenance = st.tabs(
+        [
+            "🌍 Global Analytics",
+            "💰 Usage & Cost",
+            "📊 Analytics Dashboard",
+            "💬 User Chat Histories",
+            "🔬 Profiling",
+            "🛠️ Maintenance",
+        ]
+    )
+
+    with tab_global:
+        show_global_analytics()
+
+    with tab_usage:
+        show_usage_and_cost()
+
+    with tab1:
+        show_user_analytics()
 
     with tab2:
         st.subheader("User Chat Histories")
 
-        # Get all users with chat data
-        users_with_chats = get_all_users_with_chats()
+        # Search, sort and paging happen in the database; only one page is drawn
+        filtered_users, total_users = user_directory_page("history_users")
 
-        if not users_with_chats:
+        if not total_users and not st.session_state.get("history_users_search"):
             st.info("No users with chat histories found.")
         else:
-            # Search functionality
-            search_term = st.text_input(
-                "🔍 Search users by email:", placeholder="Enter user email..."
-            )
-
-            # Filter users based on search
-            filtered_users = users_with_chats
-            if search_term:
-                filtered_users = [
-                    (user_id, msg_count, last_activity)
-                    for user_id, msg_count, last_activity in users_with_chats
-                    if search_term.lower() in user_id.lower()
-                ]
-
             if not filtered_users:
                 st.warning("No users found matching your search.")
             else:
-                st.write(f"Found **{len(filtered_users)}** users with chat histories")
+                st.write(f"Found **{total_users}** users with chat histories")
 
                 # Create two columns: user list and chat display
                 col1, col2 = st.columns([1, 2])
@@ -744,21 +1366,34 @@ def show_admin_portal():
                                 # Check if user has any chat data
                                 user_sessions = get_user_chat_sessions(selected_user)
                                 if user_sessions:
-                                    # Generate PDF
-                                    pdf_buffer = generate_chat_pdf(selected_user)
-
-                                    # Generate filename with timestamp
-                                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                                    filename = f"chat_report_{selected_user.replace('@', '_at_').replace('.', '_')}_{timestamp}.pdf"
-
-                                    st.download_button(
-                                        label="📄 Download PDF",
-                                        data=pdf_buffer.getvalue(),
-                                        file_name=filename,
-                                        mime="application/pdf",
-                                        help="Download complete chat history as PDF report",
+                                    # The report reads every session and image, so it
+                                    # is only built on request, not on every rerun
+                                    pdf = st.session_state.get("chat_pdf")
+                                    if (pdf is None or pdf[0] != selected_user) and st.button(
+                                        "📄 Prepare PDF",
+                                        help="Build a PDF report of the complete chat history",
                                         use_container_width=True,
-                                    )
+                                    ):
+                                        with st.spinner("Building PDF..."):
+                                            pdf_buffer = generate_chat_pdf(selected_user)
+                                        # Generate filename with timestamp
+                                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                                        filename = f"chat_report_{selected_user.replace('@', '_at_').replace('.', '_')}_{timestamp}.pdf"
+                                        pdf = st.session_state["chat_pdf"] = (
+                                            selected_user,
+                                            pdf_buffer.getvalue(),
+                                            filename,
+                                        )
+
+                                    if pdf is not None and pdf[0] == selected_user:
+                                        st.download_button(
+                                            label="📄 Download PDF",
+                                            data=pdf[1],
+                                            file_name=pdf[2],
+                                            mime="application/pdf",
+                                            help="Download complete chat history as PDF report",
+                                            use_container_width=True,
+                                        )
                                 else:
                                     st.button(
                                         "📄 Download PDF",
@@ -777,6 +1412,7 @@ def show_admin_portal():
                         else:
                             # Session selector
                             session_options = []
+                            session_counts = {}
                             for (
                                 session_id,
                                 snippet,
@@ -797,6 +1433,7 @@ def show_admin_portal():
                                     f"{formatted_date} - {snippet} ({msg_count} msgs)"
                                 )
                                 session_options.append((session_label, session_id))
+                                session_counts[session_id] = msg_count
 
                             if session_options:
                                 selected_session_label = st.selectbox(
@@ -814,52 +1451,31 @@ def show_admin_portal():
 
                                 if selected_session_id:
                                     st.divider()
-
-                                    # Load and display messages for the selected session
-                                    messages = load_messages(
-                                        selected_user, selected_session_id
+                                    show_session_messages(
+                                        selected_user,
+                                        selected_session_id,
+                                        session_counts[selected_session_id],
                                     )
-
-                                    if not messages:
-                                        st.info("No messages found in this session.")
-                                    else:
-                                        st.write(f"**Session:** {selected_session_id}")
-                                        st.write(f"**Total messages:** {len(messages)}")
-                                        st.divider()
-
-                                        # Display messages
-                                        for i, msg in enumerate(messages):
-                                            role_emoji = (
-                                                "👤" if msg["role"] == "user" else "🤖"
-                                            )
-                                            role_color = (
-                                                "blue"
-                                                if msg["role"] == "user"
-                                                else "green"
-                                            )
-
-                                            with st.container():
-                                                st.markdown(
-                                                    f"**{role_emoji} {msg['role'].title()}:**"
-                                                )
-
-                                                if msg["type"] == "text":
-                                                    st.markdown(
-                                                        f":{role_color}[{msg['content']}]"
-                                                    )
-                                                else:
-                                                    st.markdown(
-                                                        f":{role_color}[Image: {msg['content']}]"
-                                                    )
-                                                    if msg.get("url"):
-                                                        st.image(
-                                                            msg["url"],
-                                                            caption=msg["content"],
-                                                            width=300,
-                                                        )
-
-                                                st.write("")  # Add spacing
                     else:
                         st.info(
                             "👈 Select a user from the list to view their chat history."
                         )
+
+    with tab_profiling:
+        show_profiling(user_email)
+
+    with tab_maintenance:
+        show_maintenance()
+
+    if st.secrets.get("ADMIN_SNAPSHOT_MAX_AGE_S"):
+        with snapshot_status:
+            taken_at = get_snapshot_taken_at()
+            if taken_at:
+                st.caption(
+                    f"📸 Data from a snapshot taken {taken_at:%Y-%m-%d %H:%M:%S} UTC"
+                )
+            if st.button(
+                "🔄 Refresh snapshot", use_container_width=True, key="refresh_snapshot"
+            ):
+                refresh_snapshot()
+                st.rerun()
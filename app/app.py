@@ -1,12 +1,27 @@
 import streamlit as st
-from db import new_session, load_messages, save_message, get_session_summaries
-from image_generation import send_to_ai
+from db import (
+    new_session,
+    load_messages,
+    get_session_history,
+    HISTORY_BUCKETS,
+)
+from admission import AdmissionTimeout, queue_status
+from resilience import CircuitOpen, RequestRejected, UpstreamError
+import singleflight
+import aio
+import attachments
+from image_server import image_url
+from metrics import timed
+import asyncio
 import random
 import time
-from datetime import datetime, timedelta
 import pytz
 
+# Sessions shown per history group before "Show more"
+HISTORY_PAGE_SIZE = 10
 
+
+@timed("app.show_app", new_trace=True)
 def show_app():
     st.set_page_config(
         page_title="Origami AI Studio",
@@ -21,9 +36,6 @@ def show_app():
     user = st.experimental_user
     user_id = user["email"]
 
-    if "response_id" not in st.session_state:
-        st.session_state.response_id = None
-
     # Check if current user is admin
     def is_admin(user_email: str) -> bool:
         """Check if the current user is an admin based on email."""
@@ -62,63 +74,33 @@ def show_app():
         )
         st.session_state["user_timezone"] = user_tz
 
-        # New chat button creates and prepends a fresh session
+        # New chat button starts a fresh session; it shows up in history once used
         if st.button(
             "New Chat",
             use_container_width=True,
             icon=":material/add_box:",
             type="primary",
         ):
-            new_sid = new_session(user_id)
-            # prepend so it appears first
-            st.session_state.session_summaries.insert(0, (new_sid, "New chat"))
-            st.session_state.session_id = new_sid
-            st.session_state.response_id = None
+            st.session_state.session_id = new_session(user_id)
             st.rerun()
 
         st.title("Chat History :material/history:")
 
-        # Initialize session summaries in state once
-        if "session_summaries" not in st.session_state:
-            st.session_state.session_summaries = get_session_summaries(user_id)
-
-        if not st.session_state.session_summaries:
-            new_sid = new_session(user_id)
-            # prepend so it appears first
-            st.session_state.session_summaries.insert(0, (new_sid, "New chat"))
-            st.session_state.session_id = new_sid
-            st.session_state.response_id = None
-            st.rerun()
+        # Only the first few sessions of each group are fetched, already bucketed
+        if "history_limits" not in st.session_state:
+            st.session_state.history_limits = {
+                bucket: HISTORY_PAGE_SIZE for bucket in HISTORY_BUCKETS
+            }
+        history = get_session_history(
+            user_id, st.session_state["user_timezone"], st.session_state.history_limits
+        )
 
-        # Only show sessions that have at least one message and correct tuple length
-        session_summaries = [
-            s for s in st.session_state.session_summaries if len(s) == 3
-        ]
-
-        # Ensure session_id is initialized to the first available session
-        if session_summaries and "session_id" not in st.session_state:
-            st.session_state.session_id = session_summaries[0][0]
-
-        # Group sessions
-        grouped = {"Today": [], "Last Week": [], "Previous Chats": []}
-        user_tz_obj = pytz.timezone(st.session_state["user_timezone"])
-        now_local = datetime.now(pytz.utc).astimezone(user_tz_obj).date()
-        week_ago_local = now_local - timedelta(days=7)
-        for sid, snippet, ts in session_summaries:
-            # Convert UTC timestamp to user's timezone
-            utc_dt = datetime.strptime(ts, "%Y-%m-%d %H:%M:%S")
-            utc_dt = pytz.utc.localize(utc_dt)
-            local_dt = utc_dt.astimezone(user_tz_obj)
-            session_date = local_dt.date()
-            date_str = local_dt.strftime("%m/%d/%Y")
-            if session_date == now_local:
-                grouped["Today"].append((sid, snippet, date_str))
-            elif session_date > week_ago_local:
-                grouped["Last Week"].append((sid, snippet, date_str))
-            else:
-                grouped["Previous Chats"].append((sid, snippet, date_str))
+        # Ensure session_id is initialized to the most recent session, or a new one
+        if "session_id" not in st.session_state:
+            recent = [items[0][0] for items, _ in history.values() if items]
+            st.session_state.session_id = recent[0] if recent else new_session(user_id)
 
-        def render_history_group(label, items):
+        def render_history_group(label, items, has_more):
             if not items:
                 return
             st.markdown(f"**{label}**")
@@ -130,12 +112,18 @@ def show_app():
                     btn_kwargs["disabled"] = True
                 if st.button(btn_label, **btn_kwargs):
                     st.session_state.session_id = sid
-                    st.session_state.response_id = None
                     st.rerun()
+            if has_more and st.button(
+                "Show more",
+                key=f"hist_more_{label}",
+                icon=":material/expand_more:",
+                type="tertiary",
+            ):
+                st.session_state.history_limits[label] += HISTORY_PAGE_SIZE
+                st.rerun()
 
-        render_history_group("Today", grouped["Today"])
-        render_history_group("Last Week", grouped["Last Week"])
-        render_history_group("Previous Chats", grouped["Previous Chats"])
+        for bucket in HISTORY_BUCKETS:
+            render_history_group(bucket, *history[bucket])
 
     # ─── Main: display chat history for the chosen session ───────────────────────
     current_sid = st.session_state.session_id
@@ -149,17 +137,15 @@ def show_app():
             if msg["type"] == "text":
                 st.markdown(msg["content"])
             else:
-                st.image(msg["url"], caption=msg["content"])
+                st.image(image_url(msg["url"]), caption=msg["content"])
 
     # ─── Handle user input ───────────────────────────────────────────────────────
     if prompt := st.chat_input(
         "Enter your prompt...", accept_file=True, file_type=["jpg", "jpeg", "png"]
     ):
-        # Save & display user message
+        # Display user message
+        session_id = st.session_state.session_id
         user_msg = {"role": "user", "type": "text", "content": prompt.text}
-        save_message(user_id, st.session_state.session_id, user_msg)
-        # Refresh session summaries after saving a message
-        st.session_state.session_summaries = get_session_summaries(user_id)
         with st.chat_message("user", avatar="static/you_icon.png"):
             st.markdown(prompt.text)
             # Show image preview if user uploaded an image
@@ -168,18 +154,92 @@ def show_app():
                     st.image(file, caption="Uploaded image")
 
         # Call AI and stream response
-        with st.spinner(random.choice(st.secrets["spinner_messages"]), show_time=True):
-            resp = send_to_ai(
-                prompt.text,
-                user_id,
-                prompt["files"],
-                previous_response_id=st.session_state.response_id,
-            )
-
-        # Save & display AI response
-        save_message(user_id, st.session_state.session_id, resp)
-        # Refresh session summaries after saving a message
-        st.session_state.session_summaries = get_session_summaries(user_id)
+        queue_note = st.empty()
+
+        def show_queue_position(position):
+            if position is None:
+                queue_note.empty()
+            else:
+                queue_note.caption(
+                    f"Busy right now: {position} request(s) ahead of yours..."
+                )
+
+        with st.spinner(
+            random.choice(st.secrets["spinner_messages"]), show_time=True
+        ), queue_status(show_queue_position):
+
+            async def save_prompt(stored):
+                await aio.save_message(user_id, session_id, user_msg)
+                # Uploads are shown in the history like images
+                for file, attachment in zip(prompt.files, stored):
+                    await aio.save_message(
+                        user_id,
+                        session_id,
+                        {
+                            "role": "user",
+                            "type": "image",
+                            "content": file.name,
+                            "url": attachment["path"],
+                        },
+                    )
+
+            async def run_turn_async():
+                # Keep uploads once per content hash
+                stored = [attachments.store(user_id, file) for file in prompt.files]
+                # Continue the session's server-side thread, even after a reload
+                response_id, pending_tool_call = await aio.get_session_thread(
+                    user_id, session_id
+                )
+                # The prompt is saved while the model is thinking
+                saving = asyncio.ensure_future(save_prompt(stored))
+                try:
+                    resp = await aio.send_to_ai(
+                        prompt.text,
+                        user_id,
+                        stored,
+                        previous_response_id=response_id,
+                        session_id=session_id,
+                        pending_tool_call=pending_tool_call,
+                    )
+                finally:
+                    await saving
+                await aio.save_message(user_id, session_id, resp)
+                return resp
+
+            def run_turn():
+                return asyncio.run(run_turn_async())
+
+            # A repeated submission (double-click, reconnect) shares the first
+            # one's upstream call and saved messages instead of paying again
+            try:
+                resp, _ = singleflight.do(
+                    singleflight.turn_key(
+                        user_id, session_id, prompt.text, prompt["files"]
+                    ),
+                    run_turn,
+                )
+            except AdmissionTimeout:
+                queue_note.empty()
+                st.warning("Origami AI is very busy. Please try again in a minute.")
+                return
+            except CircuitOpen:
+                st.warning(
+                    "The AI service is having trouble right now. Please try again shortly."
+                )
+                return
+            except UpstreamError:
+                st.error(
+                    "The AI service could not complete that request. Please try again."
+                )
+                return
+            except RequestRejected:
+                st.error(
+                    "The AI service turned down that request. Please rephrase it "
+                    "or remove the attachment and try again."
+                )
+                return
+
+        # Display AI response
         with st.chat_message("assistant", avatar="static/ai_icon.png"):
             if resp["type"] == "text":
 
@@ -190,6 +250,4 @@ def show_app():
 
                 st.write_stream(stream_data)
             else:
-                st.image(resp["url"], caption=resp["content"])
-
-        st.session_state.response_id = resp["response_id"]
+                st.image(image_url(resp["url"]), caption=resp["content"])
@@ -0,0 +1,152 @@
+import os
+import sqlite3
+import threading
+import zlib
+
+# Cold sessions move out of chat.db into one archive database per month
+# (by the session's first message), with zlib-compressed message content.
+# They live next to chat.db unless ORIGAMI_ARCHIVE_DIR says otherwise.
+ARCHIVE_DIR = os.environ.get("ORIGAMI_ARCHIVE_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(os.environ.get("ORIGAMI_DB_PATH") or __file__)),
+    "archive",
+)
+# Sessions idle for longer than this are archived
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ORIGAMI_ARCHIVE_AFTER_DAYS", 90))
+
+_lock = threading.Lock()
+_connections: dict[str, sqlite3.Connection] = {}
+
+
+def archive_path(month: str) -> str:
+    return os.path.join(ARCHIVE_DIR, f"chat_{month}.db")
+
+
+def _connect(month: str) -> sqlite3.Connection:
+    """Open (creating if needed) the archive database for a YYYY-MM month."""
+    conn = _connections.get(month)
+    if conn is None:
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        conn = sqlite3.connect(archive_path(month), check_same_thread=False)
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS archived_messages (
+                id           INTEGER PRIMARY KEY,
+                user_id      TEXT,
+                session_id   TEXT,
+                role         TEXT,
+                type         TEXT,
+                content      BLOB,
+                url          TEXT,
+                ts           DATETIME
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_archived_session
+            ON archived_messages(user_id, session_id, id)
+            """
+        )
+        conn.commit()
+        _connections[month] = conn
+    return conn
+
+
+def _compress(content: str | None) -> bytes | None:
+    return None if content is None else zlib.compress(content.encode("utf-8"), 6)
+
+
+def _decompress(blob: bytes | None) -> str | None:
+    return None if blob is None else zlib.decompress(blob).decode("utf-8")
+
+
+def write_messages(month: str, rows: list[tuple]):
+    """
+    Store (id, user_id, session_id, role, type, content, url, ts) rows durably.
+    Rows keep their chat.db ids, so re-running an interrupted archival is harmless.
+    """
+    with _lock:
+        conn = _connect(month)
+        conn.executemany(
+            """
+            INSERT OR IGNORE INTO archived_messages(
+                id, user_id, session_id, role, type, content, url, ts
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [row[:5] + (_compress(row[5]),) + row[6:] for row in rows],
+        )
+        conn.commit()
+
+
+def read_session(
+    month: str, user_id: str, session_id: str, after_id: int = 0, limit: int = -1
+) -> list[tuple[int, str, str, str, str]]:
+    """Get (id, role, type, content, url) for an archived session, in message order."""
+    if not os.path.exists(archive_path(month)):
+        return []
+    with _lock:
+        rows = (
+            _connect(month)
+            .execute(
+                """
+                SELECT id, role, type, content, url
+                FROM archived_messages
+                WHERE user_id = ? AND session_id = ? AND id > ?
+                ORDER BY id
+                LIMIT ?
+                """,
+                (user_id, session_id, after_id, limit),
+            )
+            .fetchall()
+        )
+    return [(i, r, t, _decompress(c), u) for i, r, t, c, u in rows]
+
+
+def read_user(month: str, user_id: str) -> list[tuple[str, str, str, str, str, str]]:
+    """Get (session_id, role, type, content, url, ts) for all of a user's messages in a month."""
+    if not os.path.exists(archive_path(month)):
+        return []
+    with _lock:
+        rows = (
+            _connect(month)
+            .execute(
+                """
+                SELECT session_id, role, type, content, url, ts
+                FROM archived_messages
+                WHERE user_id = ?
+                ORDER BY id
+                """,
+                (user_id,),
+            )
+            .fetchall()
+        )
+    return [(s, r, t, _decompress(c), u, ts) for s, r, t, c, u, ts in rows]
+
+
+def list_archives() -> list[tuple[str, int]]:
+    """Get (month, file size in bytes) for every archive database."""
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    return sorted(
+        (
+            fname[len("chat_") : -len(".db")],
+            os.path.getsize(os.path.join(ARCHIVE_DIR, fname)),
+        )
+        for fname in os.listdir(ARCHIVE_DIR)
+        if fname.startswith("chat_") and fname.endswith(".db")
+    )
+
+
+def list_urls() -> set[str]:
+    """Get every image path referenced by an archived message."""
+    urls = set()
+    for month, _ in list_archives():
+        with _lock:
+            urls.update(
+                url
+                for (url,) in _connect(month).execute(
+                    "SELECT DISTINCT url FROM archived_messages WHERE url != ''"
+                )
+            )
+    return urls
@@ -0,0 +1,74 @@
+import base64
+import hashlib
+import os
+
+import db
+import image_store
+import resilience
+from admission import admit
+from image_server import IMAGES_DIR
+from metering import metered
+from shared import write_atomic
+
+# Uploaded images are written once per user and content hash next to the
+# user's generated images, and uploaded to OpenAI once; later requests that
+# include the same image send only its file id.
+EXTENSIONS = {"image/jpeg": "jpg", "image/png": "png"}
+
+
+def store(user_id: str, file) -> dict:
+    """Keep an uploaded file (a Streamlit UploadedFile); return its attachment record."""
+    data = file.getvalue()
+    sha256 = hashlib.sha256(data).hexdigest()
+    mime = file.type or "image/jpeg"
+    row = db.get_attachment(user_id, sha256)
+    if row and os.path.exists(row[0]):
+        path, mime, file_id = row
+    else:
+        folder = os.path.join(IMAGES_DIR, user_id)
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{sha256}.{EXTENSIONS.get(mime, 'jpg')}")
+        # Another replica may store the same upload at the same moment
+        write_atomic(path, data)
+        image_store.record_image(path, user_id)
+        db.save_attachment(user_id, sha256, path, mime)
+        file_id = row[2] if row else None
+    return {"sha256": sha256, "path": path, "mime": mime, "file_id": file_id}
+
+
+def _upload(client, attachment: dict, user_id: str, session_id: str | None) -> str:
+    with open(attachment["path"], "rb") as f:
+        data = f.read()
+    name = os.path.basename(attachment["path"])
+    with admit(user_id, "files"), metered(user_id, session_id, "upload", "files"):
+        uploaded = resilience.call(
+            "upload",
+            lambda timeout: client.files.create(
+                file=(name, data, attachment["mime"]), purpose="vision", timeout=timeout
+            ),
+        )
+    db.set_attachment_file_id(user_id, attachment["sha256"], uploaded.id)
+    return uploaded.id
+
+
+def input_image(
+    client, attachment: dict, user_id: str, session_id: str | None = None
+) -> dict:
+    """
+    The Responses input item for an attachment: its OpenAI file id, uploading
+    it the first time, or the image inlined when the upload fails.
+    """
+    file_id = attachment["file_id"]
+    if file_id is None:
+        try:
+            file_id = attachment["file_id"] = _upload(
+                client, attachment, user_id, session_id
+            )
+        except resilience.UpstreamError:
+            with open(attachment["path"], "rb") as f:
+                data = base64.b64encode(f.read()).decode("utf-8")
+            return {
+                "type": "input_image",
+                "image_url": f"data:{attachment['mime']};base64,{data}",
+            }
+    return {"type": "input_image", "file_id": file_id}
@@ -0,0 +1,181 @@
+"""
+Generate images for a file of prompts, outside the Streamlit app.
+
+    python batch_generate.py catalog.csv --workers 4
+    python batch_generate.py catalog.jsonl --via-chat --user catalog@origami.local
+
+Prompts come from a CSV file with a `prompt` column or a JSONL file of
+{"prompt": ...} objects (or plain strings); an optional `id` field names each
+prompt, otherwise its position does. Images go through generate_image (or,
+with --via-chat, the chat model and handle_response), into the normal image
+store, and every prompt/answer pair is saved as messages of one session of a
+service user, so the batch can be browsed like any chat.
+
+Progress is appended to a checkpoint file (default: <input>.checkpoint.jsonl)
+after every prompt. Running the same command again after a crash or Ctrl-C
+skips the prompts that already succeeded and continues the same session.
+"""
+
+import argparse
+import csv
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import admission
+import db
+from image_generation import generate_image, send_to_ai
+from metering import flush as flush_metering
+
+
+def read_prompts(path: str) -> list[tuple[str, str]]:
+    """Get (key, prompt) pairs from a CSV or JSONL prompt file."""
+    prompts = []
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    for position, row in enumerate(rows, 1):
+        if isinstance(row, str):
+            row = {"prompt": row}
+        prompt = (row.get("prompt") or "").strip()
+        if prompt:
+            prompts.append((str(row.get("id") or position), prompt))
+    return prompts
+
+
+def read_checkpoint(path: str) -> tuple[str | None, set[str]]:
+    """Get the session id and the keys already done from a checkpoint file."""
+    session_id, done = None, set()
+    if not os.path.exists(path):
+        return session_id, done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # a line cut short by a crash
+            if "session_id" in record:
+                session_id = record["session_id"]
+            elif record.get("ok"):
+                done.add(record["key"])
+    return session_id, done
+
+
+def run_prompt(prompt: str, user_id: str, session_id: str, via_chat: bool) -> dict:
+    if via_chat:
+        return send_to_ai(prompt, user_id, session_id=session_id)
+    path, revised_prompt = generate_image(prompt, user_id, session_id)
+    return {
+        "role": "assistant",
+        "type": "image",
+        "content": revised_prompt or prompt,
+        "url": path,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("input", help="CSV or JSONL file of prompts")
+    parser.add_argument("--user", default="batch@origami.local", help="service user id")
+    parser.add_argument("--workers", type=int, default=4, help="prompts in flight")
+    parser.add_argument("--checkpoint", help="progress file (default: <input>.checkpoint.jsonl)")
+    parser.add_argument(
+        "--via-chat",
+        action="store_true",
+        help="let the chat model write each image prompt, as in the app",
+    )
+    parser.add_argument(
+        "--rpm", type=float, help="requests per minute for this run (default: the global limit)"
+    )
+    args = parser.parse_args()
+
+    checkpoint_path = args.checkpoint or args.input + ".checkpoint.jsonl"
+    prompts = read_prompts(args.input)
+    session_id, done = read_checkpoint(checkpoint_path)
+    todo = [(key, prompt) for key, prompt in prompts if key not in done]
+
+    # The service user is the only user here, so it gets the whole process budget
+    limits = admission.get_controller().limits
+    rpm = args.rpm or limits["global_rpm"]
+    admission.configure(user_rpm=rpm, user_burst=args.workers, global_rpm=rpm)
+
+    db.init_db()
+    checkpoint = open(checkpoint_path, "a", encoding="utf-8")
+    if session_id is None:
+        session_id = db.new_session(args.user)
+        checkpoint.write(json.dumps({"session_id": session_id, "input": args.input}) + "\n")
+    print(
+        f"{len(prompts)} prompts, {len(done)} already done, {len(todo)} to run "
+        f"with {args.workers} workers (session {session_id})",
+        flush=True,
+    )
+
+    write_lock = threading.Lock()
+    latencies, failures = [], []
+
+    def process(key: str, prompt: str):
+        started = time.perf_counter()
+        try:
+            resp = run_prompt(prompt, args.user, session_id, args.via_chat)
+            error = None
+        except Exception as e:
+            # One rejected prompt (policy, quota, upstream trouble) must not stop the batch
+            resp, error = None, f"{type(e).__name__}: {e}"
+        seconds = time.perf_counter() - started
+        with write_lock:
+            record = {"key": key, "ok": error is None, "seconds": round(seconds, 3)}
+            if resp is not None:
+                # Saved as a pair so prompts and answers stay adjacent in the session
+                user_msg = {"role": "user", "type": "text", "content": prompt}
+                db.save_message(args.user, session_id, user_msg)
+                db.save_message(args.user, session_id, resp)
+                record["url"] = resp.get("url")
+                latencies.append(seconds)
+            else:
+                record["error"] = error
+                failures.append(key)
+            checkpoint.write(json.dumps(record) + "\n")
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+            finished = len(latencies) + len(failures)
+            print(
+                f"[{finished}/{len(todo)}] {key}: "
+                + (record.get("url") or "text answer" if error is None else f"FAILED {error}"),
+                flush=True,
+            )
+
+    started = time.perf_counter()
+    executor = ThreadPoolExecutor(args.workers, thread_name_prefix="batch")
+    try:
+        futures = [executor.submit(process, key, prompt) for key, prompt in todo]
+        for future in as_completed(futures):
+            future.result()
+    except KeyboardInterrupt:
+        print("Interrupted; finishing prompts in flight, rerun to resume", flush=True)
+        executor.shutdown(wait=True, cancel_futures=True)
+    finally:
+        executor.shutdown(wait=True)
+        checkpoint.close()
+        flush_metering()
+    wall = time.perf_counter() - started
+
+    print(f"\ndone {len(latencies)}, failed {len(failures)}, wall {wall:.1f}s")
+    if latencies:
+        p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0]
+        print(
+            f"throughput {len(latencies) / wall * 60:.1f} prompts/min, "
+            f"latency p50 {statistics.median(latencies):.2f}s p95 {p95:.2f}s"
+        )
+    if failures:
+        print("failed: " + ", ".join(failures[:20]) + (" ..." if len(failures) > 20 else ""))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""
+Benchmark every public db.py function against synthetic chat databases.
+
+    python benchmarks/bench_db.py --rows 10000 1000000
+    python benchmarks/bench_db.py --rows 1000000 --save-baseline benchmarks/baseline.json
+    python benchmarks/bench_db.py --rows 1000000 --baseline benchmarks/baseline.json
+
+Datasets are generated once per size into benchmarks/data/ and reused. They
+have Zipf-skewed users, log-normal session lengths, a daily activity cycle
+and a realistic text/image mix. Each function is timed on a heavy, a median
+and a light user. The report gives p50/p95 and the query plan of every
+statement the function ran.
+"""
+
+import argparse
+import importlib
+import inspect
+import json
+import math
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(ROOT, "benchmarks", "data")
+sys.path.insert(0, ROOT)
+
+DAYS = 365
+MEAN_SESSION_LENGTH = 9
+IMAGE_SHARE = 0.45
+# Relative chat volume per UTC hour, peaking in the afternoon
+HOURLY_WEIGHTS = [2, 1, 1, 1, 1, 2, 3, 5, 7, 8, 9, 10, 10, 10, 11, 12, 12, 11, 10, 9, 8, 6, 4, 3]
+WORDS = (
+    "fold crane paper crease valley mountain square base petal bird frog "
+    "boat flower star box reverse squash sink unfold sheet corner edge diagonal"
+).split()
+# Functions that change the database run after the read-only ones
+WRITE_FUNCTIONS = {
+    "save_message",
+    "refresh_aggregates",
+    "compress_stored_content",
+}
+# Functions that would move or copy the cached dataset itself
+SKIPPED_FUNCTIONS = {"archive_cold_sessions", "refresh_snapshot"}
+
+
+def _text(rng: random.Random, pool: str, low: int, high: int) -> str:
+    length = rng.randint(low, high)
+    start = rng.randrange(len(pool) - length)
+    return pool[start : start + length]
+
+
+def build_dataset(path: str, rows: int, seed: int = 42):
+    """Generate a synthetic chat.db with `rows` messages at `path`."""
+    rng = random.Random(seed)
+    pool = " ".join(rng.choice(WORDS) for _ in range(20_000))
+    os.environ["ORIGAMI_DB_PATH"] = path
+    import db
+
+    importlib.reload(db)
+    db.init_db()  # creates the schema in the new file
+
+    user_count = max(50, rows // 200)
+    users = [f"user{i:06d}@example.com" for i in range(user_count)]
+    cum_weights, total = [], 0.0
+    for rank in range(user_count):
+        total += 1 / (rank + 1) ** 1.1
+        cum_weights.append(total)
+
+    sessions_per_day = math.ceil(rows / MEAN_SESSION_LENGTH / DAYS)
+    start_day = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    start_day -= timedelta(days=DAYS - 1)
+    written, day = 0, 0
+
+    while written < rows:
+        day_start = start_day + timedelta(days=min(day, DAYS - 1))
+        batch = []
+        session_users = rng.choices(users, cum_weights=cum_weights, k=sessions_per_day)
+        hours = rng.choices(range(24), weights=HOURLY_WEIGHTS, k=sessions_per_day)
+        for user_id, hour in zip(session_users, hours):
+            session_id = uuid4().hex
+            length = min(400, int(rng.lognormvariate(1.7, 0.8)) + 1)
+            ts = day_start + timedelta(hours=hour, seconds=rng.randint(0, 3599))
+            for i in range(length):
+                if i % 2 == 0:
+                    batch.append((user_id, session_id, "user", "text", _text(rng, pool, 20, 200), "", ts))
+                elif rng.random() < IMAGE_SHARE:
+                    url = f"images/{user_id}/{uuid4().hex}.png"
+                    batch.append((user_id, session_id, "assistant", "image", _text(rng, pool, 100, 400), url, ts))
+                else:
+                    batch.append((user_id, session_id, "assistant", "text", _text(rng, pool, 200, 1500), "", ts))
+                ts += timedelta(seconds=rng.randint(5, 120))
+
+        batch.sort(key=lambda r: r[6])
+        batch = batch[: rows - written]
+        db.conn.executemany(
+            """
+            INSERT INTO messages(user_id, session_id, role, type, content, url, ts)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            [r[:6] + (r[6].strftime("%Y-%m-%d %H:%M:%S"),) for r in batch],
+        )
+        db.conn.commit()
+        written += len(batch)
+        day += 1
+
+    # Let db.py backfill its summary tables the way it does for an existing chat.db
+    db.conn.execute("DELETE FROM user_directory")
+    db.conn.execute("DELETE FROM chat_sessions")
+    db.conn.commit()
+    db.conn.close()
+    importlib.reload(db)
+    while db.refresh_aggregates():
+        pass
+    db.conn.execute("ANALYZE")
+    db.conn.commit()
+    db.conn.close()
+
+
+def open_dataset(rows: int, seed: int):
+    """
+    Return the db module pointed at a scratch copy of the dataset for `rows`,
+    building the dataset if needed.
+    """
+    os.makedirs(DATA_DIR, exist_ok=True)
+    path = os.path.join(DATA_DIR, f"chat_{rows}.db")
+    if not os.path.exists(path):
+        started = time.perf_counter()
+        print(f"Building {rows:,}-row dataset at {path} ...", flush=True)
+        build_dataset(path + ".tmp", rows, seed)
+        os.replace(path + ".tmp", path)
+        print(f"  built in {time.perf_counter() - started:.1f}s", flush=True)
+    # Write functions change the database, so every run starts from a fresh
+    # copy and baselines compare timings on the same data
+    work_path = f"{path}.{os.getpid()}.run"
+    source, target = sqlite3.connect(path), sqlite3.connect(work_path)
+    try:
+        source.backup(target)
+    finally:
+        source.close()
+        target.close()
+    os.environ["ORIGAMI_DB_PATH"] = work_path
+    import db
+
+    db = importlib.reload(db)
+    db.init_db()
+    return db
+
+
+def close_dataset(db):
+    """Close the scratch copy opened by open_dataset and delete its files."""
+    db.conn.close()
+    for path in (db.DB_PATH, db.DB_PATH + "-wal", db.DB_PATH + "-shm", db.SNAPSHOT_PATH):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def sample_targets(db) -> list[dict]:
+    """Pick a heavy, a median and a light user, each with their longest session."""
+    users = db.conn.execute(
+        "SELECT user_id FROM user_directory ORDER BY message_count DESC"
+    ).fetchall()
+    picks = [users[0][0], users[len(users) // 2][0], users[-1][0]]
+    targets = []
+    for user_id in picks:
+        session_id = db.conn.execute(
+            """
+            SELECT session_id FROM chat_sessions
+            WHERE user_id = ? ORDER BY message_count DESC LIMIT 1
+            """,
+            (user_id,),
+        ).fetchone()[0]
+        targets.append({"user_id": user_id, "session_id": session_id})
+    return targets
+
+
+def resolve_args(fn, target: dict) -> dict | None:
+    """Build keyword arguments for fn from its parameter names, or None if unknown."""
+    values = {
+        "user_id": target["user_id"],
+        "session_id": target["session_id"],
+        "tz_name": "US/Eastern",
+        "limits": {"Today": 10, "Last Week": 10, "Previous Chats": 10},
+        "search_prefix": target["user_id"][:6],
+        "position": 10,
+        "msg": {"role": "user", "type": "text", "content": "benchmark message"},
+        "sha256": "0" * 64,
+        "older_than_days": 30,
+    }
+    kwargs = {}
+    for name, param in inspect.signature(fn).parameters.items():
+        if name in values:
+            kwargs[name] = values[name]
+        elif param.default is inspect.Parameter.empty:
+            return None
+    return kwargs
+
+
+def public_functions(db) -> list:
+    functions = [
+        fn
+        for name, fn in inspect.getmembers(db, inspect.isfunction)
+        if not name.startswith("_")
+        and name not in SKIPPED_FUNCTIONS
+        and getattr(fn, "__module__", None) == db.__name__
+    ]
+    return sorted(functions, key=lambda fn: (fn.__name__ in WRITE_FUNCTIONS, fn.__name__))
+
+
+def query_plans(db, statements: list[str]) -> list[str]:
+    plans = []
+    for sql in dict.fromkeys(statements):
+        if not sql.lstrip().upper().startswith(("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")):
+            continue
+        try:
+            detail = db.conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+        except sqlite3.Error:
+            continue
+        plan = " | ".join(row[-1] for row in detail)
+        if plan and plan not in plans:
+            plans.append(plan)
+    return plans
+
+
+def run_benchmarks(db, repeat: int) -> dict:
+    targets = sample_targets(db)
+    results = {}
+    for fn in public_functions(db):
+        timings, statements = [], []
+        for target in targets:
+            kwargs = resolve_args(fn, target)
+            if kwargs is None:
+                break
+            fn(**kwargs)  # warm-up
+            db.conn.set_trace_callback(statements.append)
+            fn(**kwargs)
+            db.conn.set_trace_callback(None)
+            for _ in range(repeat):
+                started = time.perf_counter()
+                fn(**kwargs)
+                timings.append((time.perf_counter() - started) * 1000)
+        if not timings:
+            results[fn.__name__] = {"skipped": "unsupported parameters"}
+            continue
+        timings.sort()
+        results[fn.__name__] = {
+            "p50_ms": round(statistics.median(timings), 3),
+            "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+            "samples": len(timings),
+            "plans": query_plans(db, statements),
+        }
+    return results
+
+
+def print_report(rows: int, results: dict, baseline: dict | None, threshold: float):
+    print(f"\n=== {rows:,} rows ===")
+    print(f"{'function':40} {'p50 ms':>10} {'p95 ms':>10} {'vs base':>9}")
+    regressions = []
+    for name, result in results.items():
+        if "skipped" in result:
+            print(f"{name:40} {'skipped':>10}")
+            continue
+        change = ""
+        base = (baseline or {}).get(name)
+        if base and base.get("p95_ms"):
+            ratio = result["p95_ms"] / base["p95_ms"]
+            change = f"{ratio:8.2f}x"
+            if ratio > threshold and result["p95_ms"] - base["p95_ms"] > 1:
+                regressions.append(name)
+                change += "!"
+        print(f"{name:40} {result['p50_ms']:10.3f} {result['p95_ms']:10.3f} {change:>9}")
+        for plan in result["plans"]:
+            print(f"    plan: {plan}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 1_000_000, 10_000_000])
+    parser.add_argument("--repeat", type=int, default=10, help="timed calls per user")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--save-baseline", help="write results as a baseline JSON")
+    parser.add_argument("--baseline", help="compare p95 against this baseline JSON")
+    parser.add_argument(
+        "--threshold", type=float, default=1.5, help="p95 ratio reported as a regression"
+    )
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["scales"]
+
+    report = {"sqlite_version": sqlite3.sqlite_version, "scales": {}}
+    regressions = []
+    for rows in args.rows:
+        db = open_dataset(rows, args.seed)
+        try:
+            results = run_benchmarks(db, args.repeat)
+        finally:
+            close_dataset(db)
+        report["scales"][str(rows)] = results
+        regressions += [
+            f"{name} @ {rows:,}"
+            for name in print_report(rows, results, baseline.get(str(rows)), args.threshold)
+        ]
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+    if regressions:
+        print("\nRegressions: " + ", ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
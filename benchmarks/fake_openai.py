@@ -0,0 +1,209 @@
+"""
+In-process stand-in for the OpenAI client, for load tests and benchmarks.
+
+It covers the calls the app makes (responses.create, images.generate,
+files.create) with configurable latency. Image turns use whichever image tool
+the request offers: a generate_image function call, or an inline
+image_generation_call. Generated
+image URLs point at a local HTTP server, so the download step in
+generate_image runs for real. Like the real API, a response that ended in a
+function call must get its output on the next turn, and a
+previous_response_id this instance never returned is rejected as expired.
+
+Faults can be injected to exercise resilience.py: a share of calls fail with
+a 500, a 429, or hang until the caller's timeout and then time out, and a
+share of image downloads get a 503.
+"""
+
+import base64
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from uuid import uuid4
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_IMAGE = os.path.join(ROOT, "static", "origami_icon.png")
+
+
+def _api_error(
+    cls, message: str, status_code: int | None = None, code: str | None = None
+):
+    # The SDK's error constructors want its HTTP client's request/response
+    # objects; the app only looks at the type, status code and error code.
+    error = cls.__new__(cls)
+    Exception.__init__(error, message)
+    error.message = message
+    error.code = code
+    if status_code is not None:
+        error.status_code = status_code
+    return error
+
+
+class _ImageHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if random.random() < self.server.download_error_rate:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = self.server.image_bytes
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _latency(mean: float) -> float:
+    # Log-normal around the mean, like real upstream latency
+    return mean * random.lognormvariate(0, 0.35) if mean > 0 else 0
+
+
+class FakeOpenAI:
+    """Duck-typed replacement for openai.OpenAI with simulated latency."""
+
+    def __init__(
+        self,
+        chat_latency: float = 0.8,
+        image_latency: float = 3.0,
+        image_share: float = 0.3,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        hang_rate: float = 0.0,
+        download_error_rate: float = 0.0,
+    ):
+        self.chat_latency = chat_latency
+        self.image_latency = image_latency
+        self.image_share = image_share
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.hang_rate = hang_rate
+        self.calls = {"responses": 0, "images": 0, "files": 0, "faults": 0}
+        self._calls_lock = threading.Lock()
+        # response id -> call id still waiting for a function_call_output
+        self._pending_calls: dict[str, str] = {}
+        # Responses this instance created; others count as expired upstream
+        self._response_ids: set[str] = set()
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _ImageHandler)
+        with open(SAMPLE_IMAGE, "rb") as f:
+            self._server.image_bytes = f.read()
+        self._server.download_error_rate = download_error_rate
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.image_base_url = f"http://127.0.0.1:{self._server.server_address[1]}"
+
+        self.responses = SimpleNamespace(create=self._create_response)
+        self.images = SimpleNamespace(generate=self._generate_image)
+        self.files = SimpleNamespace(create=self._create_file)
+
+    def _count(self, kind: str):
+        with self._calls_lock:
+            self.calls[kind] += 1
+
+    def _inject_fault(self, timeout: float | None):
+        import openai
+
+        roll = random.random()
+        if roll < self.hang_rate:
+            self._count("faults")
+            time.sleep(timeout if timeout is not None else 600)
+            raise _api_error(openai.APITimeoutError, "Request timed out.")
+        roll -= self.hang_rate
+        if roll < self.error_rate:
+            self._count("faults")
+            raise _api_error(openai.InternalServerError, "Injected server error", 500)
+        roll -= self.error_rate
+        if roll < self.rate_limit_rate:
+            self._count("faults")
+            raise _api_error(openai.RateLimitError, "Injected rate limit", 429)
+
+    def _create_response(
+        self, model, input, previous_response_id=None, tools=(), timeout=None, **kwargs
+    ):
+        self._count("responses")
+        self._inject_fault(timeout)
+        with self._calls_lock:
+            if previous_response_id and previous_response_id not in self._response_ids:
+                import openai
+
+                raise _api_error(
+                    openai.BadRequestError,
+                    f"Previous response with id '{previous_response_id}' not found.",
+                    400,
+                    "previous_response_not_found",
+                )
+            pending = self._pending_calls.pop(previous_response_id, None)
+        answered = {i.get("call_id") for i in input if i.get("type") == "function_call_output"}
+        if pending and pending not in answered:
+            raise RuntimeError(f"No tool output found for function call {pending}.")
+        time.sleep(_latency(self.chat_latency))
+        response_id = f"resp_{uuid4().hex}"
+        with self._calls_lock:
+            self._response_ids.add(response_id)
+        prompt = input[-1]["content"][0]["text"]
+        tool_types = {tool["type"] for tool in tools}
+        output, output_text = [], f"Here is how to fold that: {prompt}"
+        if tool_types and random.random() < self.image_share:
+            output_text = ""
+            if "image_generation" in tool_types:
+                self._count("images")
+                time.sleep(_latency(self.image_latency))
+                output.append(
+                    SimpleNamespace(
+                        type="image_generation_call",
+                        result=base64.b64encode(self._server.image_bytes).decode(),
+                        revised_prompt=f"An origami model: {prompt}",
+                    )
+                )
+            else:
+                call_id = f"call_{uuid4().hex}"
+                with self._calls_lock:
+                    self._pending_calls[response_id] = call_id
+                output.append(
+                    SimpleNamespace(
+                        type="function_call",
+                        name="generate_image",
+                        arguments=json.dumps({"prompt": prompt}),
+                        call_id=call_id,
+                    )
+                )
+        return SimpleNamespace(
+            id=response_id,
+            output_text=output_text,
+            output=output,
+            usage=SimpleNamespace(
+                input_tokens=len(prompt.split()) + 50,
+                output_tokens=len(output_text.split()) + 10 * len(output),
+            ),
+        )
+
+    def _create_file(self, file, purpose, timeout=None, **kwargs):
+        self._count("files")
+        self._inject_fault(timeout)
+        return SimpleNamespace(id=f"file-{uuid4().hex}", purpose=purpose)
+
+    def _generate_image(
+        self, model, prompt, n=1, size="1024x1024", timeout=None, **kwargs
+    ):
+        self._count("images")
+        self._inject_fault(timeout)
+        time.sleep(_latency(self.image_latency))
+        return SimpleNamespace(
+            data=[
+                SimpleNamespace(
+                    url=f"{self.image_base_url}/{uuid4().hex}.png",
+                    revised_prompt=f"An origami model: {prompt}",
+                )
+            ]
+        )
+
+    def close(self):
+        self._server.shutdown()
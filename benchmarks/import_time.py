@@ -0,0 +1,98 @@
+"""
+Check import-time budgets for the app's entry modules.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --runs 9 --budget app.app=150 --top 15
+
+Each module is imported in fresh interpreters under `python -X importtime`,
+after streamlit itself (which every page needs anyway). The median cumulative
+import time is compared with its budget, and the slowest modules it pulled in
+are listed. The exit status is 1 when any module is over budget, so the
+script can gate CI.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Milliseconds of import time each entry module may add on top of streamlit
+BUDGETS_MS = {
+    "db": 20,
+    "metrics": 20,
+    "image_generation": 50,
+    "app.app": 60,
+    "app.admin": 300,
+}
+
+
+def import_profile(module: str) -> tuple[float, list[tuple[float, str]]]:
+    """Import module in a fresh interpreter; return its cumulative ms and (self ms, name) per import."""
+    env = dict(os.environ, OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "import-time"))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import streamlit; import {module}"],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total, imports, started = 0.0, [], False
+    for line in result.stderr.splitlines():
+        # "import time: <self us> | <cumulative us> | <indent><module>"
+        fields = line.removeprefix("import time:").split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        self_us, cumulative_us, name = fields[0], fields[1], fields[2][1:].rstrip()
+        # Children are listed before their parent, so everything after the
+        # streamlit line was imported by the module under test
+        if not started:
+            started = name == "streamlit"
+            continue
+        imports.append((int(self_us) / 1000, name.strip()))
+        if name == module:
+            total = int(cumulative_us) / 1000
+    return total, imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per module")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    parser.add_argument(
+        "--budget",
+        action="append",
+        default=[],
+        metavar="MODULE=MS",
+        help="override or add a budget",
+    )
+    args = parser.parse_args()
+
+    budgets = dict(BUDGETS_MS)
+    for item in args.budget:
+        module, _, ms = item.partition("=")
+        budgets[module] = float(ms)
+
+    over = []
+    print(f"{'module':20} {'median ms':>10} {'budget ms':>10}")
+    for module, budget in budgets.items():
+        runs = [import_profile(module) for _ in range(args.runs)]
+        median = statistics.median(total for total, _ in runs)
+        flag = "" if median <= budget else "  OVER"
+        print(f"{module:20} {median:10.1f} {budget:10.0f}{flag}")
+        if flag:
+            over.append(module)
+        slowest = sorted(runs[-1][1], reverse=True)[: args.top]
+        for self_ms, name in slowest:
+            print(f"    {self_ms:8.1f} ms  {name}")
+
+    if over:
+        print("\nOver budget: " + ", ".join(over))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
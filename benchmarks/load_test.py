@@ -0,0 +1,292 @@
+"""
+Concurrent-session load test for the full Streamlit app.
+
+    python benchmarks/load_test.py --levels 1 4 16 --turns 5
+
+Each simulated user is a headless AppTest session of streamlit_app.py with its
+own logged-in identity. Chat users send prompts through show_app and admin
+users rerun show_admin_portal. OpenAI is replaced by benchmarks/fake_openai.py
+with configurable latency. For each concurrency level the report gives
+throughput, turn latency percentiles, time spent waiting for the shared DB
+connection, and memory per session. The app uses a throwaway database and
+image folder.
+"""
+
+import argparse
+import json
+import math
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_SCRIPT = os.path.join(ROOT, "streamlit_app.py")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+PROMPTS = [
+    "How do I fold a paper crane?",
+    "Show me a jumping frog",
+    "Make a lotus flower with eight petals",
+    "What is a squash fold?",
+    "Generate a simple origami boat",
+]
+
+
+class SessionUser:
+    """Stands in for st.experimental_user, reading the identity from session state."""
+
+    is_logged_in = True
+
+    def _info(self) -> dict:
+        import streamlit as st
+
+        return {"email": st.session_state["load_test_user"], "email_verified": True}
+
+    def __getitem__(self, key):
+        return self._info()[key]
+
+    def get(self, key, default=None):
+        return self._info().get(key, default)
+
+
+def share_apptest_globals(secrets: dict):
+    """
+    AppTest assumes one session at a time: every run swaps st.secrets, patches
+    the config and installs then clears a process-wide mock Runtime. Install
+    those globals once so many AppTest sessions can run on parallel threads,
+    as sessions do in one server process.
+    """
+    import streamlit as st
+    from contextlib import nullcontext
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.secrets import Secrets
+    from streamlit.testing.v1 import app_test
+    from streamlit.testing.v1.util import patch_config_options
+
+    shared_secrets = Secrets()
+    shared_secrets._secrets = secrets
+    st.secrets = shared_secrets
+
+    # Keep a reference: a collected context manager would undo the patch
+    share_apptest_globals.config_patch = patch_config_options({"global.appTest": True})
+    share_apptest_globals.config_patch.__enter__()
+    app_test.patch_config_options = lambda overrides: nullcontext()
+
+    # Fall back to the last mock Runtime when another session's run cleared it
+    last_runtime = {}
+
+    def instance(cls):
+        if cls._instance is not None:
+            last_runtime["runtime"] = cls._instance
+            return cls._instance
+        if "runtime" in last_runtime:
+            return last_runtime["runtime"]
+        raise RuntimeError("Runtime hasn't been created!")
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(
+        lambda cls: cls._instance is not None or "runtime" in last_runtime
+    )
+
+
+def rss_bytes() -> int:
+    """Current resident set size (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def simulate_user(email, is_admin, turns, think_time, stats, sessions):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_SCRIPT, default_timeout=600)
+    at.session_state["load_test_user"] = email
+    if is_admin:
+        at.query_params["admin"] = "true"
+    sessions.append(at)  # keep alive so memory per session can be measured
+
+    started = time.perf_counter()
+    at.run()
+    stats["page_loads"].append(time.perf_counter() - started)
+
+    for turn in range(turns):
+        time.sleep(think_time)
+        started = time.perf_counter()
+        if is_admin:
+            user_buttons = [b for b in at.button if (b.key or "").startswith("user_")]
+            if user_buttons:
+                user_buttons[turn % len(user_buttons)].click()
+            at.run()
+        else:
+            at.chat_input[0].set_value(PROMPTS[turn % len(PROMPTS)]).run()
+        elapsed = time.perf_counter() - started
+        stats["turns"].append(elapsed)
+        if at.exception:
+            stats["errors"].append(at.exception[0].value)
+        elif not is_admin and (at.error or at.warning):
+            # The app gave up on the AI call and told the user to retry
+            stats["failed_turns"].append((at.error or at.warning)[0].value)
+
+
+def diff_histogram(before, after, key):
+    import metrics
+
+    histogram = metrics.Histogram()
+    new, old = after.get(key), before.get(key)
+    if new is None:
+        return histogram
+    histogram.bucket_counts = [
+        n - (old.bucket_counts[i] if old else 0) for i, n in enumerate(new.bucket_counts)
+    ]
+    histogram.count = new.count - (old.count if old else 0)
+    histogram.sum = new.sum - (old.sum if old else 0.0)
+    return histogram
+
+
+def run_level(level, args, secrets) -> dict:
+    import metrics
+
+    admin_count = min(level, math.floor(level * args.admin_share + 0.5))
+    users = [(f"load{level}_{i}@example.com", i < admin_count) for i in range(level)]
+    secrets["admin_emails"] += [email for email, admin in users if admin]
+    stats = {"page_loads": [], "turns": [], "errors": [], "failed_turns": []}
+    sessions = []
+
+    before, rss_before = metrics.snapshot(), rss_bytes()
+    started = time.perf_counter()
+    threads = [
+        threading.Thread(
+            target=simulate_user,
+            args=(email, admin, args.turns, args.think_time, stats, sessions),
+        )
+        for email, admin in users
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    after, rss_after = metrics.snapshot(), rss_bytes()
+
+    lock_wait = diff_histogram(before, after, ("db.lock_wait", "ok"))
+    result = {
+        "sessions": level,
+        "admin_sessions": admin_count,
+        "turns": len(stats["turns"]),
+        "errors": len(stats["errors"]),
+        "failed_turns": len(stats["failed_turns"]),
+        "wall_s": round(wall, 2),
+        "throughput_turns_per_s": round(len(stats["turns"]) / wall, 3),
+        "turn_p50_s": round(percentile(stats["turns"], 0.50), 3),
+        "turn_p95_s": round(percentile(stats["turns"], 0.95), 3),
+        "turn_p99_s": round(percentile(stats["turns"], 0.99), 3),
+        "page_load_p50_s": round(statistics.median(stats["page_loads"] or [0]), 3),
+        "db_lock_waits": lock_wait.count,
+        "db_lock_wait_total_s": round(lock_wait.sum, 3),
+        "db_lock_wait_p95_s": lock_wait.quantile(0.95),
+        "memory_per_session_mb": round((rss_after - rss_before) / level / 2**20, 2),
+    }
+    if stats["errors"]:
+        result["first_error"] = str(stats["errors"][0])
+    if stats["failed_turns"]:
+        result["first_failed_turn"] = stats["failed_turns"][0]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--turns", type=int, default=5, help="turns per session")
+    parser.add_argument("--admin-share", type=float, default=0.1)
+    parser.add_argument("--think-time", type=float, default=0.0, help="seconds between turns")
+    parser.add_argument("--chat-latency", type=float, default=0.8)
+    parser.add_argument("--image-latency", type=float, default=3.0)
+    parser.add_argument("--image-share", type=float, default=0.3)
+    parser.add_argument("--image-tool", choices=["function", "builtin"], default="function")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of API calls failing with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share failing with 429")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="share hanging until timeout")
+    parser.add_argument("--download-error-rate", type=float, default=0.0)
+    parser.add_argument("--deadline", type=float, help="override every AI step deadline (s)")
+    parser.add_argument("--output", help="write results JSON here")
+    args = parser.parse_args()
+
+    # Isolated database and image folder; must be set before the app modules load
+    workdir = tempfile.mkdtemp(prefix="origami-load-")
+    os.environ["ORIGAMI_DB_PATH"] = os.path.join(workdir, "chat.db")
+    os.environ["ORIGAMI_IMAGES_DIR"] = os.path.join(workdir, "images")
+    os.environ.setdefault("OPENAI_API_KEY", "load-test")
+    os.chdir(ROOT)  # the app loads its icons from relative static/ paths
+
+    import metrics
+
+    metrics.ENABLED = True  # before db.py is imported, so its timers are installed
+    import streamlit as st
+    import image_generation
+    from fake_openai import FakeOpenAI
+
+    fake = FakeOpenAI(
+        args.chat_latency,
+        args.image_latency,
+        args.image_share,
+        args.error_rate,
+        args.rate_limit_rate,
+        args.hang_rate,
+        args.download_error_rate,
+    )
+    if args.deadline:
+        import resilience
+
+        resilience.DEADLINES_S = dict.fromkeys(resilience.DEADLINES_S, args.deadline)
+    image_generation.client = fake
+    st.experimental_user = SessionUser()
+
+    secrets = {
+        "SYSTEM_PROMPT": "You are an origami assistant.",
+        "MODEL_CHAT": "fake-chat",
+        "MODEL_IMAGE": "fake-image",
+        "IMAGE_TOOL": args.image_tool,
+        "spinner_messages": ["Folding..."],
+        "admin_emails": [],
+    }
+    share_apptest_globals(secrets)
+
+    results = []
+    header = f"{'sessions':>8} {'turns':>6} {'err':>4} {'fail':>4} {'turn/s':>8} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'lock s':>8} {'MB/sess':>8}"
+    print(header)
+    for level in args.levels:
+        r = run_level(level, args, secrets)
+        results.append(r)
+        print(
+            f"{r['sessions']:8} {r['turns']:6} {r['errors']:4} {r['failed_turns']:4} {r['throughput_turns_per_s']:8.2f} "
+            f"{r['turn_p50_s']:7.2f} {r['turn_p95_s']:7.2f} {r['turn_p99_s']:7.2f} "
+            f"{r['db_lock_wait_total_s']:8.3f} {r['memory_per_session_mb']:8.2f}",
+            flush=True,
+        )
+        if stats_failed := r.get("first_failed_turn"):
+            print(f"         first failed turn: {stats_failed}")
+        if "first_error" in r:
+            print(f"         first error: {r['first_error']}")
+
+    fake.close()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"args": vars(args), "fake_calls": fake.calls, "levels": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
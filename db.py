@@ -1,29 +1,489 @@
 import sqlite3
 import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta, time as day_time
 from uuid import uuid4
 
+from functools import wraps
+
+import archive
+from metrics import observe, timed, timer
+from shared import file_age, file_lock, temp_path
+
 # ensure folder exists
 os.makedirs(os.path.dirname(__file__), exist_ok=True)
-DB_PATH = os.path.join(os.path.dirname(__file__), "chat.db")
-
-conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-cur = conn.cursor()
-
-cur.execute(
-    """
-CREATE TABLE IF NOT EXISTS messages (
-    id           INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id      TEXT,
-    session_id   TEXT,
-    role         TEXT,
-    type         TEXT,
-    content      TEXT,
-    url          TEXT,
-    ts           DATETIME DEFAULT CURRENT_TIMESTAMP
+# ORIGAMI_DB_PATH points the app (or a benchmark) at another database file
+DB_PATH = os.environ.get("ORIGAMI_DB_PATH") or os.path.join(
+    os.path.dirname(__file__), "chat.db"
 )
-"""
+
+# The connection is opened and the schema created on the first query, not at
+# import, so pages that never touch the database start faster
+conn = None
+cur = None
+
+# Every Streamlit session thread shares this connection, so calls are serialized
+_lock = threading.RLock()
+# Other app processes (replicas) on the same file are serialized by SQLite's own
+# write lock; a write waits up to this long for it
+BUSY_TIMEOUT_S = 10.0
+
+# Admin pages can read from a periodic copy of the database instead, so their
+# long scans never wait on, or hold up, the chat connection
+SNAPSHOT_PATH = os.environ.get("ORIGAMI_SNAPSHOT_PATH") or DB_PATH + ".snapshot"
+_snapshot_lock = threading.RLock()
+_snapshot_conn = None
+_snapshot_taken_at = None
+# Max snapshot age in seconds for reads on this thread; None reads the live database
+_snapshot_max_age: ContextVar[float | None] = ContextVar(
+    "snapshot_max_age", default=None
+)
+_snapshot_cur: ContextVar[sqlite3.Cursor | None] = ContextVar(
+    "snapshot_cur", default=None
 )
-conn.commit()
+
+# Message content of at least COMPRESS_MIN_CHARS characters is stored compressed
+# (ORIGAMI_CONTENT_CODEC: zlib, zstd or none), with messages.content_codec naming
+# the codec; NULL means plain text. chat_sessions.first_message keeps a plain
+# snippet, so session lists never decompress anything.
+CONTENT_CODEC = os.environ.get("ORIGAMI_CONTENT_CODEC", "zlib")
+COMPRESS_MIN_CHARS = int(os.environ.get("ORIGAMI_COMPRESS_MIN_CHARS", 512))
+
+
+def _codec(name: str):
+    """The module providing compress/decompress for a codec name."""
+    if name == "zlib":
+        return zlib
+    if name == "zstd":
+        try:
+            from compression import zstd  # Python 3.14+
+        except ImportError:
+            import zstandard as zstd
+        return zstd
+    raise ValueError(f"unknown content codec: {name}")
+
+
+def _encode_content(content: str | None) -> tuple[str | bytes | None, str | None]:
+    """Return (stored value, codec) for message content."""
+    if CONTENT_CODEC == "none" or not content or len(content) < COMPRESS_MIN_CHARS:
+        return content, None
+    data = content.encode("utf-8")
+    compressed = _codec(CONTENT_CODEC).compress(data)
+    if len(compressed) >= len(data):
+        return content, None
+    return compressed, CONTENT_CODEC
+
+
+def _decode_content(value: str | bytes | None, codec: str | None) -> str | None:
+    """Return message content as stored by _encode_content."""
+    if codec is None:
+        return value
+    return _codec(codec).decompress(value).decode("utf-8")
+
+
+def init_db():
+    """Open the shared connection and create the schema, once per process."""
+    with _lock:
+        if conn is None:
+            _open_db()
+
+
+def _open_db():
+    """Open the shared connection, then create and backfill the schema if needed."""
+    global conn, cur
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_S, check_same_thread=False)
+    cur = conn.cursor()
+    # Replicas starting together take turns, so none repeats another's migration
+    with file_lock("schema"):
+        _create_schema()
+
+
+def _create_schema():
+    # WAL lets maintenance and snapshot readers run beside chat writes.
+    # auto_vacuum only takes effect on a new file; maintenance.py converts old ones.
+    cur.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    cur.execute("PRAGMA journal_mode = WAL")
+    cur.execute("PRAGMA journal_size_limit = 67108864")  # WAL kept at most 64 MB at rest
+
+    cur.execute(
+        """
+    CREATE TABLE IF NOT EXISTS messages (
+        id           INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id      TEXT,
+        session_id   TEXT,
+        role         TEXT,
+        type         TEXT,
+        content      TEXT,
+        url          TEXT,
+        ts           DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_messages_user_ts ON messages(user_id, ts)"
+    )
+    _add_column("messages", "response_id", "TEXT")
+    _add_column("messages", "content_codec", "TEXT")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_messages_session_id ON messages(user_id, session_id, id)"
+    )
+
+    # One row per user, kept up to date by save_message, so the admin directory
+    # never has to group the whole messages table.
+    cur.execute(
+        """
+    CREATE TABLE IF NOT EXISTS user_directory (
+        user_id        TEXT PRIMARY KEY,
+        email_lower    TEXT NOT NULL,
+        message_count  INTEGER NOT NULL DEFAULT 0,
+        last_activity  DATETIME
+    )
+    """
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_user_directory_email ON user_directory(email_lower)"
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_user_directory_activity ON user_directory(last_activity)"
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_user_directory_count ON user_directory(message_count)"
+    )
+    if cur.execute("SELECT COUNT(*) FROM user_directory").fetchone()[0] == 0:
+        # Backfill once from existing chat data
+        cur.execute(
+            """
+            INSERT INTO user_directory(user_id, email_lower, message_count, last_activity)
+            SELECT user_id, LOWER(user_id), COUNT(*), MAX(ts)
+            FROM messages
+            GROUP BY user_id
+            """
+        )
+
+    # One row per chat session with its first-message snippet, so history lists
+    # are index range scans instead of GROUP BYs over messages.
+    cur.execute(
+        """
+    CREATE TABLE IF NOT EXISTS chat_sessions (
+        session_id     TEXT PRIMARY KEY,
+        user_id        TEXT NOT NULL,
+        first_message  TEXT,
+        message_count  INTEGER NOT NULL DEFAULT 0,
+        first_ts       DATETIME,
+        last_activity  DATETIME
+    )
+    """
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_chat_sessions_first ON chat_sessions(user_id, first_ts)"
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_chat_sessions_activity ON chat_sessions(user_id, last_activity)"
+    )
+    # Month of the archive database holding the session's cold messages, if any
+    _add_column("chat_sessions", "archive_month", "TEXT")
+    # Latest OpenAI response of the session, so a reopened chat resumes its thread
+    _add_column("chat_sessions", "last_response_id", "TEXT")
+    # generate_image call that response ended with, answered on the next turn
+    _add_column("chat_sessions", "pending_tool_call", "TEXT")
+    # When the session was last archived. Messages saved after that (the chat
+    # was continued) are archived again once it goes cold; sessions archived
+    # before this column existed get '' and are swept once.
+    _add_column("chat_sessions", "archived_at", "DATETIME DEFAULT ''")
+    cur.execute("DROP INDEX IF EXISTS idx_chat_sessions_archive")
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_chat_sessions_to_archive
+        ON chat_sessions(last_activity)
+        WHERE archive_month IS NULL OR last_activity >= archived_at
+        """
+    )
+    if cur.execute("SELECT COUNT(*) FROM chat_sessions").fetchone()[0] == 0:
+        # Backfill once from existing chat data
+        cur.execute(
+            """
+            INSERT INTO chat_sessions(
+                session_id, user_id, first_message, message_count, first_ts, last_activity
+            )
+            SELECT
+                session_id,
+                user_id,
+                (SELECT SUBSTR(COALESCE(content, ''), 1, 100) FROM messages m2
+                 WHERE m2.user_id = m.user_id AND m2.session_id = m.session_id
+                 ORDER BY id LIMIT 1),
+                COUNT(*),
+                MIN(ts),
+                MAX(ts)
+            FROM messages m
+            GROUP BY user_id, session_id
+            """
+        )
+
+    # Global analytics aggregates, filled incrementally by refresh_aggregates()
+    cur.executescript(
+        """
+    CREATE TABLE IF NOT EXISTS agg_daily (
+        day                 TEXT PRIMARY KEY,
+        messages            INTEGER NOT NULL DEFAULT 0,
+        user_messages       INTEGER NOT NULL DEFAULT 0,
+        images              INTEGER NOT NULL DEFAULT 0,
+        active_users        INTEGER NOT NULL DEFAULT 0,
+        weekly_active_users INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS agg_daily_user (
+        day            TEXT,
+        user_id        TEXT,
+        messages       INTEGER NOT NULL DEFAULT 0,
+        images         INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, user_id)
+    );
+    CREATE TABLE IF NOT EXISTS agg_hourly (
+        day            TEXT,
+        hour           INTEGER,
+        user_messages  INTEGER NOT NULL DEFAULT 0,
+        ai_responses   INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, hour)
+    );
+    CREATE TABLE IF NOT EXISTS agg_user_totals (
+        user_id        TEXT PRIMARY KEY,
+        messages       INTEGER NOT NULL DEFAULT 0,
+        images         INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_agg_user_totals_messages ON agg_user_totals(messages);
+    CREATE INDEX IF NOT EXISTS idx_agg_user_totals_images ON agg_user_totals(images);
+    CREATE TABLE IF NOT EXISTS agg_watermarks (
+        name          TEXT PRIMARY KEY,
+        last_id       INTEGER NOT NULL DEFAULT 0,
+        refreshed_at  DATETIME
+    );
+    """
+    )
+
+    # Per-call API metering, written in batches by metering.py
+    cur.executescript(
+        """
+    CREATE TABLE IF NOT EXISTS api_calls (
+        id             INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id        TEXT,
+        session_id     TEXT,
+        kind           TEXT,
+        model          TEXT,
+        input_tokens   INTEGER NOT NULL DEFAULT 0,
+        output_tokens  INTEGER NOT NULL DEFAULT 0,
+        image_count    INTEGER NOT NULL DEFAULT 0,
+        image_size     TEXT,
+        duration_ms    REAL,
+        outcome        TEXT,
+        ts             DATETIME
+    );
+    CREATE TABLE IF NOT EXISTS api_usage_daily (
+        day            TEXT,
+        user_id        TEXT,
+        model          TEXT,
+        calls          INTEGER NOT NULL DEFAULT 0,
+        errors         INTEGER NOT NULL DEFAULT 0,
+        input_tokens   INTEGER NOT NULL DEFAULT 0,
+        output_tokens  INTEGER NOT NULL DEFAULT 0,
+        images         INTEGER NOT NULL DEFAULT 0,
+        total_ms       REAL NOT NULL DEFAULT 0,
+        max_ms         REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, user_id, model)
+    );
+    """
+    )
+
+    # One row per maintenance task run, written by maintenance.py
+    cur.execute(
+        """
+    CREATE TABLE IF NOT EXISTS maintenance_log (
+        id           INTEGER PRIMARY KEY AUTOINCREMENT,
+        task         TEXT,
+        started_at   DATETIME,
+        duration_ms  REAL,
+        outcome      TEXT,
+        detail       TEXT
+    )
+    """
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_maintenance_log_task ON maintenance_log(task, id)"
+    )
+
+    # Generated image files on disk, for per-user byte accounting (image_store.py)
+    cur.execute(
+        """
+    CREATE TABLE IF NOT EXISTS image_files (
+        path             TEXT PRIMARY KEY,
+        user_id          TEXT NOT NULL,
+        bytes            INTEGER NOT NULL,
+        created_at       DATETIME DEFAULT CURRENT_TIMESTAMP,
+        recompressed_at  DATETIME
+    )
+    """
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_image_files_user ON image_files(user_id)"
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_image_files_cold ON image_files(recompressed_at, created_at)"
+    )
+    # Uploaded attachments, stored once per user and content hash (attachments.py)
+    cur.execute(
+        """
+    CREATE TABLE IF NOT EXISTS attachments (
+        user_id          TEXT NOT NULL,
+        sha256           TEXT NOT NULL,
+        path             TEXT NOT NULL,
+        mime             TEXT NOT NULL,
+        provider_file_id TEXT,
+        created_at       DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, sha256)
+    )
+    """
+    )
+    # Users an admin armed for profiling, shared by every app process (profiling.py)
+    cur.execute(
+        """
+    CREATE TABLE IF NOT EXISTS profiling_armed (
+        user_id    TEXT PRIMARY KEY,
+        page       TEXT,
+        remaining  INTEGER NOT NULL
+    )
+    """
+    )
+    conn.commit()
+
+
+def _add_column(table: str, column: str, declaration: str):
+    """Add a column to a table created by an older version of this file."""
+    columns = [row[1] for row in cur.execute(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+
+def _synchronized(fn):
+    """Run fn holding the connection lock; time spent waiting is recorded as db.lock_wait."""
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        with _lock:
+            observe("db.lock_wait", time.perf_counter() - started)
+            if conn is None:
+                _open_db()
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+@contextmanager
+def _write_transaction():
+    """
+    Run the block as one BEGIN IMMEDIATE transaction on the shared connection.
+    It takes the write lock up front, so reads made inside it stay valid
+    against other app processes until the commit.
+    """
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def _cursor() -> sqlite3.Cursor:
+    """The snapshot cursor inside a snapshot read, otherwise the live one."""
+    return _snapshot_cur.get() or cur
+
+
+def refresh_snapshot(max_age_seconds: float | None = None):
+    """
+    Copy the live database into SNAPSHOT_PATH with the online backup API.
+    Replicas share the file: with max_age_seconds, a copy another process made
+    within that age is opened instead of taking a new one.
+    """
+    global _snapshot_conn, _snapshot_taken_at
+    init_db()
+    with _snapshot_lock, file_lock("snapshot"):
+        age = file_age(SNAPSHOT_PATH)
+        if max_age_seconds is not None and age is not None and age <= max_age_seconds:
+            taken_at = datetime.utcnow() - timedelta(seconds=age)
+        else:
+            taken_at = datetime.utcnow()
+            tmp_path = temp_path(SNAPSHOT_PATH)
+            # A separate source connection: in WAL mode the one-step backup reads a
+            # consistent view without blocking chat writes
+            source = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_S)
+            target = sqlite3.connect(tmp_path)
+            try:
+                source.backup(target)
+                # A plain rollback-journal file can be opened read-only without a -shm
+                target.execute("PRAGMA journal_mode = DELETE")
+            finally:
+                target.close()
+                source.close()
+            os.replace(tmp_path, SNAPSHOT_PATH)
+        if _snapshot_conn is not None:
+            _snapshot_conn.close()
+        _snapshot_conn = sqlite3.connect(
+            f"file:{SNAPSHOT_PATH}?mode=ro", uri=True, check_same_thread=False
+        )
+        _snapshot_taken_at = taken_at
+
+
+def _snapshot_readable(fn):
+    """
+    Like _synchronized, but inside snapshot_reads() the query runs on the
+    snapshot (refreshed first when older than the allowed age) under its own lock.
+    """
+    synchronized = _synchronized(fn)
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        max_age = _snapshot_max_age.get()
+        if max_age is None:
+            return synchronized(*args, **kwargs)
+        with _snapshot_lock:
+            if (
+                _snapshot_taken_at is None
+                or (datetime.utcnow() - _snapshot_taken_at).total_seconds() > max_age
+            ):
+                with timer("db.snapshot_refresh"):
+                    refresh_snapshot(max_age)
+            token = _snapshot_cur.set(_snapshot_conn.cursor())
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _snapshot_cur.reset(token)
+
+    return wrapper
+
+
+@contextmanager
+def snapshot_reads(max_age_seconds: float):
+    """Serve reads in this block from a snapshot at most max_age_seconds old."""
+    token = _snapshot_max_age.set(max_age_seconds)
+    try:
+        yield
+    finally:
+        _snapshot_max_age.reset(token)
+
+
+def get_snapshot_taken_at() -> datetime | None:
+    """Get when the current snapshot was copied (UTC), or None before the first one."""
+    return _snapshot_taken_at
+
+
+USER_SORT_COLUMNS = {
+    "last_activity": "last_activity",
+    "message_count": "message_count",
+    "email": "email_lower",
+}
 
 
 def new_session(user_id: str) -> str:
@@ -31,40 +491,189 @@ def new_session(user_id: str) -> str:
     return uuid4().hex
 
 
+@timed("db.save_message")
+@_synchronized
 def save_message(user_id: str, session_id: str, msg: dict):
     """Persist a single message (text or image)."""
+    content, codec = _encode_content(msg.get("content", ""))
     cur.execute(
         """
-        INSERT INTO messages(user_id, session_id, role, type, content, url)
-        VALUES (?, ?, ?, ?, ?, ?)
+        INSERT INTO messages(
+            user_id, session_id, role, type, content, content_codec, url, response_id
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
     """,
         (
             user_id,
             session_id,
             msg["role"],
             msg["type"],
-            msg.get("content", ""),
+            content,
+            codec,
             msg.get("url", ""),
+            msg.get("response_id"),
+        ),
+    )
+    cur.execute(
+        """
+        INSERT INTO user_directory(user_id, email_lower, message_count, last_activity)
+        VALUES (?, LOWER(?), 1, CURRENT_TIMESTAMP)
+        ON CONFLICT(user_id) DO UPDATE SET
+            message_count = message_count + 1,
+            last_activity = CURRENT_TIMESTAMP
+    """,
+        (user_id, user_id),
+    )
+    cur.execute(
+        """
+        INSERT INTO chat_sessions(
+            session_id, user_id, first_message, message_count, first_ts,
+            last_activity, last_response_id, pending_tool_call
+        )
+        VALUES (?, ?, SUBSTR(?, 1, 100), 1, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, ?, ?)
+        ON CONFLICT(session_id) DO UPDATE SET
+            message_count = message_count + 1,
+            last_activity = CURRENT_TIMESTAMP,
+            last_response_id = COALESCE(excluded.last_response_id, last_response_id),
+            pending_tool_call = CASE
+                WHEN excluded.last_response_id IS NULL THEN pending_tool_call
+                ELSE excluded.pending_tool_call
+            END
+    """,
+        (
+            session_id,
+            user_id,
+            msg.get("content") or "",
+            msg.get("response_id"),
+            msg.get("tool_call_id"),
         ),
     )
     conn.commit()
 
 
+def _archive_month(cur: sqlite3.Cursor, session_id: str) -> str | None:
+    cur.execute(
+        "SELECT archive_month FROM chat_sessions WHERE session_id = ?", (session_id,)
+    )
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+@timed("db.load_messages")
+@_snapshot_readable
 def load_messages(user_id: str, session_id: str) -> list[dict]:
     """Fetch all messages for this user & session, ordered chronologically."""
+    cur = _cursor()
     cur.execute(
         """
-        SELECT role, type, content, url
+        SELECT role, type, content, content_codec, url
         FROM messages
         WHERE user_id=? AND session_id=?
         ORDER BY ts
     """,
         (user_id, session_id),
     )
-    rows = cur.fetchall()
+    rows = [(r, t, _decode_content(c, codec), u) for r, t, c, codec, u in cur]
+    month = _archive_month(cur, session_id)
+    if month:
+        archived = archive.read_session(month, user_id, session_id)
+        rows = [row[1:] for row in archived] + rows
     return [{"role": r, "type": t, "content": c, "url": u} for r, t, c, u in rows]
 
 
+@_snapshot_readable
+def load_messages_page(
+    user_id: str, session_id: str, after_id: int = 0, limit: int = 20
+) -> list[dict]:
+    """
+    Fetch up to `limit` messages of a session that come after message `after_id`.
+    Keyset pagination on the message id, so every page costs the same
+    regardless of how deep into the session it is.
+    """
+    cur = _cursor()
+    rows = []
+    month = _archive_month(cur, session_id)
+    if month:
+        # Archived messages are older than any still in chat.db, so they come first
+        rows = archive.read_session(month, user_id, session_id, after_id, limit)
+        if rows:
+            after_id = rows[-1][0]
+    cur.execute(
+        """
+        SELECT id, role, type, content, content_codec, url
+        FROM messages
+        WHERE user_id=? AND session_id=? AND id > ?
+        ORDER BY id
+        LIMIT ?
+    """,
+        (user_id, session_id, after_id, limit - len(rows)),
+    )
+    rows += [(i, r, t, _decode_content(c, codec), u) for i, r, t, c, codec, u in cur]
+    return [
+        {"id": i, "role": r, "type": t, "content": c, "url": u}
+        for i, r, t, c, u in rows
+    ]
+
+
+@_snapshot_readable
+def get_message_id_at(user_id: str, session_id: str, position: int) -> int | None:
+    """Return the id of the message at a 0-based position in a session (index-only seek)."""
+    cur = _cursor()
+    month = _archive_month(cur, session_id)
+    if month:
+        archived_ids = [
+            row[0] for row in archive.read_session(month, user_id, session_id)
+        ]
+        if position < len(archived_ids):
+            return archived_ids[position]
+        position -= len(archived_ids)
+    cur.execute(
+        """
+        SELECT id
+        FROM messages
+        WHERE user_id=? AND session_id=?
+        ORDER BY id
+        LIMIT 1 OFFSET ?
+    """,
+        (user_id, session_id, position),
+    )
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+@_synchronized
+def get_session_thread(
+    user_id: str, session_id: str
+) -> tuple[str | None, str | None]:
+    """
+    Return (latest OpenAI response id, its unanswered generate_image call id)
+    for the session, to continue its thread.
+    """
+    cur.execute(
+        """
+        SELECT last_response_id, pending_tool_call FROM chat_sessions
+        WHERE session_id = ? AND user_id = ?
+    """,
+        (session_id, user_id),
+    )
+    row = cur.fetchone()
+    return row if row else (None, None)
+
+
+@_synchronized
+def reset_session_thread(user_id: str, session_id: str):
+    """Forget the session's OpenAI thread, so its next turn starts a new one."""
+    cur.execute(
+        """
+        UPDATE chat_sessions SET last_response_id = NULL, pending_tool_call = NULL
+        WHERE session_id = ? AND user_id = ?
+        """,
+        (session_id, user_id),
+    )
+    conn.commit()
+
+
+@_synchronized
 def get_sessions(user_id: str) -> list[str]:
     """Return all distinct session_ids for this user, ordered by first message timestamp."""
     cur.execute(
@@ -79,6 +688,12 @@ def get_sessions(user_id: str) -> list[str]:
     return [row[0] for row in cur.fetchall()]
 
 
+def _snippet(content: str | None, length: int) -> str:
+    content = content or ""
+    return (content[:length] + "...") if len(content) > length else content
+
+
+@_synchronized
 def get_session_summaries(user_id: str) -> list[tuple[str, str, str]]:
     """
     Returns a list of (session_id, snippet, ts) sorted by newest‑first.
@@ -87,27 +702,74 @@ def get_session_summaries(user_id: str) -> list[tuple[str, str, str]]:
     """
     cur.execute(
         """
-      SELECT m.session_id, m.content, m.ts
-      FROM messages m
-      JOIN (
-        SELECT session_id, MIN(ts) AS first_ts
-        FROM messages
-        WHERE user_id=?
-        GROUP BY session_id
-      ) sub
-      ON m.session_id = sub.session_id AND m.ts = sub.first_ts
-      ORDER BY sub.first_ts DESC
+      SELECT session_id, first_message, first_ts
+      FROM chat_sessions
+      WHERE user_id=?
+      ORDER BY first_ts DESC
     """,
         (user_id,),
     )
     rows = cur.fetchall()
-    summaries = []
-    for session_id, content, ts in rows:
-        snippet = (content[:20] + "...") if len(content) > 20 else content
-        summaries.append((session_id, snippet, ts))
-    return summaries
+    return [
+        (session_id, _snippet(content, 20), ts) for session_id, content, ts in rows
+    ]
+
+
+HISTORY_BUCKETS = ("Today", "Last Week", "Previous Chats")
 
 
+@_synchronized
+def get_session_history(
+    user_id: str, tz_name: str, limits: dict[str, int]
+) -> dict[str, tuple[list[tuple[str, str, str]], bool]]:
+    """
+    Returns the user's sessions grouped into HISTORY_BUCKETS for a timezone.
+    Each bucket maps to ([(session_id, snippet, local_date_str), ...], has_more),
+    newest first and holding at most limits[bucket] sessions.
+    Bucket boundaries are converted to UTC so each bucket is one index range scan.
+    """
+    import pytz  # only the chat sidebar needs it; keeps it out of import time
+
+    tz = pytz.timezone(tz_name)
+    today_local = datetime.now(pytz.utc).astimezone(tz).date()
+
+    def utc_midnight(day) -> str:
+        local_midnight = tz.localize(datetime.combine(day, day_time.min))
+        return local_midnight.astimezone(pytz.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+    today_start = utc_midnight(today_local)
+    week_start = utc_midnight(today_local - timedelta(days=6))
+    ranges = {
+        "Today": (today_start, "9999-12-31"),
+        "Last Week": (week_start, today_start),
+        "Previous Chats": ("", week_start),
+    }
+
+    history = {}
+    for bucket in HISTORY_BUCKETS:
+        start, end = ranges[bucket]
+        limit = limits.get(bucket, 0)
+        cur.execute(
+            """
+            SELECT session_id, first_message, first_ts
+            FROM chat_sessions
+            WHERE user_id=? AND first_ts >= ? AND first_ts < ?
+            ORDER BY first_ts DESC
+            LIMIT ?
+        """,
+            (user_id, start, end, limit + 1),
+        )
+        rows = cur.fetchall()
+        items = []
+        for session_id, content, ts in rows[:limit]:
+            utc_dt = pytz.utc.localize(datetime.strptime(ts, "%Y-%m-%d %H:%M:%S"))
+            date_str = utc_dt.astimezone(tz).strftime("%m/%d/%Y")
+            items.append((session_id, _snippet(content, 20), date_str))
+        history[bucket] = (items, len(rows) > limit)
+    return history
+
+
+@_synchronized
 def get_all_users_with_chats() -> list[tuple[str, int, str]]:
     """
     Returns a list of (user_id, message_count, last_activity) for all users with chat data.
@@ -115,30 +777,72 @@ def get_all_users_with_chats() -> list[tuple[str, int, str]]:
     """
     cur.execute(
         """
-        SELECT user_id, COUNT(*) as message_count, MAX(ts) as last_activity
-        FROM messages
-        GROUP BY user_id
+        SELECT user_id, message_count, last_activity
+        FROM user_directory
         ORDER BY last_activity DESC
         """
     )
     return cur.fetchall()
 
 
+def _prefix_upper_bound(prefix: str) -> str:
+    """Smallest string greater than every string starting with prefix."""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+@_snapshot_readable
+def get_users_page(
+    search_prefix: str = "",
+    sort_by: str = "last_activity",
+    descending: bool = True,
+    page: int = 0,
+    page_size: int = 25,
+) -> tuple[list[tuple[str, int, str]], int]:
+    """
+    Returns one page of (user_id, message_count, last_activity) from the user
+    directory, plus the total number of matching users.
+    search_prefix is matched case-insensitively against the start of the email.
+    sort_by is one of USER_SORT_COLUMNS.
+    """
+    cur = _cursor()
+    if sort_by not in USER_SORT_COLUMNS:
+        raise ValueError(f"Unknown sort column: {sort_by}")
+    order = "DESC" if descending else "ASC"
+    where, params = "", []
+    prefix = search_prefix.strip().lower()
+    if prefix:
+        # Range scan on the email index instead of a LIKE over every row
+        where = "WHERE email_lower >= ? AND email_lower < ?"
+        params = [prefix, _prefix_upper_bound(prefix)]
+
+    cur.execute(f"SELECT COUNT(*) FROM user_directory {where}", params)
+    total = cur.fetchone()[0]
+
+    cur.execute(
+        f"""
+        SELECT user_id, message_count, last_activity
+        FROM user_directory
+        {where}
+        ORDER BY {USER_SORT_COLUMNS[sort_by]} {order}, user_id
+        LIMIT ? OFFSET ?
+        """,
+        params + [page_size, page * page_size],
+    )
+    return cur.fetchall(), total
+
+
+@_snapshot_readable
 def get_user_chat_sessions(user_id: str) -> list[tuple[str, str, int, str]]:
     """
     Returns a list of (session_id, snippet, message_count, last_activity) for a specific user.
     Sorted by last activity (newest first).
     """
+    cur = _cursor()
     cur.execute(
         """
-        SELECT 
-            session_id,
-            (SELECT content FROM messages m2 WHERE m2.session_id = m.session_id AND m2.user_id = m.user_id ORDER BY ts LIMIT 1) as first_message,
-            COUNT(*) as message_count,
-            MAX(ts) as last_activity
-        FROM messages m
+        SELECT session_id, first_message, message_count, last_activity
+        FROM chat_sessions
         WHERE user_id = ?
-        GROUP BY session_id
         ORDER BY last_activity DESC
         """,
         (user_id,),
@@ -156,8 +860,10 @@ def get_user_chat_sessions(user_id: str) -> list[tuple[str, str, int, str]]:
 
 
 # User-specific analytics functions
+@_snapshot_readable
 def get_user_total_images_created(user_id: str) -> int:
     """Get total number of images created by AI for a specific user."""
+    cur = _cursor()
     cur.execute(
         """
         SELECT COUNT(*) FROM messages 
@@ -168,8 +874,10 @@ def get_user_total_images_created(user_id: str) -> int:
     return cur.fetchone()[0]
 
 
+@_snapshot_readable
 def get_user_images_created_over_time(user_id: str) -> list[tuple[str, int]]:
     """Get number of images created per day for a specific user."""
+    cur = _cursor()
     cur.execute(
         """
         SELECT DATE(ts) as date, COUNT(*) as count
@@ -183,8 +891,10 @@ def get_user_images_created_over_time(user_id: str) -> list[tuple[str, int]]:
     return cur.fetchall()
 
 
+@_snapshot_readable
 def get_user_activity_over_time(user_id: str) -> list[tuple[str, int]]:
     """Get user activity per day for a specific user (all messages)."""
+    cur = _cursor()
     cur.execute(
         """
         SELECT DATE(ts) as date, COUNT(*) as message_count
@@ -198,8 +908,10 @@ def get_user_activity_over_time(user_id: str) -> list[tuple[str, int]]:
     return cur.fetchall()
 
 
+@_snapshot_readable
 def get_user_messages_over_time(user_id: str) -> list[tuple[str, int]]:
     """Get only user messages per day (excluding AI responses)."""
+    cur = _cursor()
     cur.execute(
         """
         SELECT DATE(ts) as date, COUNT(*) as user_message_count
@@ -213,8 +925,10 @@ def get_user_messages_over_time(user_id: str) -> list[tuple[str, int]]:
     return cur.fetchall()
 
 
+@_snapshot_readable
 def get_user_message_distribution(user_id: str) -> list[tuple[str, int]]:
     """Get distribution of message types for a specific user."""
+    cur = _cursor()
     cur.execute(
         """
         SELECT 
@@ -235,8 +949,10 @@ def get_user_message_distribution(user_id: str) -> list[tuple[str, int]]:
     return cur.fetchall()
 
 
+@_snapshot_readable
 def get_user_hourly_breakdown(user_id: str) -> list[tuple[int, int, int]]:
     """Get hourly breakdown of user messages vs AI responses."""
+    cur = _cursor()
     cur.execute(
         """
         SELECT 
@@ -253,8 +969,10 @@ def get_user_hourly_breakdown(user_id: str) -> list[tuple[int, int, int]]:
     return cur.fetchall()
 
 
+@_snapshot_readable
 def get_user_session_length_stats(user_id: str) -> list[tuple[str, int, int]]:
     """Get session statistics for a specific user: (session_id, message_count, duration_minutes)."""
+    cur = _cursor()
     cur.execute(
         """
         SELECT 
@@ -273,33 +991,39 @@ def get_user_session_length_stats(user_id: str) -> list[tuple[str, int, int]]:
     return cur.fetchall()
 
 
+@_snapshot_readable
 def get_user_total_messages(user_id: str) -> int:
     """Get total number of messages for a specific user."""
+    cur = _cursor()
     cur.execute(
         """
-        SELECT COUNT(*) FROM messages WHERE user_id = ?
+        SELECT COALESCE(MAX(message_count), 0) FROM user_directory WHERE user_id = ?
         """,
         (user_id,),
     )
     return cur.fetchone()[0]
 
 
+@_snapshot_readable
 def get_user_total_sessions(user_id: str) -> int:
     """Get total number of sessions for a specific user."""
+    cur = _cursor()
     cur.execute(
         """
-        SELECT COUNT(DISTINCT session_id) FROM messages WHERE user_id = ?
+        SELECT COUNT(*) FROM chat_sessions WHERE user_id = ?
         """,
         (user_id,),
     )
     return cur.fetchone()[0]
 
 
+@_snapshot_readable
 def get_user_last_activity(user_id: str) -> str:
     """Get last activity date for a specific user."""
+    cur = _cursor()
     cur.execute(
         """
-        SELECT MAX(ts) FROM messages WHERE user_id = ?
+        SELECT MAX(last_activity) FROM user_directory WHERE user_id = ?
         """,
         (user_id,),
     )
@@ -307,18 +1031,35 @@ def get_user_last_activity(user_id: str) -> str:
     return result if result else "Never"
 
 
+@_snapshot_readable
 def export_user_chat_data(user_id: str) -> list[dict]:
     """Export all chat data for a specific user."""
+    cur = _cursor()
     cur.execute(
         """
-        SELECT session_id, role, type, content, url, ts
+        SELECT session_id, role, type, content, content_codec, url, ts
         FROM messages
         WHERE user_id = ?
         ORDER BY ts
         """,
         (user_id,),
     )
-    rows = cur.fetchall()
+    rows = [
+        (session_id, role, type_, _decode_content(content, codec), url, ts)
+        for session_id, role, type_, content, codec, url, ts in cur.fetchall()
+    ]
+    cur.execute(
+        """
+        SELECT DISTINCT archive_month FROM chat_sessions
+        WHERE user_id = ? AND archive_month IS NOT NULL
+        """,
+        (user_id,),
+    )
+    archived = [
+        row for (month,) in cur.fetchall() for row in archive.read_user(month, user_id)
+    ]
+    if archived:
+        rows = sorted(archived + rows, key=lambda row: row[5])
     return [
         {
             "session_id": row[0],
@@ -330,3 +1071,595 @@ def export_user_chat_data(user_id: str) -> list[dict]:
         }
         for row in rows
     ]
+
+
+# Global analytics aggregates
+@_synchronized
+def refresh_aggregates(max_rows: int = 50_000) -> int:
+    """
+    Fold the next messages added since the last refresh into the aggregate
+    tables, at most max_rows ids past the stored watermark per call, so one
+    call holds the connection only briefly. Returns how many ids it covered;
+    max_rows means more may be pending.
+    """
+    # The watermark is read and moved in one write transaction, so replicas
+    # refreshing at the same moment never fold the same rows twice
+    with _write_transaction():
+        return _fold_new_messages(max_rows)
+
+
+def _aggregated_through(cur: sqlite3.Cursor) -> int:
+    cur.execute(
+        "SELECT COALESCE((SELECT last_id FROM agg_watermarks WHERE name = 'messages'), 0)"
+    )
+    return cur.fetchone()[0]
+
+
+def _fold_new_messages(max_rows: int) -> int:
+    last_id = _aggregated_through(cur)
+    cur.execute("SELECT COALESCE(MAX(id), 0) FROM messages")
+    max_id = min(cur.fetchone()[0], last_id + max_rows)
+
+    if max_id > last_id:
+        cur.execute("DROP TABLE IF EXISTS temp.agg_delta")
+        cur.execute(
+            """
+            CREATE TEMP TABLE agg_delta AS
+            SELECT
+                DATE(ts) AS day,
+                user_id,
+                COUNT(*) AS messages,
+                SUM(role = 'user') AS user_messages,
+                SUM(role = 'assistant' AND type != 'text') AS images
+            FROM messages
+            WHERE id > ? AND id <= ?
+            GROUP BY day, user_id
+            """,
+            (last_id, max_id),
+        )
+
+        # Users seen for the first time on a day add to that day's active count
+        cur.execute(
+            """
+            INSERT INTO agg_daily(day, messages, user_messages, images, active_users)
+            SELECT
+                d.day,
+                SUM(d.messages),
+                SUM(d.user_messages),
+                SUM(d.images),
+                SUM(u.user_id IS NULL)
+            FROM agg_delta d
+            LEFT JOIN agg_daily_user u ON u.day = d.day AND u.user_id = d.user_id
+            GROUP BY d.day
+            ON CONFLICT(day) DO UPDATE SET
+                messages = messages + excluded.messages,
+                user_messages = user_messages + excluded.user_messages,
+                images = images + excluded.images,
+                active_users = active_users + excluded.active_users
+            """
+        )
+        cur.execute(
+            """
+            INSERT INTO agg_daily_user(day, user_id, messages, images)
+            SELECT day, user_id, messages, images FROM agg_delta WHERE true
+            ON CONFLICT(day, user_id) DO UPDATE SET
+                messages = messages + excluded.messages,
+                images = images + excluded.images
+            """
+        )
+        cur.execute(
+            """
+            INSERT INTO agg_user_totals(user_id, messages, images)
+            SELECT user_id, SUM(messages), SUM(images) FROM agg_delta GROUP BY user_id
+            ON CONFLICT(user_id) DO UPDATE SET
+                messages = messages + excluded.messages,
+                images = images + excluded.images
+            """
+        )
+        cur.execute(
+            """
+            INSERT INTO agg_hourly(day, hour, user_messages, ai_responses)
+            SELECT
+                DATE(ts),
+                CAST(strftime('%H', ts) AS INTEGER),
+                SUM(role = 'user'),
+                SUM(role = 'assistant')
+            FROM messages
+            WHERE id > ? AND id <= ?
+            GROUP BY 1, 2
+            ON CONFLICT(day, hour) DO UPDATE SET
+                user_messages = user_messages + excluded.user_messages,
+                ai_responses = ai_responses + excluded.ai_responses
+            """,
+            (last_id, max_id),
+        )
+
+        # Weekly actives only change for the 7 days starting at each touched day
+        cur.execute(
+            """
+            UPDATE agg_daily
+            SET weekly_active_users = (
+                SELECT COUNT(DISTINCT user_id) FROM agg_daily_user u
+                WHERE u.day BETWEEN DATE(agg_daily.day, '-6 days') AND agg_daily.day
+            )
+            WHERE day IN (
+                SELECT DISTINCT DATE(d.day, '+' || n.k || ' days')
+                FROM agg_delta d,
+                     (SELECT 0 AS k UNION ALL SELECT 1 UNION ALL SELECT 2
+                      UNION ALL SELECT 3 UNION ALL SELECT 4 UNION ALL SELECT 5
+                      UNION ALL SELECT 6) n
+            )
+            """
+        )
+        cur.execute("DROP TABLE temp.agg_delta")
+
+    cur.execute(
+        """
+        INSERT INTO agg_watermarks(name, last_id, refreshed_at)
+        VALUES ('messages', ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(name) DO UPDATE SET
+            last_id = excluded.last_id,
+            refreshed_at = excluded.refreshed_at
+        """,
+        (max_id,),
+    )
+    return max_id - last_id
+
+
+@_snapshot_readable
+def get_aggregates_refreshed_at() -> str | None:
+    """Get when the aggregate tables were last refreshed (UTC)."""
+    cur = _cursor()
+    cur.execute("SELECT refreshed_at FROM agg_watermarks WHERE name = 'messages'")
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+@_snapshot_readable
+def get_global_totals() -> tuple[int, int, int]:
+    """Get (total messages, total images, total users) across all users."""
+    cur = _cursor()
+    cur.execute(
+        "SELECT COALESCE(SUM(messages), 0), COALESCE(SUM(images), 0) FROM agg_daily"
+    )
+    messages, images = cur.fetchone()
+    cur.execute("SELECT COUNT(*) FROM agg_user_totals")
+    return messages, images, cur.fetchone()[0]
+
+
+@_snapshot_readable
+def get_global_daily_stats(days: int = 90) -> list[tuple[str, int, int, int, int, int]]:
+    """Get (date, messages, user_messages, images, daily_active_users, weekly_active_users) per day."""
+    cur = _cursor()
+    cur.execute(
+        """
+        SELECT day, messages, user_messages, images, active_users, weekly_active_users
+        FROM agg_daily
+        WHERE day >= DATE('now', ?)
+        ORDER BY day
+        """,
+        (f"-{int(days)} days",),
+    )
+    return cur.fetchall()
+
+
+@_snapshot_readable
+def get_global_hourly_heatmap(days: int = 90) -> list[tuple[int, int, int]]:
+    """Get (weekday 0=Sunday, hour, message_count) over the last `days` days."""
+    cur = _cursor()
+    cur.execute(
+        """
+        SELECT
+            CAST(strftime('%w', day) AS INTEGER) AS weekday,
+            hour,
+            SUM(user_messages + ai_responses)
+        FROM agg_hourly
+        WHERE day >= DATE('now', ?)
+        GROUP BY weekday, hour
+        ORDER BY weekday, hour
+        """,
+        (f"-{int(days)} days",),
+    )
+    return cur.fetchall()
+
+
+@_snapshot_readable
+def get_top_users(limit: int = 10, by: str = "images") -> list[tuple[str, int, int]]:
+    """Get the top users as (user_id, messages, images), ordered by images or messages."""
+    cur = _cursor()
+    if by not in ("images", "messages"):
+        raise ValueError(f"Unknown ranking column: {by}")
+    cur.execute(
+        f"""
+        SELECT user_id, messages, images
+        FROM agg_user_totals
+        ORDER BY {by} DESC
+        LIMIT ?
+        """,
+        (limit,),
+    )
+    return cur.fetchall()
+
+
+# API usage metering
+@_synchronized
+def save_api_calls(calls: list[dict]):
+    """Persist a batch of metered API calls and fold them into the daily usage table."""
+    cur.executemany(
+        """
+        INSERT INTO api_calls(
+            user_id, session_id, kind, model, input_tokens, output_tokens,
+            image_count, image_size, duration_ms, outcome, ts
+        )
+        VALUES (
+            :user_id, :session_id, :kind, :model, :input_tokens, :output_tokens,
+            :image_count, :image_size, :duration_ms, :outcome, :ts
+        )
+        """,
+        calls,
+    )
+    cur.executemany(
+        """
+        INSERT INTO api_usage_daily(
+            day, user_id, model, calls, errors, input_tokens, output_tokens,
+            images, total_ms, max_ms
+        )
+        VALUES (
+            DATE(:ts), :user_id, :model, 1, :outcome != 'ok', :input_tokens,
+            :output_tokens, :image_count, :duration_ms, :duration_ms
+        )
+        ON CONFLICT(day, user_id, model) DO UPDATE SET
+            calls = calls + 1,
+            errors = errors + excluded.errors,
+            input_tokens = input_tokens + excluded.input_tokens,
+            output_tokens = output_tokens + excluded.output_tokens,
+            images = images + excluded.images,
+            total_ms = total_ms + excluded.total_ms,
+            max_ms = MAX(max_ms, excluded.max_ms)
+        """,
+        calls,
+    )
+    conn.commit()
+
+
+@_snapshot_readable
+def get_usage_by_day(days: int = 30) -> list[tuple]:
+    """Get (date, model, calls, errors, input_tokens, output_tokens, images, total_ms) per day and model."""
+    cur = _cursor()
+    cur.execute(
+        """
+        SELECT day, model, SUM(calls), SUM(errors), SUM(input_tokens),
+               SUM(output_tokens), SUM(images), SUM(total_ms)
+        FROM api_usage_daily
+        WHERE day >= DATE('now', ?)
+        GROUP BY day, model
+        ORDER BY day, model
+        """,
+        (f"-{int(days)} days",),
+    )
+    return cur.fetchall()
+
+
+@_snapshot_readable
+def get_usage_by_user(days: int = 30) -> list[tuple]:
+    """Get (user_id, model, calls, errors, input_tokens, output_tokens, images, total_ms, max_ms) per user and model."""
+    cur = _cursor()
+    cur.execute(
+        """
+        SELECT user_id, model, SUM(calls), SUM(errors), SUM(input_tokens),
+               SUM(output_tokens), SUM(images), SUM(total_ms), MAX(max_ms)
+        FROM api_usage_daily
+        WHERE day >= DATE('now', ?)
+        GROUP BY user_id, model
+        """,
+        (f"-{int(days)} days",),
+    )
+    return cur.fetchall()
+
+
+# Archival of cold sessions
+@_synchronized
+def archive_cold_sessions(
+    older_than_days: int = archive.ARCHIVE_AFTER_DAYS, max_sessions: int = 100
+) -> int:
+    """
+    Move up to max_sessions sessions idle for older_than_days into the monthly
+    archive databases and return how many were moved. Their chat_sessions rows
+    stay, pointing at the archive, so history lists and reads are unchanged.
+    Sessions continued after archival have their new messages moved into the
+    same month's archive.
+    """
+    # Archived rows leave the messages table, so only sessions whose messages
+    # refresh_aggregates has already counted are moved
+    aggregated_through = _aggregated_through(cur)
+    cur.execute(
+        """
+        SELECT session_id, user_id, COALESCE(archive_month, strftime('%Y-%m', first_ts))
+        FROM chat_sessions
+        WHERE last_activity < DATETIME('now', ?)
+          AND (archive_month IS NULL OR last_activity >= archived_at)
+        ORDER BY last_activity
+        LIMIT ?
+        """,
+        (f"-{int(older_than_days)} days", max_sessions),
+    )
+    by_month = {}
+    for session_id, user_id, month in cur.fetchall():
+        by_month.setdefault(month, []).append((user_id, session_id))
+
+    moved = 0
+    for month, sessions in by_month.items():
+        rows, moved_sessions = [], []
+        for user_id, session_id in sessions:
+            cur.execute(
+                """
+                SELECT id, user_id, session_id, role, type, content, content_codec, url, ts
+                FROM messages
+                WHERE user_id = ? AND session_id = ?
+                """,
+                (user_id, session_id),
+            )
+            session_rows = cur.fetchall()
+            if any(row[0] > aggregated_through for row in session_rows):
+                continue  # moved on a later run, once the aggregates have caught up
+            # The archive compresses content itself, so it is given plain text
+            rows += [
+                (*row[:5], _decode_content(row[5], row[6]), *row[7:])
+                for row in session_rows
+            ]
+            moved_sessions.append(session_id)
+        # The archive is committed before anything is deleted here
+        archive.write_messages(month, rows)
+        cur.executemany(
+            "DELETE FROM messages WHERE id = ?", [(row[0],) for row in rows]
+        )
+        cur.executemany(
+            """
+            UPDATE chat_sessions SET archive_month = ?, archived_at = CURRENT_TIMESTAMP
+            WHERE session_id = ?
+            """,
+            [(month, session_id) for session_id in moved_sessions],
+        )
+        conn.commit()
+        moved += len(moved_sessions)
+    return moved
+
+
+# Compression of message content stored before it was compressed on write
+@_synchronized
+def compress_stored_content(max_rows: int = 500) -> tuple[int, int, int]:
+    """
+    Look at the next max_rows messages after the last one this scanned and
+    compress the plain content of those at or above COMPRESS_MIN_CHARS.
+    Returns (rows scanned, rows compressed, bytes saved).
+    """
+    if CONTENT_CODEC == "none":
+        return 0, 0, 0
+    # One transaction, so replicas never compress the same batch
+    with _write_transaction():
+        cur.execute(
+            "SELECT COALESCE((SELECT last_id FROM agg_watermarks WHERE name = 'content_codec'), 0)"
+        )
+        last_id = cur.fetchone()[0]
+        # Keyset batches on the id, so every step reads at most max_rows rows
+        cur.execute(
+            """
+            SELECT id, content FROM messages
+            WHERE id > ? AND content_codec IS NULL
+            ORDER BY id
+            LIMIT ?
+            """,
+            (last_id, max_rows),
+        )
+        rows = cur.fetchall()
+        if not rows:
+            return 0, 0, 0
+        updates, saved = [], 0
+        for message_id, content in rows:
+            value, codec = _encode_content(content)
+            if codec is not None:
+                updates.append((value, codec, message_id))
+                saved += len(content.encode("utf-8")) - len(value)
+        cur.executemany(
+            "UPDATE messages SET content = ?, content_codec = ? WHERE id = ?", updates
+        )
+        cur.execute(
+            """
+            INSERT INTO agg_watermarks(name, last_id, refreshed_at)
+            VALUES ('content_codec', ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(name) DO UPDATE SET
+                last_id = excluded.last_id,
+                refreshed_at = excluded.refreshed_at
+            """,
+            (rows[-1][0],),
+        )
+    return len(rows), len(updates), saved
+
+
+# Image file accounting
+@_synchronized
+def record_image_files(files: list[tuple[str, str, int, str | None]]):
+    """Track (path, user_id, bytes, created_at or None for now) image files; known paths are kept."""
+    cur.executemany(
+        """
+        INSERT OR IGNORE INTO image_files(path, user_id, bytes, created_at)
+        VALUES (?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+        """,
+        files,
+    )
+    conn.commit()
+
+
+@_synchronized
+def mark_image_recompressed(path: str, size: int):
+    """Record the new size of an image after recompression."""
+    cur.execute(
+        """
+        UPDATE image_files SET bytes = ?, recompressed_at = CURRENT_TIMESTAMP
+        WHERE path = ?
+        """,
+        (size, path),
+    )
+    conn.commit()
+
+
+@_synchronized
+def forget_image_files(paths: list[str]):
+    """Stop tracking image files that were deleted."""
+    cur.executemany("DELETE FROM image_files WHERE path = ?", [(p,) for p in paths])
+    conn.commit()
+
+
+@_synchronized
+def get_cold_image_files(older_than_days: int, limit: int = 100) -> list[str]:
+    """Get paths of images never recompressed and created more than older_than_days ago."""
+    cur.execute(
+        """
+        SELECT path FROM image_files
+        WHERE recompressed_at IS NULL AND created_at < DATETIME('now', ?)
+          AND path LIKE '%.png'  -- uploads keep their own format
+        ORDER BY created_at
+        LIMIT ?
+        """,
+        (f"-{int(older_than_days)} days", limit),
+    )
+    return [row[0] for row in cur.fetchall()]
+
+
+@_synchronized
+def get_tracked_image_paths() -> set[str]:
+    """Get the paths of all tracked image files."""
+    cur.execute("SELECT path FROM image_files")
+    return {row[0] for row in cur.fetchall()}
+
+
+@_synchronized
+def get_referenced_image_urls() -> set[str]:
+    """Get every image path referenced by a message in chat.db."""
+    cur.execute("SELECT DISTINCT url FROM messages WHERE url != ''")
+    return {row[0] for row in cur.fetchall()}
+
+
+@_synchronized
+def get_attachment(user_id: str, sha256: str) -> tuple[str, str, str | None] | None:
+    """Get (path, mime, provider_file_id) of a stored attachment, or None."""
+    cur.execute(
+        """
+        SELECT path, mime, provider_file_id FROM attachments
+        WHERE user_id = ? AND sha256 = ?
+        """,
+        (user_id, sha256),
+    )
+    return cur.fetchone()
+
+
+@_synchronized
+def save_attachment(user_id: str, sha256: str, path: str, mime: str):
+    """Record a stored attachment; an existing one keeps its provider file id."""
+    cur.execute(
+        """
+        INSERT INTO attachments(user_id, sha256, path, mime)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(user_id, sha256) DO UPDATE SET path = excluded.path
+        """,
+        (user_id, sha256, path, mime),
+    )
+    conn.commit()
+
+
+@_synchronized
+def set_attachment_file_id(user_id: str, sha256: str, file_id: str | None):
+    """Remember (or with None, forget) the provider's id for an uploaded attachment."""
+    cur.execute(
+        "UPDATE attachments SET provider_file_id = ? WHERE user_id = ? AND sha256 = ?",
+        (file_id, user_id, sha256),
+    )
+    conn.commit()
+
+
+@_snapshot_readable
+def get_user_image_bytes(user_id: str) -> int:
+    """Get the bytes of image storage a user currently holds."""
+    cur = _cursor()
+    cur.execute(
+        "SELECT COALESCE(SUM(bytes), 0) FROM image_files WHERE user_id = ?", (user_id,)
+    )
+    return cur.fetchone()[0]
+
+
+@_snapshot_readable
+def get_image_storage_by_user(limit: int = 20) -> list[tuple[str, int, int]]:
+    """Get (user_id, files, bytes) for the users holding the most image storage."""
+    cur = _cursor()
+    cur.execute(
+        """
+        SELECT user_id, COUNT(*), SUM(bytes) AS total
+        FROM image_files
+        GROUP BY user_id
+        ORDER BY total DESC
+        LIMIT ?
+        """,
+        (limit,),
+    )
+    return cur.fetchall()
+
+
+@_snapshot_readable
+def get_image_storage_totals() -> tuple[int, int, int]:
+    """Get (files, bytes, recompressed files) over all tracked images."""
+    cur = _cursor()
+    cur.execute(
+        """
+        SELECT COUNT(*), COALESCE(SUM(bytes), 0), COUNT(recompressed_at)
+        FROM image_files
+        """
+    )
+    return cur.fetchone()
+
+
+@_synchronized
+def arm_profiling(user_id: str, runs: int, page: str | None = None):
+    """Profile the user's next `runs` reruns of `page` (or any page)."""
+    cur.execute(
+        """
+        INSERT INTO profiling_armed(user_id, page, remaining) VALUES (?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            page = excluded.page, remaining = excluded.remaining
+        """,
+        (user_id, page, runs),
+    )
+    conn.commit()
+
+
+@_synchronized
+def disarm_profiling(user_id: str):
+    cur.execute("DELETE FROM profiling_armed WHERE user_id = ?", (user_id,))
+    conn.commit()
+
+
+@_synchronized
+def get_profiling_armed() -> dict[str, dict]:
+    """Return {user_id: {"page", "remaining"}} for every armed user."""
+    cur.execute("SELECT user_id, page, remaining FROM profiling_armed")
+    return {
+        user_id: {"page": page, "remaining": remaining}
+        for user_id, page, remaining in cur.fetchall()
+    }
+
+
+@_synchronized
+def claim_profiling_run(user_id: str, page: str) -> bool:
+    """Use up one armed run of the user for this page; False if none is left."""
+    cur.execute(
+        """
+        UPDATE profiling_armed SET remaining = remaining - 1
+        WHERE user_id = ? AND (page IS NULL OR page = ?) AND remaining > 0
+        """,
+        (user_id, page),
+    )
+    claimed = cur.rowcount > 0
+    cur.execute(
+        "DELETE FROM profiling_armed WHERE user_id = ? AND remaining <= 0", (user_id,)
+    )
+    conn.commit()
+    return claimed
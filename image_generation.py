@@ -1,19 +1,92 @@
 import os
 import base64
-import requests
+import threading
 import streamlit as st
 from uuid import uuid4
-from openai import OpenAI
 import json
-
-client = OpenAI()
+from image_server import IMAGES_DIR
+from metrics import timer
+from metering import metered
+from admission import admit
+import resilience
+import attachments
+import db
+from shared import write_atomic
+import image_store
+
+# The OpenAI SDK takes about a second to import, so the client is built on the
+# first API call instead of when the chat page loads. Tests may assign a
+# replacement to `client` directly.
+client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the shared OpenAI client, creating it on first use."""
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                from openai import OpenAI
+
+                # Retries and timeouts are handled per step by resilience.call
+                client = OpenAI(max_retries=0)
+    return client
+
+
+IMAGE_SIZE = "1024x1024"
+# How the model asks for an image (IMAGE_TOOL secret): "function" declares this
+# tool and the app calls the Images API; "builtin" uses the Responses API
+# image_generation tool, which returns the image in the same call.
+GENERATE_IMAGE_TOOL = {
+    "type": "function",
+    "name": "generate_image",
+    "description": "Create an origami illustration for the user.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "prompt": {
+                "type": "string",
+                "description": "Detailed description of the image to create.",
+            }
+        },
+        "required": ["prompt"],
+        "additionalProperties": False,
+    },
+    "strict": True,
+}
+QUOTA_NOTE = (
+    "Image generation is unavailable for this user because their image storage "
+    "limit is reached. Explain this if they ask for an image and help in text."
+)
+
+
+def _save_image(data: bytes, user_id: str) -> str:
+    folder = os.path.join(IMAGES_DIR, user_id)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{uuid4().hex}.png")
+    write_atomic(path, data)
+    image_store.record_image(path, user_id)
+    return path
 
 
-def generate_image(prompt: str, user_id: str) -> tuple[str, str]:
+def generate_image(
+    prompt: str, user_id: str, session_id: str | None = None
+) -> tuple[str, str]:
     """Call OpenAI to generate an image, download it locally, return local path & revised prompt."""
-    image_response = client.images.generate(
-        model=st.secrets["MODEL_IMAGE"], prompt=prompt, n=1, size="1024x1024"
-    )
+    model = st.secrets["MODEL_IMAGE"]
+    with admit(user_id, model), timer("ai.image_generate"), metered(
+        user_id, session_id, "image", model
+    ) as usage:
+        # Each attempt may be billed, so only refused requests are retried
+        image_response = resilience.call(
+            "image",
+            lambda timeout: get_client().images.generate(
+                model=model, prompt=prompt, n=1, size=IMAGE_SIZE, timeout=timeout
+            ),
+            idempotent=False,
+        )
+        usage["image_count"], usage["image_size"] = 1, IMAGE_SIZE
 
     image_data = image_response.data[0]
     image_url = image_data.url
@@ -21,52 +94,88 @@ def generate_image(prompt: str, user_id: str) -> tuple[str, str]:
     revised_prompt = getattr(image_data, "revised_prompt", None)
 
     # fetch & save locally
-    r = requests.get(image_url)
-    folder = os.path.join("images", user_id)
-    os.makedirs(folder, exist_ok=True)
-    fname = f"{uuid4().hex}.png"
-    path = os.path.join(folder, fname)
-    with open(path, "wb") as f:
-        f.write(r.content)
-
-    return path, revised_prompt
-
-
-def handle_response(response_text: str, response_id: str, user_id: str) -> dict:
-    """Parse assistant output; if JSON instructs image, generate and return image message."""
-    try:
-        parsed = json.loads(response_text)
-        if parsed.get("action") == "generate_image":
-            image_prompt = parsed["prompt"]
-            image_path, revised_prompt = generate_image(image_prompt, user_id)
+    import requests
+
+    def download(timeout):
+        r = requests.get(image_url, timeout=timeout)
+        r.raise_for_status()
+        return r.content
+
+    with timer("ai.image_download"):
+        content = resilience.call("download", download, upstream="image-download")
+    return _save_image(content, user_id), revised_prompt
+
+
+def image_tools(user_id: str) -> list[dict]:
+    """Tools offered to the model this turn; none once the user is over their image quota."""
+    quota_mb = st.secrets.get("IMAGE_QUOTA_MB")
+    if quota_mb and image_store.over_quota(user_id, float(quota_mb)):
+        return []
+    if st.secrets.get("IMAGE_TOOL", "function") == "builtin":
+        return [{"type": "image_generation", "size": IMAGE_SIZE}]
+    return [GENERATE_IMAGE_TOOL]
+
+
+def handle_response(res, user_id: str, session_id: str | None = None) -> dict:
+    """Turn a Responses result into a chat message, running any image tool call it holds."""
+    for item in res.output:
+        if item.type == "image_generation_call" and item.result:
+            # Built-in tool: the image is already in the response
+            path = _save_image(base64.b64decode(item.result), user_id)
             return {
                 "role": "assistant",
                 "type": "image",
-                "content": revised_prompt,
+                "content": getattr(item, "revised_prompt", None) or res.output_text,
+                "url": path,
+                "response_id": res.id,
+            }
+        if item.type == "function_call" and item.name == "generate_image":
+            # Strict schema: arguments are always valid JSON with a prompt
+            image_prompt = json.loads(item.arguments)["prompt"]
+            image_path, revised_prompt = generate_image(
+                image_prompt, user_id, session_id
+            )
+            return {
+                "role": "assistant",
+                "type": "image",
+                "content": revised_prompt or image_prompt,
                 "url": image_path,
-                "response_id": response_id,
+                "response_id": res.id,
+                # Answered at the start of the next turn, which continues this response
+                "tool_call_id": item.call_id,
             }
-    except json.JSONDecodeError:
-        # except Exception as e:
-        # Normal chat response
-        pass
 
     return {
         "role": "assistant",
         "type": "text",
-        "content": response_text,
-        "response_id": response_id,
+        "content": res.output_text,
+        "response_id": res.id,
     }
 
 
+def _thread_expired(error: resilience.RequestRejected) -> bool:
+    """Whether a request was rejected because its previous_response_id is gone."""
+    cause = error.__cause__
+    if getattr(cause, "code", None) == "previous_response_not_found":
+        return True
+    message = str(cause).lower()
+    return "previous response" in message and "not found" in message
+
+
 def send_to_ai(
     prompt,
     user_id,
     attachements=None,
     previous_response_id=None,
+    session_id=None,
+    pending_tool_call=None,
 ):
     """Send messages to OpenAI chat endpoint and dispatch to text/image handler."""
-    system = {"role": "developer", "content": st.secrets["SYSTEM_PROMPT"]}
+    tools = image_tools(user_id)
+    instructions = st.secrets["SYSTEM_PROMPT"]
+    if not tools:
+        instructions += "\n\n" + QUOTA_NOTE
+    system = {"role": "developer", "content": instructions}
     user_msg = {
         "role": "user",
         "content": [
@@ -78,20 +187,61 @@ def send_to_ai(
     }
 
     if attachements:
+        # Stored attachments (attachments.store) go by OpenAI file id
         for attachement in attachements:
             user_msg["content"].append(
-                {
-                    "type": "input_image",
-                    "image_url": f"data:image/jpeg;base64,{base64.b64encode(attachement.read()).decode("utf-8")}",
-                }
+                attachments.input_image(get_client(), attachement, user_id, session_id)
             )
 
     messages = [system, user_msg]
+    if pending_tool_call and previous_response_id:
+        # The previous response ended in a generate_image call; report its result
+        messages.insert(
+            0,
+            {
+                "type": "function_call_output",
+                "call_id": pending_tool_call,
+                "output": "The image was generated and shown to the user.",
+            },
+        )
+
+    model = st.secrets["MODEL_CHAT"]
+
+    def create(timeout, previous_response_id=previous_response_id, messages=messages):
+        return get_client().responses.create(
+            model=model,
+            input=messages,
+            previous_response_id=previous_response_id,
+            tools=tools,
+            # At most one generate_image call per response: only one call
+            # id is kept as pending_tool_call and answered next turn
+            **({"parallel_tool_calls": False} if tools else {}),
+            timeout=timeout,
+        )
+
+    # A retried built-in image call would generate (and bill) another image
+    idempotent = not any(tool["type"] == "image_generation" for tool in tools)
+    with admit(user_id, model), timer("ai.chat"), metered(
+        user_id, session_id, "chat", model
+    ) as usage:
+        try:
+            res = resilience.call("chat", create, idempotent=idempotent)
+        except resilience.RequestRejected as e:
+            if not previous_response_id or not _thread_expired(e):
+                raise
+            # OpenAI keeps responses for about 30 days; an older thread is gone,
+            # so the session starts a new one instead of failing on every turn
+            if session_id:
+                db.reset_session_thread(user_id, session_id)
+            res = resilience.call(
+                "chat",
+                lambda timeout: create(timeout, None, [system, user_msg]),
+                idempotent=idempotent,
+            )
+        if res.usage:
+            usage["input_tokens"] = res.usage.input_tokens
+            usage["output_tokens"] = res.usage.output_tokens
+        if any(item.type == "image_generation_call" for item in res.output):
+            usage["image_count"], usage["image_size"] = 1, IMAGE_SIZE
 
-    res = client.responses.create(
-        model=st.secrets["MODEL_CHAT"],
-        input=messages,
-        previous_response_id=previous_response_id,
-    )
-
-    return handle_response(res.output_text, res.id, user_id)
+    return handle_response(res, user_id, session_id)
@@ -0,0 +1,106 @@
+import os
+import re
+import shutil
+import mimetypes
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote, urlsplit
+
+import streamlit as st
+
+IMAGES_DIR = os.environ.get("ORIGAMI_IMAGES_DIR", "images")
+# Only generated images, saved under a random uuid4 name, are served: the name
+# is the access check, since the endpoint has no login. Uploaded attachments
+# are named by their content hash, which anyone holding the file can compute,
+# so they keep going through Streamlit.
+SERVED_NAME = re.compile(r"[0-9a-f]{32}\.png")
+# A served file keeps its pixels for good, but recompression (image_store.py)
+# rewrites its bytes in place, so it is not marked immutable; the ETag changes
+CACHE_CONTROL = "public, max-age=31536000"
+
+
+class ImageRequestHandler(BaseHTTPRequestHandler):
+    """Serve generated images below IMAGES_DIR with ETags and long-lived cache headers."""
+
+    server_version = "OrigamiImages/1.0"
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body: bool):
+        root = os.path.abspath(IMAGES_DIR)
+        rel_path = unquote(urlsplit(self.path).path).lstrip("/")
+        path = os.path.abspath(os.path.join(root, rel_path))
+
+        # Refuse anything that escapes the image folder or is not a generated image
+        if (
+            os.path.commonpath([root, path]) != root
+            or not SERVED_NAME.fullmatch(os.path.basename(path))
+            or not os.path.isfile(path)
+        ):
+            self.send_error(404)
+            return
+
+        stat = os.stat(path)
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        if etag in self.headers.get("If-None-Match", ""):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", CACHE_CONTROL)
+            self.end_headers()
+            return
+
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(stat.st_size))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(stat.st_mtime, usegmt=True))
+        self.send_header("Cache-Control", CACHE_CONTROL)
+        self.end_headers()
+        if send_body:
+            with open(path, "rb") as f:
+                shutil.copyfileobj(f, self.wfile)
+
+    def log_message(self, format, *args):
+        # Keep per-request logging out of the Streamlit console
+        pass
+
+
+@st.cache_resource
+def start_image_server(host: str, port: int) -> ThreadingHTTPServer | None:
+    """Start the image endpoint once per process, in a daemon thread."""
+    try:
+        server = ThreadingHTTPServer((host, port), ImageRequestHandler)
+    except OSError:
+        # Port already taken, e.g. by another app process serving the same folder
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def image_url(path: str) -> str:
+    """
+    Return what the browser should load for a stored image.
+    With IMAGE_BASE_URL configured this is a cacheable URL on the image endpoint;
+    otherwise the local path is returned and Streamlit inlines the bytes.
+    """
+    base_url = st.secrets.get("IMAGE_BASE_URL")
+    if not base_url or not path:
+        return path
+
+    start_image_server(
+        # Loopback by default; expose it through the proxy serving IMAGE_BASE_URL
+        st.secrets.get("IMAGE_SERVER_HOST", "127.0.0.1"),
+        int(st.secrets.get("IMAGE_SERVER_PORT", 8502)),
+    )
+    rel_path = os.path.relpath(os.path.abspath(path), os.path.abspath(IMAGES_DIR))
+    if rel_path.startswith("..") or not SERVED_NAME.fullmatch(os.path.basename(path)):
+        # Not a generated image in the store, let Streamlit serve it as before
+        return path
+    return f"{base_url.rstrip('/')}/{quote(rel_path.replace(os.sep, '/'))}"
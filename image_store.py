@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import archive
+import db
+from image_server import IMAGES_DIR
+from shared import temp_path
+
+# Images older than this are recompressed to an optimized PNG in place. The
+# pixels and the file name stay the same, so message URLs and cached copies
+# remain valid.
+RECOMPRESS_AFTER_DAYS = int(os.environ.get("ORIGAMI_IMAGE_RECOMPRESS_DAYS", 30))
+RECOMPRESS_WORKERS = 2
+# Files younger than this are never swept: their message may not be saved yet
+ORPHAN_GRACE_S = 60 * 60
+
+_pool = None
+_pool_lock = threading.Lock()
+_pending: set[str] = set()
+# Scan or sweep pass -> user folder it resumes at after running out of time
+_resume_at: dict[str, str] = {}
+
+
+def record_image(path: str, user_id: str):
+    """Start accounting for a newly written image file."""
+    db.record_image_files([(path, user_id, os.path.getsize(path), None)])
+
+
+def over_quota(user_id: str, quota_mb: float) -> bool:
+    """Whether the user's stored images already use their quota."""
+    return db.get_user_image_bytes(user_id) >= quota_mb * 2**20
+
+
+def _image_files(task: str | None = None, deadline: float | None = None):
+    """
+    Yield (path, user_id) for the files in the image folder, one user folder
+    at a time in name order. Once `deadline` (time.monotonic()) passes this
+    stops and remembers the folder, so the next pass for `task` resumes there
+    instead of starting over.
+    """
+    if not os.path.isdir(IMAGES_DIR):
+        return
+    users = sorted(
+        user_id
+        for user_id in os.listdir(IMAGES_DIR)
+        if not user_id.startswith(".")
+        and os.path.isdir(os.path.join(IMAGES_DIR, user_id))
+    )
+    start = _resume_at.pop(task, "")
+    for user_id in (u for u in users if u >= start):
+        folder = os.path.join(IMAGES_DIR, user_id)
+        for fname in os.listdir(folder):
+            if deadline is not None and time.monotonic() > deadline:
+                _resume_at[task] = user_id
+                return
+            if not fname.startswith(".") and not fname.endswith(".tmp"):
+                yield os.path.join(folder, fname), user_id
+
+
+def unfinished(task: str) -> bool:
+    """Whether the last scan or sweep pass stopped at its deadline."""
+    return task in _resume_at
+
+
+def scan_untracked(deadline: float | None = None) -> int:
+    """Start accounting for image files written before tracking existed; return how many."""
+    tracked = db.get_tracked_image_paths()
+    files = []
+    for path, user_id in _image_files("scan", deadline):
+        if path not in tracked:
+            stat = os.stat(path)
+            created_at = datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+            files.append(
+                (path, user_id, stat.st_size, created_at.strftime("%Y-%m-%d %H:%M:%S"))
+            )
+    if files:
+        db.record_image_files(files)
+    return len(files)
+
+
+class SweepRefused(Exception):
+    """No message references a file in the image folder, so nothing was deleted."""
+
+
+def sweep_orphans(dry_run: bool = False, deadline: float | None = None) -> tuple[int, int]:
+    """
+    Delete image files no message references, in chat.db or the archives,
+    and stop tracking files that are gone. Return (files, bytes) removed.
+    """
+    # Messages may store the path relative to another working directory or
+    # IMAGES_DIR spelled differently, so both sides are compared resolved
+    referenced = {
+        os.path.realpath(url)
+        for url in db.get_referenced_image_urls() | archive.list_urls()
+    }
+    root = os.path.realpath(IMAGES_DIR) + os.sep
+    if not any(path.startswith(root) for path in referenced) and any(_image_files()):
+        # Far more likely a path mismatch than a folder of nothing but orphans
+        raise SweepRefused(f"no message references a file in {IMAGES_DIR}")
+    cutoff = time.time() - ORPHAN_GRACE_S
+    removed, removed_bytes, swept_users = [], 0, set()
+    for path, user_id in _image_files("sweep", deadline):
+        swept_users.add(user_id)
+        stat = os.stat(path)
+        if os.path.realpath(path) in referenced or stat.st_mtime > cutoff:
+            continue
+        if not dry_run:
+            os.remove(path)
+        removed.append(path)
+        removed_bytes += stat.st_size
+    if not dry_run:
+        missing = [
+            p
+            for p in db.get_tracked_image_paths()
+            if os.path.basename(os.path.dirname(p)) in swept_users and not os.path.exists(p)
+        ]
+        db.forget_image_files(removed + missing)
+    return len(removed), removed_bytes
+
+
+def _recompress(path: str):
+    from PIL import Image
+
+    try:
+        tmp_path = temp_path(path)
+        with Image.open(path) as image:
+            image.save(tmp_path, format="PNG", optimize=True)
+        if os.path.getsize(tmp_path) < os.path.getsize(path):
+            os.replace(tmp_path, path)
+        else:
+            os.remove(tmp_path)
+        db.mark_image_recompressed(path, os.path.getsize(path))
+    except FileNotFoundError:
+        db.forget_image_files([path])
+    finally:
+        with _pool_lock:
+            _pending.discard(path)
+
+
+def recompress_cold(limit: int = 200) -> int:
+    """Queue up to `limit` cold images for recompression in the background pool."""
+    global _pool
+    paths = db.get_cold_image_files(RECOMPRESS_AFTER_DAYS, limit)
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                RECOMPRESS_WORKERS, thread_name_prefix="image-recompress"
+            )
+        queued = [p for p in paths if p not in _pending]
+        _pending.update(queued)
+    for path in queued:
+        _pool.submit(_recompress, path)
+    return len(queued)
@@ -0,0 +1,328 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import streamlit as st
+
+import db
+import image_store
+from shared import file_lock
+
+# Seconds between runs of each task when the scheduler is on
+TASK_INTERVALS_S = {
+    "checkpoint": 5 * 60,
+    "aggregates": 5 * 60,
+    "optimize": 60 * 60,
+    "compress": 60 * 60,
+    "incremental_vacuum": 60 * 60,
+    "integrity_check": 24 * 60 * 60,
+    "archive": 24 * 60 * 60,
+    "images": 24 * 60 * 60,
+}
+# Wall-time budget per task run; work still pending is picked up next run
+TASK_BUDGETS_S = {
+    "checkpoint": 1.0,
+    "aggregates": 2.0,
+    "optimize": 2.0,
+    "compress": 2.0,
+    "incremental_vacuum": 1.0,
+    "integrity_check": 5.0,
+    "archive": 10.0,
+    "images": 30.0,
+}
+# Message ids folded per aggregates step, each its own short write transaction
+AGGREGATE_STEP_ROWS = 50_000
+# Sessions moved per archive step; each step holds the chat connection's lock briefly
+ARCHIVE_STEP_SESSIONS = 50
+# Messages looked at per compress step
+COMPRESS_STEP_ROWS = 500
+# Pages released per incremental_vacuum step, each step is its own short transaction
+VACUUM_STEP_PAGES = 256
+# Rows sampled per index by ANALYZE, so statistics stay cheap on a large chat.db
+ANALYSIS_LIMIT = 1000
+SCHEDULER_TICK_S = 60
+
+_run_lock = threading.Lock()
+
+
+class BudgetExceeded(Exception):
+    """A maintenance task ran out of its time budget before finishing."""
+
+
+def _connect() -> sqlite3.Connection:
+    """Maintenance uses its own connection so it never holds the chat connection's lock."""
+    db.init_db()
+    conn = sqlite3.connect(db.DB_PATH, timeout=0.1, check_same_thread=False)
+    conn.isolation_level = None  # autocommit: each step is its own short transaction
+    return conn
+
+
+@contextmanager
+def _time_budget(conn: sqlite3.Connection, seconds: float):
+    """Interrupt any statement still running after `seconds`."""
+    deadline = time.monotonic() + seconds
+    conn.set_progress_handler(lambda: time.monotonic() > deadline, 1000)
+    try:
+        yield deadline
+    except sqlite3.OperationalError as e:
+        if "interrupted" in str(e):
+            raise BudgetExceeded from e
+        raise
+    finally:
+        conn.set_progress_handler(None, 0)
+
+
+def _optimize(conn: sqlite3.Connection, budget: float) -> str:
+    with _time_budget(conn, budget):
+        conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+        has_stats = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+        ).fetchone()
+        if not has_stats:
+            conn.execute("ANALYZE")
+            return "initial ANALYZE"
+        # 0x10002: analyze every table whose statistics look stale
+        conn.execute("PRAGMA optimize = 0x10002")
+        return "PRAGMA optimize"
+
+
+def _incremental_vacuum(conn: sqlite3.Connection, budget: float) -> str:
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return "skipped: auto_vacuum is not INCREMENTAL"
+    freed = 0
+    with _time_budget(conn, budget) as deadline:
+        while time.monotonic() < deadline:
+            free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free_pages:
+                break
+            step = min(free_pages, VACUUM_STEP_PAGES)
+            conn.execute(f"PRAGMA incremental_vacuum({step})").fetchall()
+            freed += step
+    remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return f"released {freed} pages, {remaining} still free"
+
+
+def _checkpoint(conn: sqlite3.Connection, budget: float) -> str:
+    # PASSIVE copies what it can without waiting on readers or writers; the WAL
+    # file itself is cut back to journal_size_limit when SQLite next resets it
+    busy, wal_pages, done = conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+    if wal_pages < 0:
+        return "skipped: database is not in WAL mode"
+    return f"{done}/{wal_pages} WAL frames checkpointed" + (", busy" if busy else "")
+
+
+def _integrity_check(conn: sqlite3.Connection, budget: float) -> str:
+    with _time_budget(conn, budget):
+        problems = [row[0] for row in conn.execute("PRAGMA quick_check(20)")]
+    if problems != ["ok"]:
+        raise sqlite3.DatabaseError("; ".join(problems))
+    return "ok"
+
+
+def _aggregates(conn: sqlite3.Connection, budget: float) -> str:
+    # Goes through db.py, which releases the chat connection between steps
+    deadline = time.monotonic() + budget
+    folded, more = 0, True
+    while more and time.monotonic() < deadline:
+        step = db.refresh_aggregates(AGGREGATE_STEP_ROWS)
+        folded += step
+        more = step == AGGREGATE_STEP_ROWS
+    return f"folded {folded} message ids" + (", more pending" if more else "")
+
+
+def _archive(conn: sqlite3.Connection, budget: float) -> str:
+    # Goes through db.py: archival changes chat.db's own tables under its lock
+    deadline = time.monotonic() + budget
+    moved, more = 0, True
+    while more and time.monotonic() < deadline:
+        step = db.archive_cold_sessions(max_sessions=ARCHIVE_STEP_SESSIONS)
+        moved += step
+        more = step == ARCHIVE_STEP_SESSIONS
+    return f"archived {moved} sessions" + (", more pending" if more else "")
+
+
+def _compress(conn: sqlite3.Connection, budget: float) -> str:
+    # Compresses content saved before compression was on (or below a lower
+    # threshold); the pages this frees are released by incremental_vacuum
+    deadline = time.monotonic() + budget
+    compressed, saved, more = 0, 0, True
+    while more and time.monotonic() < deadline:
+        scanned, rows, size = db.compress_stored_content(COMPRESS_STEP_ROWS)
+        compressed += rows
+        saved += size
+        more = scanned == COMPRESS_STEP_ROWS
+    return f"compressed {compressed} messages, saved {saved / 2**20:.1f} MB" + (
+        ", more pending" if more else ""
+    )
+
+
+def _images(conn: sqlite3.Connection, budget: float) -> str:
+    # File work only; recompression continues in image_store's background pool.
+    # Scan and sweep each get half the budget and resume where they stopped.
+    started = time.monotonic()
+    tracked = image_store.scan_untracked(deadline=started + budget / 2)
+    try:
+        files, size = image_store.sweep_orphans(deadline=started + budget)
+        swept = f"swept {files} orphans ({size / 2**20:.1f} MB)"
+    except image_store.SweepRefused as e:
+        swept = f"sweep refused: {e}"
+    queued = image_store.recompress_cold()
+    more = image_store.unfinished("scan") or image_store.unfinished("sweep")
+    return f"tracked {tracked} new files, {swept}, queued {queued} for recompression" + (
+        ", more pending" if more else ""
+    )
+
+
+TASKS = {
+    "checkpoint": _checkpoint,
+    "aggregates": _aggregates,
+    "optimize": _optimize,
+    "compress": _compress,
+    "incremental_vacuum": _incremental_vacuum,
+    "integrity_check": _integrity_check,
+    "archive": _archive,
+    "images": _images,
+}
+
+
+def run_task(task: str, conn: sqlite3.Connection | None = None) -> tuple[str, str]:
+    """Run one maintenance task within its budget, log it, and return (outcome, detail)."""
+    own_conn = conn is None
+    conn = conn or _connect()
+    started_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    started = time.perf_counter()
+    try:
+        outcome, detail = "ok", TASKS[task](conn, TASK_BUDGETS_S[task])
+    except BudgetExceeded:
+        outcome, detail = "timeout", f"stopped after {TASK_BUDGETS_S[task]}s budget"
+    except sqlite3.OperationalError as e:
+        # "database is locked": a chat write held the lock, try again next run
+        outcome, detail = "busy" if "locked" in str(e) else "error", str(e)
+    except sqlite3.DatabaseError as e:
+        outcome, detail = "error", str(e)
+    except Exception as e:
+        # File work (archives, images) can fail too; it must not stop other tasks
+        outcome, detail = "error", f"{type(e).__name__}: {e}"
+    duration_ms = (time.perf_counter() - started) * 1000
+    try:
+        conn.execute(
+            """
+            INSERT INTO maintenance_log(task, started_at, duration_ms, outcome, detail)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (task, started_at, round(duration_ms, 1), outcome, detail),
+        )
+    except sqlite3.OperationalError:
+        pass  # losing a log row is better than waiting on the write lock
+    if own_conn:
+        conn.close()
+    return outcome, detail
+
+
+def run_maintenance(tasks: list[str] | None = None) -> dict[str, tuple[str, str]] | None:
+    """
+    Run the given tasks (default: all) in order; None if another run is in
+    progress, in this process or in another app process on the same database.
+    """
+    if not _run_lock.acquire(blocking=False):
+        return None
+    try:
+        with file_lock("maintenance", blocking=False) as acquired:
+            if not acquired:
+                return None
+            conn = _connect()
+            try:
+                return {task: run_task(task, conn) for task in tasks or TASKS}
+            finally:
+                conn.close()
+    finally:
+        _run_lock.release()
+
+
+def last_runs() -> dict[str, tuple[str, float, str, str]]:
+    """Get {task: (started_at, duration_ms, outcome, detail)} for each task's latest run."""
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            """
+            SELECT task, started_at, duration_ms, outcome, detail
+            FROM maintenance_log
+            WHERE id IN (SELECT MAX(id) FROM maintenance_log GROUP BY task)
+            """
+        ).fetchall()
+    finally:
+        conn.close()
+    return {task: rest for task, *rest in rows}
+
+
+def database_stats() -> dict:
+    """Report file sizes, free pages and the storage modes of the database."""
+    conn = _connect()
+    try:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    finally:
+        conn.close()
+    wal_path = db.DB_PATH + "-wal"
+    return {
+        "db_bytes": page_size * page_count,
+        "wal_bytes": os.path.getsize(wal_path) if os.path.exists(wal_path) else 0,
+        "page_count": page_count,
+        "free_pages": freelist,
+        "fragmentation": freelist / page_count if page_count else 0.0,
+        "auto_vacuum": {0: "NONE", 1: "FULL", 2: "INCREMENTAL"}.get(auto_vacuum, "?"),
+        "journal_mode": journal_mode.upper(),
+    }
+
+
+def enable_incremental_vacuum():
+    """
+    Switch an existing database to auto_vacuum=INCREMENTAL.
+    This needs one full VACUUM, which blocks writers while it rewrites the file,
+    so it only runs on an explicit admin request.
+    """
+    with _run_lock, file_lock("maintenance"):
+        conn = _connect()
+        conn.execute("PRAGMA busy_timeout = 5000")
+        try:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+
+
+def _scheduler_loop():
+    while True:
+        try:
+            # Read from the log each tick, so runs by other app processes count
+            last_started = {
+                task: datetime.strptime(started_at, "%Y-%m-%d %H:%M:%S")
+                .replace(tzinfo=timezone.utc)
+                .timestamp()
+                for task, (started_at, *_rest) in last_runs().items()
+            }
+            now = time.time()
+            due = [
+                task
+                for task, interval in TASK_INTERVALS_S.items()
+                if now - last_started.get(task, 0) >= interval
+            ]
+            if due:
+                run_maintenance(due)
+        except Exception:
+            pass  # each task already logs its own failures; keep the scheduler alive
+        time.sleep(SCHEDULER_TICK_S)
+
+
+@st.cache_resource
+def start_scheduler() -> threading.Thread:
+    """Start the maintenance scheduler once per process, in a daemon thread."""
+    thread = threading.Thread(target=_scheduler_loop, daemon=True, name="db-maintenance")
+    thread.start()
+    return thread
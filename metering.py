@@ -0,0 +1,122 @@
+import atexit
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from db import save_api_calls
+
+# A batch is written when it reaches BATCH_SIZE calls or FLUSH_INTERVAL_S seconds
+BATCH_SIZE = 50
+FLUSH_INTERVAL_S = 5.0
+
+_buffer: list[dict] = []
+_lock = threading.Lock()
+_flusher = None
+
+
+def record_call(
+    user_id: str,
+    session_id: str | None,
+    kind: str,
+    model: str,
+    duration_ms: float,
+    outcome: str = "ok",
+    input_tokens: int = 0,
+    output_tokens: int = 0,
+    image_count: int = 0,
+    image_size: str = "",
+):
+    """Queue one API call for the metering table; this never touches the database."""
+    call = {
+        "user_id": user_id,
+        "session_id": session_id,
+        "kind": kind,
+        "model": model,
+        "input_tokens": input_tokens or 0,
+        "output_tokens": output_tokens or 0,
+        "image_count": image_count,
+        "image_size": image_size,
+        "duration_ms": round(duration_ms, 1),
+        "outcome": outcome,
+        "ts": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    with _lock:
+        _buffer.append(call)
+        full = len(_buffer) >= BATCH_SIZE
+    _ensure_flusher()
+    if full:
+        flush()
+
+
+def flush():
+    """Write all queued calls in one transaction."""
+    global _buffer
+    with _lock:
+        batch, _buffer = _buffer, []
+    if batch:
+        save_api_calls(batch)
+
+
+@contextmanager
+def metered(user_id: str, session_id: str | None, kind: str, model: str, **fields):
+    """
+    Time an API call and record it when the block exits.
+    The yielded dict can be filled with token counts once the response is in.
+    """
+    usage = dict(fields)
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield usage
+    except Exception as e:
+        outcome = f"error:{type(e).__name__}"
+        raise
+    finally:
+        record_call(
+            user_id,
+            session_id,
+            kind,
+            model,
+            (time.perf_counter() - started) * 1000,
+            outcome,
+            **usage,
+        )
+
+
+def estimate_cost(
+    pricing: dict, model: str, input_tokens: int, output_tokens: int, images: int
+) -> float:
+    """
+    Cost in dollars from a pricing table shaped like
+    {model: {"input_per_1m": ..., "output_per_1m": ..., "per_image": ...}}.
+    Models without a price count as free.
+    """
+    price = pricing.get(model, {})
+    return (
+        input_tokens * price.get("input_per_1m", 0) / 1_000_000
+        + output_tokens * price.get("output_per_1m", 0) / 1_000_000
+        + images * price.get("per_image", 0)
+    )
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(FLUSH_INTERVAL_S)
+        try:
+            flush()
+        except Exception:
+            # Metering must never take down the app; the next flush retries new calls
+            pass
+
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is None:
+        with _lock:
+            if _flusher is None:
+                _flusher = threading.Thread(target=_flush_periodically, daemon=True)
+                _flusher.start()
+
+
+atexit.register(flush)
@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from uuid import uuid4
+
+# Instrumentation is off unless a metrics port or a trace file is configured.
+# When off, timed() returns the function untouched and timer() does nothing.
+METRICS_PORT = os.environ.get("ORIGAMI_METRICS_PORT")
+TRACE_FILE = os.environ.get("ORIGAMI_TRACE_FILE")
+ENABLED = bool(METRICS_PORT or TRACE_FILE)
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_trace_id: ContextVar[str | None] = ContextVar("trace_id", default=None)
+_lock = threading.Lock()
+_histograms: dict[tuple[str, str], "Histogram"] = {}
+_trace_fh = None
+_server = None
+
+
+class Histogram:
+    """Cumulative latency histogram in the Prometheus bucket layout."""
+
+    def __init__(self):
+        self.bucket_counts = [0] * (len(BUCKETS) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.bucket_counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile as the upper bound of the bucket it falls in."""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for bound, bucket_count in zip(BUCKETS + (float("inf"),), self.bucket_counts):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+def current_trace_id() -> str | None:
+    """Return the trace id of the request being handled on this thread, if any."""
+    return _trace_id.get()
+
+
+def observe(stage: str, seconds: float, outcome: str = "ok"):
+    """Record one duration for a stage and append it to the trace file if enabled."""
+    if not ENABLED:
+        return
+    _ensure_exporters()
+    with _lock:
+        histogram = _histograms.get((stage, outcome))
+        if histogram is None:
+            histogram = _histograms[(stage, outcome)] = Histogram()
+        histogram.observe(seconds)
+        if _trace_fh:
+            record = {
+                "ts": time.time(),
+                "trace_id": _trace_id.get(),
+                "stage": stage,
+                "duration_ms": round(seconds * 1000, 3),
+                "outcome": outcome,
+            }
+            _trace_fh.write(json.dumps(record) + "\n")
+
+
+@contextmanager
+def timer(stage: str):
+    """Time the enclosed block as `stage`; exceptions are recorded as outcome=error."""
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except Exception:
+        outcome = "error"
+        raise
+    except BaseException:
+        # Streamlit's st.rerun()/st.stop() unwind with BaseException subclasses
+        outcome = "interrupted"
+        raise
+    finally:
+        observe(stage, time.perf_counter() - start, outcome)
+
+
+@contextmanager
+def trace(stage: str):
+    """Start a new request-scoped trace id and time the enclosed block as `stage`."""
+    token = _trace_id.set(uuid4().hex[:16])
+    try:
+        with timer(stage):
+            yield
+    finally:
+        _trace_id.reset(token)
+
+
+def timed(stage: str, new_trace: bool = False):
+    """Decorator form of timer() (or trace() with new_trace=True); a no-op when disabled."""
+
+    def decorator(fn):
+        if not ENABLED:
+            return fn
+        wrap = trace if new_trace else timer
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with wrap(stage):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def snapshot() -> dict[tuple[str, str], Histogram]:
+    """Return a copy of the current histograms keyed by (stage, outcome)."""
+    with _lock:
+        copies = {}
+        for key, histogram in _histograms.items():
+            copy = Histogram()
+            copy.bucket_counts = list(histogram.bucket_counts)
+            copy.count, copy.sum = histogram.count, histogram.sum
+            copies[key] = copy
+        return copies
+
+
+def render_prometheus() -> str:
+    """Render all histograms in the Prometheus text exposition format."""
+    name = "origami_stage_duration_seconds"
+    lines = [
+        f"# HELP {name} Latency of instrumented request stages.",
+        f"# TYPE {name} histogram",
+    ]
+    for (stage, outcome), histogram in sorted(snapshot().items()):
+        labels = f'stage="{stage}",outcome="{outcome}"'
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS, histogram.bucket_counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+        lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+        lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Expose render_prometheus() at /metrics."""
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _ensure_exporters():
+    """Open the trace file and start the metrics endpoint on first use."""
+    global _trace_fh, _server
+    if _trace_fh is not None or _server is not None:
+        return
+    with _lock:
+        if TRACE_FILE and _trace_fh is None:
+            _trace_fh = open(TRACE_FILE, "a", buffering=1, encoding="utf-8")
+        if METRICS_PORT and _server is None:
+            try:
+                _server = ThreadingHTTPServer(
+                    ("127.0.0.1", int(METRICS_PORT)), MetricsRequestHandler
+                )
+            except OSError:
+                # Another process on this host already exposes the endpoint
+                _server = False
+                return
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
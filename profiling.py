@@ -0,0 +1,180 @@
+import os
+import cProfile
+import pstats
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+
+import db
+
+# Profiles are only captured for users an admin has armed; every other rerun
+# gets a nullcontext after one dict lookup. Arming lives in chat.db so every
+# app process sees it; each process re-reads it once per ARMED_CHECK_S.
+PROFILES_DIR = os.environ.get("ORIGAMI_PROFILES_DIR", "profiles")
+PAGES = ("show_app", "show_admin_portal")
+ARMED_CHECK_S = 2.0
+
+_lock = threading.Lock()
+# From Python 3.12 cProfile uses sys.monitoring, which allows one profiler per
+# process (a second enable() raises ValueError) and sees every thread. One
+# capture runs at a time; an armed rerun that finds it busy is not profiled
+# and keeps its run for later.
+_capture_lock = threading.Lock()
+_armed: dict[str, dict] = {}
+_checked_at = 0.0
+
+
+def _refresh(force: bool = False):
+    global _armed, _checked_at
+    now = time.monotonic()
+    if force or now - _checked_at >= ARMED_CHECK_S:
+        with _lock:
+            _armed = db.get_profiling_armed()
+            _checked_at = now
+
+
+def arm(user_id: str, runs: int, page: str | None = None):
+    """Profile the next `runs` reruns of `page` (or any page) for this user."""
+    db.arm_profiling(user_id, runs, page)
+    _refresh(force=True)
+
+
+def disarm(user_id: str):
+    db.disarm_profiling(user_id)
+    _refresh(force=True)
+
+
+def armed() -> dict[str, dict]:
+    """Return {user_id: {"page", "remaining"}} for every armed user."""
+    _refresh(force=True)
+    return {user_id: dict(state) for user_id, state in _armed.items()}
+
+
+def profiled(user_id: str, page: str):
+    """Context manager that profiles this rerun if an admin armed it, else does nothing."""
+    _refresh()
+    if user_id not in _armed:
+        return nullcontext()
+    state = _armed[user_id]
+    if state["page"] not in (None, page) or not _capture_lock.acquire(blocking=False):
+        return nullcontext()
+    claimed = False
+    try:
+        claimed = db.claim_profiling_run(user_id, page)
+    finally:
+        if not claimed:
+            _capture_lock.release()
+    if not claimed:
+        return nullcontext()
+    _refresh(force=True)
+    return _profile_run(user_id, page)
+
+
+@contextmanager
+def _profile_run(user_id: str, page: str):
+    # Holds _capture_lock, taken by profiled()
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler (a debugger, a manual cProfile run) owns the process
+        _capture_lock.release()
+        yield
+        return
+    try:
+        yield
+    finally:
+        # Also runs when st.rerun()/st.stop() unwind the script
+        profiler.disable()
+        _capture_lock.release()
+        folder = os.path.join(PROFILES_DIR, user_id)
+        os.makedirs(folder, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S-%f")
+        profiler.dump_stats(os.path.join(folder, f"{stamp}_{page}.prof"))
+
+
+def list_profiles(user_id: str | None = None) -> list[tuple[str, str, str, datetime]]:
+    """Get (path, user_id, page, captured_at) for stored profiles, newest first."""
+    if not os.path.isdir(PROFILES_DIR):
+        return []
+    users = [user_id] if user_id else sorted(os.listdir(PROFILES_DIR))
+    profiles = []
+    for user in users:
+        folder = os.path.join(PROFILES_DIR, user)
+        if not os.path.isdir(folder):
+            continue
+        for fname in os.listdir(folder):
+            if not fname.endswith(".prof"):
+                continue
+            stamp, _, rest = fname.partition("_")
+            captured_at = datetime.strptime(stamp, "%Y%m%d-%H%M%S-%f")
+            profiles.append(
+                (os.path.join(folder, fname), user, rest[: -len(".prof")], captured_at)
+            )
+    return sorted(profiles, key=lambda p: p[3], reverse=True)
+
+
+def _label(func: tuple[str, int, str]) -> str:
+    filename, line, name = func
+    if filename == "~":
+        return name  # built-in, e.g. <built-in method time.sleep>
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def top_functions(path: str, limit: int = 25, sort: str = "cumulative") -> list[dict]:
+    """Return the heaviest functions of a stored profile by cumulative or own time."""
+    stats = pstats.Stats(path).stats
+    key = 3 if sort == "cumulative" else 2
+    rows = sorted(stats.items(), key=lambda item: item[1][key], reverse=True)
+    return [
+        {
+            "Function": _label(func),
+            "Calls": nc,
+            "Own time (s)": round(tt, 4),
+            "Cumulative (s)": round(ct, 4),
+        }
+        for func, (cc, nc, tt, ct, callers) in rows[:limit]
+    ]
+
+
+def call_tree(
+    path: str, max_depth: int = 12, min_share: float = 0.005
+) -> tuple[list[str], list[str], list[str], list[float]]:
+    """
+    Build an icicle/flamegraph tree (ids, labels, parents, values) from a profile.
+    cProfile keeps caller->callee edges rather than full stacks, so each child's
+    time is the cumulative time recorded on that edge; branches below
+    min_share of the total are dropped.
+    """
+    stats = pstats.Stats(path).stats
+    callees: dict[tuple, list[tuple[tuple, float]]] = {}
+    for func, (cc, nc, tt, ct, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+
+    roots = [(func, stat[3]) for func, stat in stats.items() if not stat[4]]
+    total = sum(ct for _, ct in roots) or 1.0
+    ids, labels, parents, values = [], [], [], []
+
+    def visit(func, seconds, parent_id, stack):
+        node_id = f"{parent_id}/{len(ids)}"
+        ids.append(node_id)
+        labels.append(_label(func))
+        parents.append(parent_id)
+        values.append(seconds)
+        if len(stack) >= max_depth:
+            return
+        children = sorted(callees.get(func, []), key=lambda c: c[1], reverse=True)
+        budget = seconds  # recursion can make edge times exceed the parent
+        for child, child_seconds in children:
+            child_seconds = min(child_seconds, budget)
+            if child in stack or child_seconds < total * min_share:
+                continue
+            budget -= child_seconds
+            visit(child, child_seconds, node_id, stack | {child})
+
+    for func, seconds in sorted(roots, key=lambda r: r[1], reverse=True):
+        if seconds >= total * min_share:
+            visit(func, seconds, "", {func})
+    return ids, labels, parents, values
@@ -0,0 +1,178 @@
+import random
+import threading
+import time
+from collections import deque
+
+from metrics import observe
+
+# Total time one step may take, across all of its attempts
+DEADLINES_S = {"chat": 60.0, "image": 120.0, "download": 30.0, "upload": 60.0}
+MAX_ATTEMPTS = 3
+BACKOFF_BASE_S = 0.5
+BACKOFF_MAX_S = 8.0
+# The breaker opens when at least BREAKER_MIN_CALLS of the last BREAKER_WINDOW
+# calls ended and BREAKER_FAILURE_RATIO of them failed upstream. After
+# BREAKER_COOLDOWN_S one probe call is let through; its outcome closes or
+# reopens the breaker.
+BREAKER_WINDOW = 20
+BREAKER_MIN_CALLS = 5
+BREAKER_FAILURE_RATIO = 0.5
+BREAKER_COOLDOWN_S = 30.0
+
+
+class UpstreamError(Exception):
+    """An AI step failed after its retries; the cause is chained."""
+
+
+class CircuitOpen(UpstreamError):
+    """The upstream is failing, so the call was refused without being sent."""
+
+
+class RequestRejected(Exception):
+    """The upstream answered that our request is invalid (a 4xx); the cause is chained."""
+
+
+class CircuitBreaker:
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._results: deque[bool] = deque(maxlen=BREAKER_WINDOW)
+        self._opened_at: float | None = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at < BREAKER_COOLDOWN_S:
+                return "open"
+            return "half-open"
+
+    def allow(self) -> bool:
+        """Whether a call may be sent now; in half-open state only one probe is."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < BREAKER_COOLDOWN_S or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record(self, ok: bool):
+        with self._lock:
+            if self._opened_at is not None:
+                if not self._probing:
+                    return  # a call admitted before the breaker opened
+                self._probing = False
+                if ok:
+                    self._opened_at = None
+                    self._results.clear()
+                else:
+                    self._opened_at = time.monotonic()
+                return
+            self._results.append(ok)
+            failures = self._results.count(False)
+            if (
+                len(self._results) >= BREAKER_MIN_CALLS
+                and failures / len(self._results) >= BREAKER_FAILURE_RATIO
+            ):
+                self._opened_at = time.monotonic()
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(upstream: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(upstream)
+        if breaker is None:
+            breaker = _breakers[upstream] = CircuitBreaker(upstream)
+        return breaker
+
+
+def breaker_states() -> dict[str, str]:
+    """Return {upstream: closed/open/half-open} for every breaker in use."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.state for breaker in breakers}
+
+
+def status_code(error: Exception) -> int | None:
+    """The HTTP status an upstream answered with, or None if it did not answer."""
+    import requests
+    from openai import APIStatusError
+
+    if isinstance(error, APIStatusError):
+        return error.status_code
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code
+    return None
+
+
+def classify(error: Exception) -> str:
+    """
+    Sort a failed attempt into timeout, connection, rate_limited or server
+    (upstream trouble, worth retrying) or client (our request is wrong).
+    """
+    import requests
+    from openai import APIConnectionError, APITimeoutError
+
+    if isinstance(error, (APITimeoutError, requests.Timeout)):
+        return "timeout"
+    if isinstance(error, (APIConnectionError, requests.ConnectionError)):
+        return "connection"
+    status = status_code(error)
+    if status is None:
+        return "client"
+    if status == 429:
+        return "rate_limited"
+    return "server" if status >= 500 or status == 408 else "client"
+
+
+def _backoff(attempt: int) -> float:
+    # Full jitter: spreads out retries from sessions that failed together
+    return random.uniform(0, min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2**attempt))
+
+
+def call(step: str, fn, *, idempotent: bool = True, upstream: str = "openai"):
+    """
+    Run fn(timeout=<seconds left>) for an AI step under its deadline, retrying
+    upstream failures with jittered exponential backoff, behind the upstream's
+    circuit breaker. Steps that are not idempotent (each attempt may be billed
+    again) are only retried when the upstream refused the request outright.
+    Raise UpstreamError when the step gives up, RequestRejected when the
+    upstream turned the request down as invalid.
+    """
+    breaker = get_breaker(upstream)
+    deadline = time.monotonic() + DEADLINES_S[step]
+    for attempt in range(MAX_ATTEMPTS):
+        if not breaker.allow():
+            observe(f"resilience.{step}", 0.0, "circuit_open")
+            raise CircuitOpen(f"{upstream} is unavailable, not sending {step}")
+        started = time.monotonic()
+        try:
+            result = fn(timeout=max(deadline - started, 0.1))
+        except Exception as e:
+            kind = classify(e)
+            observe(f"resilience.{step}", time.monotonic() - started, kind)
+            if kind == "client":
+                breaker.record(True)  # the upstream answered; the request was wrong
+                if status_code(e) is None:
+                    raise  # not an upstream answer, a bug on our side
+                raise RequestRejected(f"{step} was rejected: {e}") from e
+            breaker.record(False)
+            retryable = idempotent or kind in ("rate_limited", "connection")
+            pause = _backoff(attempt)
+            if (
+                not retryable
+                or attempt == MAX_ATTEMPTS - 1
+                or time.monotonic() + pause >= deadline
+            ):
+                raise UpstreamError(f"{step} failed: {kind}") from e
+            time.sleep(pause)
+            continue
+        observe(f"resilience.{step}", time.monotonic() - started, "ok")
+        breaker.record(True)
+        return result
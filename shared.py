@@ -0,0 +1,70 @@
+import os
+import time
+from contextlib import contextmanager
+from uuid import uuid4
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single app process is supported there
+    fcntl = None
+
+# Several app processes (replicas) can share one chat.db and image folder on
+# the same host. These helpers coordinate them: advisory file locks for
+# one-at-a-time work, atomic file writes so no process ever reads a partial
+# file, and the replica count used to split process-wide limits.
+REPLICAS = max(1, int(os.environ.get("ORIGAMI_REPLICAS", 1)))
+LOCK_DIR = os.environ.get("ORIGAMI_LOCK_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(os.environ.get("ORIGAMI_DB_PATH") or __file__)),
+    ".locks",
+)
+
+
+@contextmanager
+def file_lock(name: str, blocking: bool = True):
+    """
+    Hold the host-wide lock `name` for the block. Yields False instead of
+    waiting when blocking is False and another process holds it.
+    """
+    if fcntl is None:
+        yield True
+        return
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    with open(os.path.join(LOCK_DIR, f"{name}.lock"), "a") as f:
+        flags = fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB)
+        try:
+            fcntl.flock(f, flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def temp_path(path: str) -> str:
+    """A scratch name beside `path` that no other process or thread will pick."""
+    return f"{path}.{os.getpid()}.{uuid4().hex[:8]}.tmp"
+
+
+def write_atomic(path: str, data: bytes):
+    """Write a file so readers in any process see either nothing or all of it."""
+    tmp_path = temp_path(path)
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def file_age(path: str) -> float | None:
+    """Seconds since `path` was last written, or None when it does not exist."""
+    try:
+        return time.time() - os.path.getmtime(path)
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,79 @@
+import hashlib
+import threading
+import time
+
+from metrics import observe
+
+# How long a finished turn's result is handed to repeats of the same submission
+RECENT_S = 10.0
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error", "finished_at")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.finished_at = None
+
+
+_lock = threading.Lock()
+_flights: dict[tuple, _Flight] = {}
+
+
+def turn_key(user_id: str, session_id: str, prompt: str, attachments=()) -> tuple:
+    """Identify one chat submission by user, session, prompt and attached files."""
+    files = hashlib.sha256()
+    for attachment in attachments or ():
+        files.update(hashlib.sha256(attachment.getvalue()).digest())
+    return (
+        user_id,
+        session_id,
+        hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+        files.hexdigest(),
+    )
+
+
+def _prune(now: float):
+    for key in [
+        k
+        for k, f in _flights.items()
+        if f.finished_at is not None and now - f.finished_at > RECENT_S
+    ]:
+        del _flights[key]
+
+
+def do(key: tuple, fn) -> tuple[object, bool]:
+    """
+    Run fn() once per key. Calls with the same key while it runs, or up to
+    RECENT_S after it succeeded, get its result instead of running fn again.
+    Return (result, shared); shared is True when another call produced it.
+    A failure is passed to the callers already waiting but not remembered.
+    """
+    with _lock:
+        _prune(time.monotonic())
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        started = time.monotonic()
+        flight.done.wait()
+        observe("ai.singleflight_wait", time.monotonic() - started, "shared")
+        if flight.error is not None:
+            raise flight.error
+        return flight.result, True
+
+    try:
+        flight.result = fn()
+    except BaseException as e:
+        flight.error = e
+        with _lock:
+            del _flights[key]
+        raise
+    finally:
+        flight.finished_at = time.monotonic()
+        flight.done.set()
+    return flight.result, False
@@ -1,6 +1,12 @@
 import streamlit as st
 from app.landing import show_landing
 from app.app import show_app
+from profiling import profiled
+from maintenance import start_scheduler
+
+# Background ANALYZE / vacuum / checkpoint runs; set MAINTENANCE_SCHEDULER = false to turn off
+if st.secrets.get("MAINTENANCE_SCHEDULER", True):
+    start_scheduler()
 
 # 1) If not logged in, show landing (calls st.login("auth0") and stops)
 if not st.experimental_user.is_logged_in:
@@ -17,8 +23,10 @@ if not st.experimental_user.get("email_verified", False):
 # 3) Check if accessing admin portal
 query_params = st.query_params
 if "admin" in query_params:
-    from app.admin import show_admin_portal
+    from app.admin import admin_reads, show_admin_portal
 
-    show_admin_portal()
+    with profiled(st.experimental_user["email"], "show_admin_portal"), admin_reads():
+        show_admin_portal()
 else:
-    show_app()
+    with profiled(st.experimental_user["email"], "show_app"):
+        show_app()